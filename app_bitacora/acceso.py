@@ -0,0 +1,93 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Limite de intentos de inicio de sesion. Se cuentan los fallos de cada nombre de usuario (exista o no) desde cada
+# IP y, pasados los intentos libres, cada intento duplica la espera: mientras dura iniciar_sesion responde 429 sin
+# llamar a authenticate, asi un ataque de credential stuffing no llega al hasher. El limite del usuario es por IP:
+# si fuera global, cualquiera podria dejar bloqueada una cuenta ajena fallando a proposito.
+# Los fallos de cada IP (con cualquier usuario) tambien se cuentan, pero ese limite solo se aplica a los intentos
+# que fallan: detras de un proxy o una NAT muchos usuarios comparten la IP, y los fallos de uno no pueden dejar
+# afuera a los demas. Los contadores vencen LOGIN_VENTANA segundos despues del primer fallo (los intentos
+# siguientes no los prolongan) y estan en el cache 'login', que es local a cada proceso: con N workers un
+# atacante tiene a lo sumo N veces los intentos
+
+def cache_login():
+    return caches['login']
+
+def ip_cliente(request):
+    '''
+        Detras de un proxy REMOTE_ADDR es la IP del proxy. Con BITACORA_IP_HEADER (ej. HTTP_X_FORWARDED_FOR)
+        se toma la IP que agrego el primero de los BITACORA_PROXIES_CONFIABLES proxies, contando desde el
+        servidor: las anteriores las puede inventar el cliente.
+    '''
+    if settings.BITACORA_IP_HEADER:
+        ips = [ip.strip() for ip in request.META.get(settings.BITACORA_IP_HEADER, '').split(',') if ip.strip()]
+        if len(ips) >= settings.BITACORA_PROXIES_CONFIABLES:
+            return ips[-settings.BITACORA_PROXIES_CONFIABLES]
+    return request.META.get('REMOTE_ADDR', '')
+
+def clave_usuario(ip, username):
+    # El nombre se normaliza y se hashea: puede traer espacios o ser muy largo
+    usuario = hashlib.sha256(username.casefold().encode()).hexdigest()[:32]
+    return f'bitacora:login:usuario:{usuario}:{ip}'
+
+def clave_ip(ip):
+    return f'bitacora:login:ip:{ip}'
+
+def sumar(cache, clave, cantidad):
+    # El vencimiento lo fija el primer fallo: incr no lo cambia
+    cache.add(clave, 0, settings.BITACORA_LOGIN_VENTANA)
+    try:
+        return cache.incr(clave, cantidad)
+    except ValueError:  # Vencio justo entre add e incr
+        valor = max(cantidad, 0)
+        cache.set(clave, valor, settings.BITACORA_LOGIN_VENTANA)
+        return valor
+
+def espera_para(intentos, libres):
+    if intentos <= libres:
+        return 0
+    return min(settings.BITACORA_LOGIN_ESPERA_INICIAL * 2 ** min(intentos - libres - 1, 32),
+               settings.BITACORA_LOGIN_ESPERA_MAXIMA)
+
+def restante(cache, bloqueo):
+    hasta = cache.get(bloqueo)
+    return max(hasta - time.time() if hasta else 0, 1)
+
+def reservar_intento(ip, username):
+    '''
+        Se llama antes de authenticate y cuenta el intento como fallido hasta saber el resultado (si sale bien
+        liberar_intento lo perdona). Pasados los intentos libres, cada intento tiene que tomar su turno con
+        cache.add, que como incr es atomico: de una rafaga de intentos simultaneos pasa uno solo, y deja puesta
+        la espera para el siguiente. Devuelve los segundos que faltan para poder intentar (0 si puede seguir).
+    '''
+    cache = cache_login()
+    clave = clave_usuario(ip, username)
+    segundos = espera_para(sumar(cache, clave, 1), settings.BITACORA_LOGIN_INTENTOS_USUARIO)
+    if not segundos or cache.add(f'{clave}:bloqueo', time.time() + segundos, math.ceil(segundos)):
+        return 0
+    sumar(cache, clave, -1)  # Un intento rechazado no llega al hasher, asi que no cuenta
+    return restante(cache, f'{clave}:bloqueo')
+
+def liberar_intento(ip, username):
+    # Un inicio de sesion correcto perdona los fallos del usuario desde esa IP; los de la IP no cambian (puede
+    # estar probando otras cuentas), pero tampoco suman
+    clave = clave_usuario(ip, username)
+    cache_login().delete_many([clave, f'{clave}:bloqueo'])
+
+def registrar_fallo_ip(ip):
+    '''
+        Se llama cuando authenticate falla. Cuenta el fallo de la IP y, pasados los intentos libres, la bloquea
+        con una espera que se duplica en cada fallo. Devuelve los segundos de bloqueo que le quedan a la IP
+        (0 si no esta bloqueada): en ese caso el fallo se responde con 429.
+    '''
+    cache = cache_login()
+    clave = clave_ip(ip)
+    segundos = espera_para(sumar(cache, clave, 1), settings.BITACORA_LOGIN_INTENTOS_IP)
+    if segundos and cache.add(f'{clave}:bloqueo', time.time() + segundos, math.ceil(segundos)):
+        return segundos
+    return restante(cache, f'{clave}:bloqueo') if cache.get(f'{clave}:bloqueo') else 0
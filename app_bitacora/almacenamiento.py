@@ -0,0 +1,77 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+
+# Un archivo modificado hace menos de estos segundos no se borra aunque no tenga referencias: puede ser de una
+# subida cuya entrada todavia no se guardo (o que reutilizo un archivo que ya existia)
+ANTIGUEDAD_MINIMA_BORRADO = 10 * 60
+
+class AlmacenamientoPorContenido(FileSystemStorage):
+    '''
+        Storage que guarda cada archivo con el hash SHA-256 de su contenido como nombre, dentro de la
+        carpeta que indique upload_to (por ejemplo imagenes/3f/a2/3fa2...e9.jpg).
+        Si varios usuarios suben la misma imagen queda un solo archivo en disco, y el espacio ocupado
+        (y el tiempo de backup) depende del contenido distinto y no de la cantidad de subidas.
+    '''
+
+    def nombre_por_contenido(self, name, content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2], digest[2:4], digest + extension)
+
+    def _save(self, name, content):
+        nombre = self.nombre_por_contenido(name, content)
+        if self.exists(nombre):
+            # El mismo contenido ya esta guardado, no se vuelve a escribir. Actualizo la fecha de modificacion
+            # para que no lo borre la limpieza de huerfanos antes de que se guarde la entrada que lo usa
+            os.utime(self.path(nombre))
+            return nombre
+
+        # Escribo en un temporal de la misma carpeta y lo muevo con os.replace, asi dos subidas simultaneas
+        # del mismo archivo no chocan y nunca queda un archivo a medio escribir con el nombre final
+        ruta = self.path(nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), prefix='.subida-')
+        try:
+            with os.fdopen(descriptor, 'wb') as destino:
+                for chunk in content.chunks():
+                    destino.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporal, self.file_permissions_mode)
+            os.replace(temporal, ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return nombre
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre final lo decide el contenido en _save, no hace falta buscar uno libre
+        return name
+
+def contar_referencias(nombre):
+    # La cuenta de referencias de un archivo sale de la base, asi nunca se desfasa de las entradas reales
+    from .models import Entrada
+    from .particiones import imagenes_archivadas
+    return Entrada.objects.filter(imagen=nombre).count() + len(imagenes_archivadas(nombre))
+
+def se_puede_borrar(nombre):
+    from django.core.files.storage import default_storage
+    return default_storage.get_modified_time(nombre).timestamp() < time.time() - ANTIGUEDAD_MINIMA_BORRADO
+
+def liberar_imagen(nombre):
+    '''
+        Se llama cuando una entrada deja de usar una imagen (se reemplazo o se elimino la entrada).
+        El archivo solo se borra si ninguna otra entrada lo sigue usando. Las versiones redimensionadas
+        (y los archivos recien subidos) los borra el comando recolectar_imagenes, que revisa todas las referencias.
+    '''
+    from django.core.files.storage import default_storage
+    if nombre and contar_referencias(nombre) == 0 and default_storage.exists(nombre) and se_puede_borrar(nombre):
+        default_storage.delete(nombre)
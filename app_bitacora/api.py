@@ -0,0 +1,144 @@
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+
+from .cache import version_usuario, estado_feed
+from .forms import FiltrosEntradaForm
+from .models import Entrada, EntradaColeccion
+from .paginacion import paginar_por_cursor, ENTRADAS_POR_PAGINA
+
+# API de solo lectura en JSON. Los listados se arman con .values(), asi nunca se crean instancias del modelo
+
+TAMANIO_MAXIMO_PAGINA = 100
+
+# Campos que se pueden pedir con ?fields= y la columna de la que sale cada uno
+CAMPOS_ENTRADA = {
+    'id': 'id',
+    'detalle_entrada': 'detalle_entrada',
+    'fecha_entrada': 'fecha_entrada',
+    'fecha_modificacion': 'fecha_modificacion',
+    'tipo_entrada': 'tipo_entrada',
+    'imagen': 'imagen',
+    'imagen_versiones': 'imagen_versiones',
+    'colecciones': None,  # Ids de las colecciones, salen de una consulta aparte sobre la tabla intermedia
+}
+CAMPOS_FEED = {
+    'id': 'id',
+    'detalle_entrada': 'detalle_entrada',
+    'fecha_entrada': 'fecha_entrada',
+    'imagen': 'imagen',
+    'imagen_versiones': 'imagen_versiones',
+    'usuario': 'usuario__username',
+}
+
+def respuesta_json(datos, status=200):
+    # Sin espacios entre separadores: el JSON mas chico posible, y comprime bien con gzip
+    return JsonResponse(datos, status=status, encoder=DjangoJSONEncoder,
+                        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False})
+
+def elegir_campos(request, disponibles):
+    pedidos = request.GET.get('fields')
+    if not pedidos:
+        return list(disponibles)
+    campos = list(dict.fromkeys(campo.strip() for campo in pedidos.split(',') if campo.strip()))
+    invalidos = [campo for campo in campos if campo not in disponibles]
+    if invalidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(invalidos)}. Disponibles: {', '.join(disponibles)}.")
+    return campos
+
+def elegir_tamanio(request):
+    try:
+        return max(1, min(int(request.GET.get('tamanio', ENTRADAS_POR_PAGINA)), TAMANIO_MAXIMO_PAGINA))
+    except ValueError:
+        return ENTRADAS_POR_PAGINA
+
+def calcular_etag(version, request):
+    # La version cambia con cualquier modificacion de los datos, asi que alcanza con ella y la URL pedida
+    return '"%s"' % hashlib.md5(f'{version}|{request.get_full_path()}'.encode()).hexdigest()
+
+def url_archivo(nombre):
+    return default_storage.url(nombre) if nombre else None
+
+def serializar(filas, campos, disponibles):
+    colecciones = {}
+    if 'colecciones' in campos and filas:
+        vinculos = EntradaColeccion.objects.filter(entrada_id__in=[fila['id'] for fila in filas]).values_list('entrada_id', 'coleccion_id')
+        for entrada_id, coleccion_id in vinculos:
+            colecciones.setdefault(entrada_id, []).append(coleccion_id)
+
+    resultados = []
+    for fila in filas:
+        resultado = {}
+        for campo in campos:
+            if campo == 'colecciones':
+                resultado[campo] = colecciones.get(fila['id'], [])
+            elif campo == 'imagen':
+                resultado[campo] = url_archivo(fila['imagen'])
+            elif campo == 'imagen_versiones':
+                resultado[campo] = {
+                    version: {extension: {'url': url_archivo(archivo['nombre']), 'ancho': archivo['ancho']}
+                              for extension, archivo in formatos.items()}
+                    for version, formatos in (fila['imagen_versiones'] or {}).items()
+                }
+            else:
+                resultado[campo] = fila[disponibles[campo]]
+        resultados.append(resultado)
+    return resultados
+
+def listar(request, entradas, disponibles, etag, privado):
+    try:
+        campos = elegir_campos(request, disponibles)
+    except ValueError as e:
+        return respuesta_json({'error': str(e)}, status=400)
+
+    # fecha_entrada e id siempre se piden porque con ellas se arma el cursor de la pagina siguiente
+    columnas = {disponibles[campo] for campo in campos if disponibles[campo]} | {'id', 'fecha_entrada'}
+    filas, siguiente_cursor = paginar_por_cursor(entradas.values(*columnas), request.GET.get('cursor'), elegir_tamanio(request))
+
+    respuesta = respuesta_json({'resultados': serializar(filas, campos, disponibles), 'siguiente_cursor': siguiente_cursor})
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'private, no-cache' if privado else 'no-cache'
+    return respuesta
+
+@gzip_page
+@require_GET
+def api_entradas(request):
+    '''
+        Entradas del usuario autenticado, con los mismos filtros que mis_entradas (coleccion, tipo_entrada,
+        busqueda_x_detalle_entrada, modo_busqueda, fecha_desde y fecha_hasta). Ej: /bitacora/api/entradas?fields=id,fecha_entrada&tipo_entrada=publica
+    '''
+    if not request.user.is_authenticated:
+        return respuesta_json({'error': "Se requiere iniciar sesión."}, status=401)
+
+    # Un filtro invalido es un error del cliente: filtrar() lo ignoraria y devolveria todas las entradas.
+    # Se valida antes del ETag para que un If-None-Match que coincida no tape el 400 con un 304
+    form = FiltrosEntradaForm(usuario=request.user, data=request.GET)
+    if not form.is_valid():
+        errores = {campo: [error['message'] for error in lista] for campo, lista in form.errors.get_json_data().items()}
+        return respuesta_json({'error': "Los filtros no son válidos.", 'campos': errores}, status=400)
+
+    # Si el cliente ya tiene esta respuesta se contesta 304 sin consultar las entradas
+    etag = calcular_etag(version_usuario(request.user.id), request)
+    no_modificada = get_conditional_response(request, etag=etag)
+    if no_modificada is not None:
+        return no_modificada
+
+    entradas = form.filtrar(Entrada.objects.filter(usuario=request.user))
+    return listar(request, entradas, CAMPOS_ENTRADA, etag, privado=True)
+
+@gzip_page
+@require_GET
+def api_feed(request):
+    # Entradas publicas de todos los usuarios, en el mismo orden que el feed de la pagina principal
+    etag = calcular_etag(estado_feed()['version'], request)
+    no_modificada = get_conditional_response(request, etag=etag)
+    if no_modificada is not None:
+        return no_modificada
+
+    entradas = Entrada.objects.filter(tipo_entrada='publica')
+    return listar(request, entradas, CAMPOS_FEED, etag, privado=False)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppBitacoraConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_bitacora'
+
+    def ready(self):
+        # Registra los receptores de señales (invalidacion de cache, etc.)
+        from . import signals  # noqa: F401
@@ -0,0 +1,91 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F, Func, IntegerField, Q
+
+# Configuracion de busqueda de texto de PostgreSQL creada en la migracion 0005 (español y sin acentos)
+CONFIGURACION_BUSQUEDA = 'es_unaccent'
+
+# Modos de busqueda que se pueden elegir desde los formularios de filtros
+MODO_PALABRAS = 'palabras'
+MODO_PARCIAL = 'parcial'
+MODO_APROXIMADO = 'aproximada'
+OPCIONES_MODO_BUSQUEDA = [
+    (MODO_PALABRAS, "Palabras completas"),
+    (MODO_PARCIAL, "Parte de una palabra"),
+    (MODO_APROXIMADO, "Aproximada (tolera errores de tipeo)"),
+]
+
+def separar_palabras(busqueda):
+    # Me quedo solo con letras y numeros, asi el texto del usuario no puede meter operadores de tsquery
+    return re.findall(r'\w+', busqueda or '')
+
+def usa_postgres(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+def consulta_icontains(palabras, campo='detalle_entrada'):
+    consulta = Q() # Creo una consulta con Q() para cada palabra en palabras
+    for palabra in palabras:
+        consulta &= Q(**{f'{campo}__icontains': palabra})  # Filtra por cada palabra y con icontains pueden ser coincidencias parciales(asi evito tener que trabajar con coincidencias totales en la busqueda)
+        # Todas las palabras sueltas deben coincidir para que la entrada pase el filtro y se muestre
+        # Esto lo hago gracias a &= que funciona como un AND y asegura que todas las palabras de la búsqueda estén en detalle_entrada.
+    return consulta
+
+def buscar_por_icontains(entradas, palabras, campo='detalle_entrada'):
+    return entradas.filter(consulta_icontains(palabras, campo))
+
+def buscar_texto_completo(entradas, palabras):
+    '''
+        Busqueda de texto completo sobre el vector mantenido por el trigger de la migracion 0005.
+        Cada palabra se busca por prefijo ("cami" encuentra "caminata") y todas tienen que estar (AND).
+        Los resultados se ordenan por relevancia y despues por fecha.
+        Si todas las palabras son palabras vacias ("de", "la") el tsquery queda vacio y no encontraria nada, asi
+        que en ese caso se busca con icontains, como antes del texto completo.
+    '''
+    consulta = SearchQuery(' & '.join(f'{palabra}:*' for palabra in palabras),
+                           config=CONFIGURACION_BUSQUEDA, search_type='raw')
+    # La decision se toma en la misma consulta (filtrar() corre en vistas async y no puede hacer otra): numnode
+    # y to_tsquery con configuracion son inmutables, asi que PostgreSQL evalua la condicion al planificar y
+    # descarta la rama que no corresponde sin perder el indice del vector
+    vacia = Q(nodos_consulta=0) & consulta_icontains(palabras)
+    return (entradas.alias(nodos_consulta=Func(consulta, function='numnode', output_field=IntegerField()))
+            .filter(Q(busqueda_vector=consulta) | vacia)
+            .annotate(relevancia=SearchRank(F('busqueda_vector'), consulta))
+            .order_by('-relevancia', '-fecha_entrada'))
+
+def buscar_por_trigramas(queryset, busqueda, campo, desempate):
+    '''
+        Busqueda por subcadena: es el mismo icontains de siempre, pero en PostgreSQL el
+        UPPER(campo) LIKE '%palabra%' lo resuelve el indice GIN de trigramas de la migracion 0006
+        en vez de recorrer toda la tabla. Los resultados se ordenan por similitud con el texto buscado.
+    '''
+    return (buscar_por_icontains(queryset, busqueda.split(), campo)
+            .annotate(similitud=TrigramSimilarity(campo, busqueda))
+            .order_by('-similitud', desempate))
+
+def buscar_aproximado(queryset, busqueda, campo, desempate):
+    # "¿Quisiste decir...?": el operador %> de pg_trgm encuentra palabras parecidas aunque tengan errores de tipeo
+    return (queryset.filter(**{f'{campo}__trigram_word_similar': busqueda})
+            .annotate(similitud=TrigramWordSimilarity(busqueda, campo))
+            .order_by('-similitud', desempate))
+
+def buscar_entradas(entradas, busqueda, modo=MODO_PALABRAS):
+    # En SQLite (tests locales) no hay tsvector ni pg_trgm, asi que todos los modos usan icontains
+    if not usa_postgres(entradas):
+        return buscar_por_icontains(entradas, busqueda.split())  # Divide la búsqueda en palabras
+    if modo == MODO_PARCIAL:
+        return buscar_por_trigramas(entradas, busqueda, 'detalle_entrada', '-fecha_entrada')
+    if modo == MODO_APROXIMADO:
+        return buscar_aproximado(entradas, busqueda, 'detalle_entrada', '-fecha_entrada')
+    palabras = separar_palabras(busqueda)
+    if not palabras:
+        return entradas
+    return buscar_texto_completo(entradas, palabras)
+
+def buscar_colecciones(colecciones, busqueda, modo=MODO_PARCIAL):
+    if not usa_postgres(colecciones):
+        return buscar_por_icontains(colecciones, busqueda.split(), 'nombre_coleccion')
+    if modo == MODO_APROXIMADO:
+        return buscar_aproximado(colecciones, busqueda, 'nombre_coleccion', 'nombre_coleccion')
+    return buscar_por_trigramas(colecciones, busqueda, 'nombre_coleccion', 'nombre_coleccion')
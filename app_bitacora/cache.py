@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+# Cuanto tiempo se guarda cada fragmento renderizado (igual se invalida antes si la entrada cambia)
+TIEMPO_CACHE_FRAGMENTOS = 60 * 60 * 24
+
+CLAVE_ACIERTOS = 'bitacora:fragmentos:aciertos'
+CLAVE_FALLOS = 'bitacora:fragmentos:fallos'
+
+def clave_version_usuario(usuario_id):
+    return f'bitacora:fragmentos:version:{usuario_id}'
+
+def version_usuario(usuario_id):
+    '''
+        Version de los fragmentos del usuario. Es un valor al azar y no un contador, asi si el backend
+        descarta la clave nunca se vuelve a una version vieja y se sirven fragmentos desactualizados.
+    '''
+    clave = clave_version_usuario(usuario_id)
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, uuid.uuid4().hex, None)
+        version = cache.get(clave)
+    return version
+
+def invalidar_fragmentos_usuario(usuario_id):
+    # Al cambiar la version, ninguna clave vieja del usuario vuelve a coincidir
+    cache.set(clave_version_usuario(usuario_id), uuid.uuid4().hex, None)
+
+def clave_tarjeta(entrada, usuario_id, version):
+    return f'bitacora:tarjeta:{usuario_id}:{version}:{entrada.id}:{entrada.fecha_modificacion.timestamp()}'
+
+def sumar_contador(clave, cantidad):
+    if not cantidad:
+        return
+    try:
+        cache.incr(clave, cantidad)
+    except ValueError:  # La clave todavia no existe (o el backend la descarto)
+        cache.add(clave, 0, None)
+        cache.incr(clave, cantidad)
+
+def renderizar_tarjetas(entradas, usuario_id):
+    '''
+        Devuelve una lista de (entrada, html de la tarjeta) usando el cache de fragmentos.
+        Todas las tarjetas de la pagina se piden al cache en una sola operacion (get_many) y
+        las que faltan se renderizan y se guardan juntas (set_many).
+    '''
+    version = version_usuario(usuario_id)
+    claves = {entrada.id: clave_tarjeta(entrada, usuario_id, version) for entrada in entradas}
+    guardadas = cache.get_many(claves.values())
+
+    tarjetas, nuevas = [], {}
+    for entrada in entradas:
+        html = guardadas.get(claves[entrada.id])
+        if html is None:
+            html = render_to_string('app_bitacora/tarjeta_entrada.html', {'entrada': entrada})
+            nuevas[claves[entrada.id]] = html
+        tarjetas.append((entrada, html))
+
+    if nuevas:
+        cache.set_many(nuevas, TIEMPO_CACHE_FRAGMENTOS)
+    sumar_contador(CLAVE_ACIERTOS, len(guardadas))
+    sumar_contador(CLAVE_FALLOS, len(nuevas))
+    return tarjetas
+
+async def arenderizar_tarjetas(entradas, usuario_id):
+    # Para las vistas async: con un cache de red (redis, memcached) get_many/set_many bloquearian el event loop
+    return await sync_to_async(renderizar_tarjetas)(entradas, usuario_id)
+
+def estadisticas_cache():
+    contadores = cache.get_many([CLAVE_ACIERTOS, CLAVE_FALLOS])
+    aciertos = contadores.get(CLAVE_ACIERTOS, 0)
+    fallos = contadores.get(CLAVE_FALLOS, 0)
+    total = aciertos + fallos
+    return {
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'tasa_aciertos': round(aciertos / total, 4) if total else None,
+    }
+
+# Feed publico: una pagina cacheada se considera fresca durante TIEMPO_FRESCO_FEED segundos, despues (o si el
+# feed cambio) se sigue sirviendo mientras un solo proceso la regenera (stale-while-revalidate)
+TIEMPO_FRESCO_FEED = 60
+TIEMPO_MAXIMO_FEED = 60 * 60
+TIEMPO_LOCK_FEED = 10
+ESPERA_MAXIMA_FEED = 2
+
+CLAVE_ESTADO_FEED = 'bitacora:feed:estado'
+
+def estado_feed():
+    '''
+        Version actual del feed publico y fecha de su ultimo cambio. La version cambia cada vez que
+        se crea, edita, se hace privada o se elimina una entrada publica (ver signals.py).
+    '''
+    estado = cache.get(CLAVE_ESTADO_FEED)
+    if estado is None:
+        cache.add(CLAVE_ESTADO_FEED, {'version': uuid.uuid4().hex, 'modificado': timezone.now()}, None)
+        estado = cache.get(CLAVE_ESTADO_FEED)
+    return estado
+
+def invalidar_feed():
+    cache.set(CLAVE_ESTADO_FEED, {'version': uuid.uuid4().hex, 'modificado': timezone.now()}, None)
+
+def claves_pagina_feed(cursor):
+    identificador = hashlib.md5((cursor or '').encode()).hexdigest()
+    clave = f'bitacora:feed:pagina:{identificador}'
+    return clave, f'{clave}:lock'
+
+def pagina_vigente(guardada, estado):
+    return guardada and guardada['version'] == estado['version'] and time.time() - guardada['generada'] < TIEMPO_FRESCO_FEED
+
+def armar_pagina_feed(html, estado):
+    return {
+        'html': html,
+        'version': estado['version'],
+        'generada': time.time(),
+        'modificado': estado['modificado'],
+        'etag': '"%s"' % hashlib.md5(html.encode()).hexdigest(),
+    }
+
+async def apagina_feed(cursor, arenderizar):
+    '''
+        Devuelve un diccionario con el html de una pagina del feed publico, su etag y su fecha de modificacion.
+        "arenderizar" es la corrutina que hace las consultas y arma el html cuando no hay una copia vigente.
+        Si la copia guardada es de una version vieja del feed o ya no esta fresca, solo el proceso que consigue
+        el lock la regenera y el resto sigue sirviendo la copia vieja, asi un pico de trafico no termina en
+        cientos de consultas iguales a la base. Si no hay ninguna copia, se espera un poco (sin bloquear el
+        event loop) a que la genere el proceso que tiene el lock antes de hacer la consulta.
+    '''
+    estado = await sync_to_async(estado_feed)()
+    clave, clave_lock = claves_pagina_feed(cursor)
+
+    guardada = await cache.aget(clave)
+    if pagina_vigente(guardada, estado):
+        return guardada
+
+    tengo_lock = await cache.aadd(clave_lock, 1, TIEMPO_LOCK_FEED)
+    if not tengo_lock:
+        if guardada:
+            return guardada
+        limite = time.monotonic() + ESPERA_MAXIMA_FEED
+        while time.monotonic() < limite:
+            await asyncio.sleep(0.05)
+            guardada = await cache.aget(clave)
+            if guardada:
+                return guardada
+
+    try:
+        pagina = armar_pagina_feed(await arenderizar(), estado)
+        await cache.aset(clave, pagina, TIEMPO_MAXIMO_FEED)
+    finally:
+        if tengo_lock:
+            await cache.adelete(clave_lock)
+    return pagina
@@ -0,0 +1,161 @@
+import logging
+import random
+import re
+import time
+
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .metricas import SIN_RUTA
+
+logger = logging.getLogger(__name__)
+
+# Detector de consultas problematicas: en una muestra de los requests (BITACORA_CONSULTAS_MUESTREO) se agrupan
+# las consultas por su huella (el SQL sin literales) y se marcan las que se repiten mas de
+# BITACORA_CONSULTAS_REPETIDAS_MAXIMO veces (un N+1) y las que tardan mas de BITACORA_CONSULTA_LENTA_MS.
+# En los tests (BITACORA_CONSULTAS_ESTRICTO) se miran todos los requests y un hallazgo hace fallar el request;
+# en produccion se loguea y se acumula en el cache para verlo con manage.py perf_report
+
+REPETIDA = 'repetida'
+LENTA = 'lenta'
+
+CLAVE_REPORTE = 'bitacora:consultas:reporte'
+MAXIMO_HALLAZGOS = 200  # Si hay mas en el reporte se descartan los que hace mas que no aparecen
+
+_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_LITERAL_NUMERO = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_LISTA_VALORES = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ESPACIOS = re.compile(r'\s+')
+
+def huella_consulta(sql):
+    '''
+        El SQL sin los valores: "WHERE id = 3", "WHERE id = %s" y "WHERE id IN (1, 2)" dan la misma
+        huella, asi una consulta que se repite con otros parametros se reconoce como la misma.
+    '''
+    sql = _LITERAL_TEXTO.sub('?', sql.replace('%s', '?'))
+    sql = _LITERAL_NUMERO.sub('?', sql)
+    sql = _LISTA_VALORES.sub('(...)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+class ConsultasProblematicas(Exception):
+    pass
+
+class EstadoDetector:
+    def __init__(self):
+        self.consultas = Counter()  # SQL tal cual -> veces, la huella se calcula una vez por SQL distinto
+        self.lentas = []
+
+_estado = ContextVar('bitacora_estado_detector', default=None)
+
+def vigilar_consulta(execute, sql, params, many, context):
+    # Execute wrapper que se instala en todas las conexiones (ver signals.py)
+    estado = _estado.get()
+    if estado is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        milisegundos = (time.perf_counter() - inicio) * 1000
+        estado.consultas[sql] += 1
+        if milisegundos > settings.BITACORA_CONSULTA_LENTA_MS:
+            estado.lentas.append((sql, milisegundos))
+
+def analizar(estado):
+    # Devuelve [(tipo, huella, valor, ejemplo)]: valor son las repeticiones o los milisegundos
+    repeticiones, ejemplos = Counter(), {}
+    for sql, veces in estado.consultas.items():
+        huella = huella_consulta(sql)
+        repeticiones[huella] += veces
+        ejemplos.setdefault(huella, sql)
+    hallazgos = [(REPETIDA, huella, veces, ejemplos[huella]) for huella, veces in repeticiones.most_common()
+                 if veces > settings.BITACORA_CONSULTAS_REPETIDAS_MAXIMO]
+    hallazgos += [(LENTA, huella_consulta(sql), round(milisegundos, 1), sql) for sql, milisegundos in estado.lentas]
+    return hallazgos
+
+def acumular_en_reporte(vista, hallazgos):
+    # Un solo valor en el cache con todos los hallazgos: si dos procesos escriben a la vez se puede perder
+    # alguno, alcanza para un reporte de diagnostico
+    reporte = cache.get(CLAVE_REPORTE, {})
+    ahora = timezone.now()
+    for tipo, huella, valor, ejemplo in hallazgos:
+        hallazgo = reporte.setdefault((tipo, vista, huella), {'veces': 0, 'peor': 0, 'ejemplo': ejemplo})
+        hallazgo['veces'] += 1
+        hallazgo['peor'] = max(hallazgo['peor'], valor)
+        hallazgo['ultima'] = ahora
+    if len(reporte) > MAXIMO_HALLAZGOS:
+        recientes = sorted(reporte, key=lambda clave: reporte[clave]['ultima'], reverse=True)[:MAXIMO_HALLAZGOS]
+        reporte = {clave: reporte[clave] for clave in recientes}
+    cache.set(CLAVE_REPORTE, reporte, None)
+
+def reporte_consultas():
+    return cache.get(CLAVE_REPORTE, {})
+
+def limpiar_reporte_consultas():
+    cache.delete(CLAVE_REPORTE)
+
+def describir(tipo, valor):
+    return f"se repite {valor} veces" if tipo == REPETIDA else f"tardo {valor} ms"
+
+class DetectorConsultasMiddleware:
+    '''
+        Revisa las consultas de los requests de la muestra (todos en modo estricto) y reporta las
+        repetidas y las lentas; en modo estricto las repetidas ademas son un error. Funciona en modo sync y async.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def medir(self):
+        return settings.BITACORA_CONSULTAS_ESTRICTO or random.random() < settings.BITACORA_CONSULTAS_MUESTREO
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.medir():
+            return self.get_response(request)
+        estado = EstadoDetector()
+        token = _estado.set(estado)
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _estado.reset(token)
+        hallazgos = analizar(estado)
+        if hallazgos:
+            self.reportar(request, hallazgos)
+        return respuesta
+
+    async def __acall__(self, request):
+        if not self.medir():
+            return await self.get_response(request)
+        estado = EstadoDetector()
+        token = _estado.set(estado)
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _estado.reset(token)
+        hallazgos = analizar(estado)
+        if hallazgos:
+            # El reporte se acumula en el cache, que puede ser de red: no se bloquea el event loop
+            await sync_to_async(self.reportar)(request, hallazgos)
+        return respuesta
+
+    def reportar(self, request, hallazgos):
+        ruta = getattr(request, 'resolver_match', None)
+        vista = ruta.view_name if ruta else SIN_RUTA
+        detalle = '\n'.join(f"  [{tipo}] {describir(tipo, valor)}: {ejemplo}" for tipo, _, valor, ejemplo in hallazgos)
+        # En modo estricto solo las repetidas son un error: son deterministas, en cambio una consulta lenta
+        # puede serlo solo porque la maquina de CI esta cargada. Las lentas se siguen logueando
+        if settings.BITACORA_CONSULTAS_ESTRICTO and any(tipo == REPETIDA for tipo, *_ in hallazgos):
+            raise ConsultasProblematicas(f"Consultas problematicas en {vista} ({request.path}):\n{detalle}")
+        logger.warning("Consultas problematicas en %s (%s):\n%s", vista, request.path, detalle)
+        acumular_en_reporte(vista, hallazgos)
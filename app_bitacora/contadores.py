@@ -0,0 +1,110 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Count, Exists, F, OuterRef, Q
+
+from .models import Usuario, Entrada, Coleccion, EntradaColeccion
+
+# Los contadores se actualizan con F() (UPDATE ... SET campo = campo + n), asi dos requests simultaneos
+# no se pisan. Si igual quedan desfasados (por ejemplo por un UPDATE hecho a mano en la base),
+# el comando reconciliar_contadores los recalcula
+
+CAMPO_POR_TIPO = {
+    'publica': 'cantidad_entradas_publicas',
+    'privada': 'cantidad_entradas_privadas',
+}
+
+def sumar_entradas_usuario(usuario_id, cantidades):
+    # cantidades: {tipo_entrada: diferencia}, ej. {'publica': 1, 'privada': -1} al hacer publica una entrada
+    cambios = {CAMPO_POR_TIPO[tipo]: F(CAMPO_POR_TIPO[tipo]) + cantidad for tipo, cantidad in cantidades.items() if cantidad}
+    if cambios:
+        Usuario.objects.filter(id=usuario_id).update(**cambios)
+
+def sumar_entradas_colecciones(cantidades):
+    # cantidades: {coleccion_id: diferencia}. Las colecciones con la misma diferencia se actualizan juntas
+    por_cantidad = {}
+    for coleccion_id, cantidad in cantidades.items():
+        if cantidad:
+            por_cantidad.setdefault(cantidad, []).append(coleccion_id)
+    for cantidad, ids in por_cantidad.items():
+        Coleccion.objects.filter(id__in=ids).update(cantidad_entradas=F('cantidad_entradas') + cantidad)
+
+def sumar_vinculos(vinculos, signo=1):
+    # vinculos: pares (entrada_id, coleccion_id) que se agregaron (signo 1) o se quitaron (signo -1)
+    sumar_entradas_colecciones({coleccion_id: signo * cantidad
+                                for coleccion_id, cantidad in Counter(coleccion_id for _, coleccion_id in vinculos).items()})
+
+def vinculos_existentes(entrada_ids=None, coleccion_ids=None):
+    vinculos = EntradaColeccion.objects.all()
+    if entrada_ids is not None:
+        vinculos = vinculos.filter(entrada_id__in=entrada_ids)
+    if coleccion_ids is not None:
+        vinculos = vinculos.filter(coleccion_id__in=coleccion_ids)
+    return list(vinculos.values_list('entrada_id', 'coleccion_id'))
+
+_en_lote = ContextVar('contadores_en_lote', default=False)
+
+def contando_en_lote():
+    return _en_lote.get()
+
+@contextmanager
+def contadores_en_lote(entradas):
+    '''
+        Para borrar muchas entradas juntas (un queryset, o usuarios con todas sus entradas): los contadores se
+        descuentan al final con consultas agrupadas por usuario y por coleccion, en vez de las dos consultas por
+        entrada de signals.descontar_entrada_eliminada. "entradas" es el queryset de las que se van a borrar.
+    '''
+    por_usuario = list(entradas.values_list('usuario_id', 'tipo_entrada').annotate(cantidad=Count('id')).order_by())
+    por_coleccion = list(EntradaColeccion.objects.filter(entrada__in=entradas).values_list('coleccion_id')
+                         .annotate(cantidad=Count('id')).order_by())
+    token = _en_lote.set(True)
+    try:
+        yield
+    finally:
+        _en_lote.reset(token)
+    cantidades = {}
+    for usuario_id, tipo, cantidad in por_usuario:
+        cantidades.setdefault(usuario_id, {})[tipo] = -cantidad
+    for usuario_id, cantidades_usuario in cantidades.items():
+        sumar_entradas_usuario(usuario_id, cantidades_usuario)
+    sumar_entradas_colecciones({coleccion_id: -cantidad for coleccion_id, cantidad in por_coleccion})
+
+def reconciliar_usuarios(desde_id, hasta_id):
+    '''
+        Recalcula los contadores de los usuarios con id en [desde_id, hasta_id) y guarda solo los que
+        estaban mal. Devuelve la cantidad de usuarios corregidos.
+    '''
+    usuarios = (Usuario.objects.filter(id__gte=desde_id, id__lt=hasta_id)
+                .annotate(publicas=Count('entrada', filter=Q(entrada__tipo_entrada='publica')),
+                          privadas=Count('entrada', filter=Q(entrada__tipo_entrada='privada')))
+                .only('id', 'cantidad_entradas_publicas', 'cantidad_entradas_privadas'))
+    corregidos = []
+    for usuario in usuarios:
+        if (usuario.cantidad_entradas_publicas, usuario.cantidad_entradas_privadas) != (usuario.publicas, usuario.privadas):
+            usuario.cantidad_entradas_publicas, usuario.cantidad_entradas_privadas = usuario.publicas, usuario.privadas
+            corregidos.append(usuario)
+    Usuario.objects.bulk_update(corregidos, ['cantidad_entradas_publicas', 'cantidad_entradas_privadas'])
+    return len(corregidos)
+
+def reconciliar_colecciones(desde_id, hasta_id):
+    colecciones = (Coleccion.objects.filter(id__gte=desde_id, id__lt=hasta_id)
+                   .annotate(reales=Count('entradas'))
+                   .only('id', 'cantidad_entradas'))
+    corregidas = []
+    for coleccion in colecciones:
+        if coleccion.cantidad_entradas != coleccion.reales:
+            coleccion.cantidad_entradas = coleccion.reales
+            corregidas.append(coleccion)
+    Coleccion.objects.bulk_update(corregidas, ['cantidad_entradas'])
+    return len(corregidas)
+
+def borrar_vinculos_huerfanos(desde_id, hasta_id):
+    '''
+        Borra los vinculos con id en [desde_id, hasta_id) cuya entrada ya no existe. Con la tabla de entradas
+        particionada la base no tiene la clave foranea (ver particiones.convertir_tabla), asi que un DELETE
+        hecho a mano deja vinculos sueltos. Devuelve la cantidad de vinculos borrados.
+    '''
+    huerfanos = (EntradaColeccion.objects.filter(id__gte=desde_id, id__lt=hasta_id)
+                 .filter(~Exists(Entrada.objects.filter(id=OuterRef('entrada_id')))))
+    return huerfanos.delete()[0]
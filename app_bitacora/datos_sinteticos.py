@@ -0,0 +1,131 @@
+import random
+
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from .models import Usuario, Entrada, Coleccion, EntradaColeccion
+from .contadores import sumar_entradas_usuario
+from .imagenes import generar_versiones
+
+# Vocabulario para armar detalles de entradas con texto parecido al real (con acentos incluidos)
+PALABRAS = [
+    'hoy', 'ayer', 'mañana', 'caminata', 'montaña', 'playa', 'canción', 'música', 'lectura', 'libro',
+    'café', 'amigos', 'familia', 'trabajo', 'reunión', 'viaje', 'tren', 'ciudad', 'parque', 'lluvia',
+    'sol', 'invierno', 'verano', 'película', 'cocina', 'receta', 'jardín', 'flores', 'perro', 'gato',
+    'estudio', 'examen', 'proyecto', 'código', 'fútbol', 'partido', 'cumpleaños', 'regalo', 'noche', 'estrellas',
+    'fotografía', 'museo', 'concierto', 'bicicleta', 'río', 'lago', 'bosque', 'atardecer', 'desayuno', 'cena',
+]
+
+def generar_detalle(aleatorio, minimo=6, maximo=30):
+    return ' '.join(aleatorio.choices(PALABRAS, k=aleatorio.randint(minimo, maximo))).capitalize()
+
+PAISES = ['Argentina', 'Uruguay', 'Chile', 'México', 'España', 'Colombia', 'Perú', None]
+
+def generar_entrada(aleatorio, usuario, fecha, proporcion_publicas, imagenes, proporcion_imagenes):
+    entrada = Entrada(
+        detalle_entrada=generar_detalle(aleatorio),
+        fecha_entrada=fecha,
+        tipo_entrada='publica' if aleatorio.random() < proporcion_publicas else 'privada',
+        usuario=usuario,
+    )
+    if imagenes and aleatorio.random() < proporcion_imagenes:
+        entrada.imagen, entrada.imagen_versiones = aleatorio.choice(imagenes)
+    return entrada
+
+def generar_entradas(usuario, cantidad, lote=5000, semilla=None, proporcion_publicas=0.5, imagenes=(), proporcion_imagenes=0):
+    '''
+        Inserta "cantidad" entradas sinteticas del usuario con bulk_create, de a "lote" filas por INSERT.
+        Las fechas se reparten hacia atras desde ahora, una cada pocos minutos. Con "imagenes" (ver
+        generar_imagenes) esa proporcion de las entradas lleva una de ellas, con sus versiones ya generadas.
+    '''
+    aleatorio = random.Random(semilla)
+    ahora = timezone.now()
+    for inicio in range(0, cantidad, lote):
+        entradas = Entrada.objects.bulk_create([
+            generar_entrada(aleatorio, usuario, ahora - timedelta(minutes=i * 7 + aleatorio.randint(0, 6)),
+                            proporcion_publicas, imagenes, proporcion_imagenes)
+            for i in range(inicio, min(cantidad, inicio + lote))
+        ])
+        # bulk_create no envia señales, asi que los contadores del usuario se suman aca
+        sumar_entradas_usuario(usuario.id, Counter(entrada.tipo_entrada for entrada in entradas))
+
+def generar_colecciones(usuario, cantidad, entradas_por_coleccion=20, semilla=None):
+    '''
+        Crea "cantidad" colecciones del usuario y mete en cada una entradas al azar del mismo usuario.
+        Las relaciones se insertan directo en la tabla intermedia con bulk_create.
+    '''
+    aleatorio = random.Random(semilla)
+    # Cada coleccion se crea ya con su cantidad de entradas, asi no hace falta actualizar el contador despues
+    ids_entradas = list(Entrada.objects.filter(usuario=usuario).values_list('id', flat=True))
+    por_coleccion = min(entradas_por_coleccion, len(ids_entradas))
+    colecciones = Coleccion.objects.bulk_create([
+        Coleccion(nombre_coleccion=f"{aleatorio.choice(PALABRAS).capitalize()} {numero}",
+                  detalle_coleccion=generar_detalle(aleatorio, 3, 10), usuario=usuario,
+                  cantidad_entradas=por_coleccion)
+        for numero in range(cantidad)
+    ])
+    EntradaColeccion.objects.bulk_create([
+        EntradaColeccion(entrada_id=id_entrada, coleccion=coleccion)
+        for coleccion in colecciones
+        for id_entrada in aleatorio.sample(ids_entradas, por_coleccion)
+    ], batch_size=5000)
+    return colecciones
+
+def generar_imagenes(cantidad, semilla=None):
+    '''
+        Guarda "cantidad" fotos sinteticas (figuras de colores sobre un fondo liso) con sus versiones
+        y devuelve una lista de (nombre, versiones) para generar_entradas. Con la misma semilla salen los
+        mismos archivos, que el almacenamiento por contenido no vuelve a escribir.
+    '''
+    aleatorio = random.Random(semilla)
+    imagenes = []
+    color = lambda: tuple(aleatorio.randint(0, 255) for _ in range(3))  # noqa: E731
+    for _ in range(cantidad):
+        imagen = Image.new('RGB', (1600, 1200), color())
+        dibujo = ImageDraw.Draw(imagen)
+        for _ in range(12):
+            x, y = aleatorio.randint(0, 1400), aleatorio.randint(0, 1000)
+            dibujo.ellipse((x, y, x + aleatorio.randint(50, 400), y + aleatorio.randint(50, 400)), fill=color())
+        buffer = BytesIO()
+        imagen.save(buffer, 'JPEG', quality=85)
+        nombre = default_storage.save('imagenes/sintetica.jpg', ContentFile(buffer.getvalue()))
+        imagenes.append((nombre, generar_versiones(nombre)))
+    return imagenes
+
+def repartir_con_sesgo(total, partes, exponente=1.1):
+    # Reparte "total" entre "partes" siguiendo una ley de Zipf: pocos usuarios escriben mucho y la mayoria poco
+    pesos = [1 / posicion ** exponente for posicion in range(1, partes + 1)]
+    suma = sum(pesos)
+    cantidades = [int(total * peso / suma) for peso in pesos]
+    cantidades[0] += total - sum(cantidades)
+    return cantidades
+
+def generar_usuarios(cantidad, prefijo, password=None, semilla=None):
+    # El hash se calcula una sola vez, es lo mas lento de crear un usuario
+    aleatorio = random.Random(semilla)
+    hash_password = make_password(password)
+    return Usuario.objects.bulk_create([
+        Usuario(username=f'{prefijo}{numero}', email=f'{prefijo}{numero}@bitacora.local', password=hash_password,
+                pais=aleatorio.choice(PAISES), date_joined=timezone.now())
+        for numero in range(cantidad)
+    ])
+
+def generar_dataset(usuarios, entradas, colecciones_por_usuario=5, entradas_por_coleccion=20, proporcion_imagenes=0.1,
+                    imagenes_distintas=8, prefijo='seed', password=None, semilla=0):
+    '''
+        Genera un conjunto de datos completo: usuarios, entradas repartidas con sesgo entre ellos (el
+        primero es el que mas tiene), colecciones con entradas que pueden estar en varias a la vez e
+        imagenes. Devuelve los usuarios creados, en orden de cantidad de entradas.
+    '''
+    creados = generar_usuarios(usuarios, prefijo, password, semilla)
+    imagenes = generar_imagenes(imagenes_distintas, semilla) if proporcion_imagenes and imagenes_distintas else []
+    for numero, (usuario, cantidad) in enumerate(zip(creados, repartir_con_sesgo(entradas, usuarios))):
+        generar_entradas(usuario, cantidad, semilla=semilla + numero, imagenes=imagenes, proporcion_imagenes=proporcion_imagenes)
+        generar_colecciones(usuario, colecciones_por_usuario, entradas_por_coleccion, semilla=semilla + numero)
+    return creados
@@ -1,17 +1,36 @@
+from datetime import datetime, timedelta
 from django import forms
 from django.contrib.auth.decorators import login_required
+from django.utils import timezone
 
 from .models import Entrada, Usuario, Coleccion
+from .busqueda import OPCIONES_MODO_BUSQUEDA, MODO_PALABRAS, MODO_PARCIAL, MODO_APROXIMADO, buscar_entradas
+from .validaciones import validar_cabecera_imagen
+from .importacion import OPCIONES_FORMATO, FORMATO_CSV, FORMATO_JSONL, verificar_codificacion
+from .metricas import medir
 
 class LoginForm(forms.Form):
     nombre = forms.CharField(label="Nombre de usuario", max_length=100)
     password = forms.CharField(label="Contraseña", max_length=100, widget=forms.PasswordInput)
 
+class ImagenEntradaField(forms.ImageField):
+    def to_python(self, data):
+        if data in self.empty_values:
+            return super().to_python(data)
+        # Errores que detecto el handler mientras se subia el archivo (ver subidas.py)
+        if getattr(data, 'error_subida', None):
+            raise forms.ValidationError(data.error_subida, code='tamanio')
+        # La firma y las dimensiones se controlan antes de que ImageField abra la imagen con Pillow
+        with medir('imagenes'):
+            validar_cabecera_imagen(data)
+            return super().to_python(data)
+
 #para este formulario uso ModelForm porque tengo un modelo previo, entonces el form se adapta a dicho modelo
 class EntradaForm(forms.ModelForm):
     class Meta:
         model = Entrada
         fields = ['detalle_entrada', 'fecha_entrada', 'tipo_entrada','imagen']
+        field_classes = {'imagen': ImagenEntradaField}
         widgets = {
             'detalle_entrada': forms.Textarea(attrs={
                 'placeholder': 'Escribe el detalle de tu entrada...',
@@ -95,6 +114,9 @@ class ColeccionForm(forms.ModelForm):
             'detalle_coleccion': 'Detalle de la coleccion'
         }
 
+def inicio_del_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+
 class FiltrosEntradaForm(forms.Form):
     # Dejo vacia la lista de choices porque las voy a rellenar dinamicamente con el constructor __init__
     coleccion = forms.ChoiceField(choices=[], required=False, label="Filtrar por colección")
@@ -111,15 +133,63 @@ class FiltrosEntradaForm(forms.Form):
     busqueda_x_detalle_entrada = forms.CharField(label="Buscar entrada",
                                                  required=False,
                                                  widget=forms.TextInput(attrs={"placeholder": "Ingrese texto para buscar..."}))
+    modo_busqueda = forms.ChoiceField(choices=OPCIONES_MODO_BUSQUEDA, required=False, label="Modo de búsqueda")
+    fecha_desde = forms.DateField(required=False, label="Desde", widget=forms.DateInput(attrs={"type": "date"}))
+    fecha_hasta = forms.DateField(required=False, label="Hasta", widget=forms.DateInput(attrs={"type": "date"}))
 
-    def __init__(self, *args, usuario=None, **kwargs):
+    def __init__(self, *args, usuario=None, colecciones=None, **kwargs):
+        # "colecciones" son los pares (id, nombre) ya consultados (las vistas async no pueden consultar desde aca)
         super().__init__(*args, **kwargs)
-        if usuario:
-            colecciones_usuario = Coleccion.objects.filter(usuario=usuario)
+        if colecciones is None and usuario:
+            colecciones = Coleccion.objects.filter(usuario=usuario).values_list('id', 'nombre_coleccion')
+        if colecciones is not None:
             # Guardo la opcion "Todas" + las colecciones que tenga el usuario en "opciones"
-            opciones = [("", "Todas")] + [(c.id, c.nombre_coleccion) for c in colecciones_usuario]
+            opciones = [("", "Todas")] + list(colecciones)
             self.fields["coleccion"].choices = opciones
 
+    def clean_modo_busqueda(self):
+        # Si no se elige un modo se busca por palabras completas
+        return self.cleaned_data["modo_busqueda"] or MODO_PALABRAS
+
+    def filtrar(self, entradas):
+        # Aplica los filtros elegidos al queryset de entradas (lo usan mis_entradas y la API)
+        if not self.is_valid():
+            return entradas
+
+        # Filtrar por colección si el usuario seleccionó una
+        coleccion_id = self.cleaned_data.get("coleccion")
+        if coleccion_id:
+            entradas = entradas.filter(colecciones=coleccion_id)
+
+        # Filtrar por tipo de entrada
+        tipo_entrada = self.cleaned_data.get("tipo_entrada")
+        if tipo_entrada:
+            entradas = entradas.filter(tipo_entrada=tipo_entrada)
+
+        # Rango de fechas (hasta inclusive). Se compara la columna directamente y no con __date, asi el motor usa
+        # el indice y, si la tabla esta particionada, solo lee las particiones de esas fechas
+        fecha_desde = self.cleaned_data.get("fecha_desde")
+        if fecha_desde:
+            entradas = entradas.filter(fecha_entrada__gte=inicio_del_dia(fecha_desde))
+        fecha_hasta = self.cleaned_data.get("fecha_hasta")
+        if fecha_hasta:
+            entradas = entradas.filter(fecha_entrada__lt=inicio_del_dia(fecha_hasta + timedelta(days=1)))
+
+        busqueda = self.cleaned_data.get("busqueda_x_detalle_entrada")
+        if busqueda:
+            entradas = buscar_entradas(entradas, busqueda, self.cleaned_data.get("modo_busqueda"))
+        return entradas
+
+class FiltrosColeccionForm(forms.Form):
+    busqueda_x_nombre_coleccion = forms.CharField(label="Buscar colección",
+                                                  required=False,
+                                                  widget=forms.TextInput(attrs={"placeholder": "Ingrese parte del nombre..."}))
+    modo_busqueda = forms.ChoiceField(
+        choices=[(MODO_PARCIAL, "Parte del nombre"), (MODO_APROXIMADO, "Aproximada (tolera errores de tipeo)")],
+        required=False,
+        label="Modo de búsqueda"
+    )
+
 class AgregarEntradaEnColeccionForm(forms.Form):
     colecciones = forms.ModelMultipleChoiceField(
         queryset=Coleccion.objects.none(),  # Se llenará dinámicamente
@@ -138,3 +208,69 @@ class AgregarEntradaEnColeccionForm(forms.Form):
         # Si hay entrada, marcamos las colecciones a las que ya pertenece
         if entrada:
             self.fields["colecciones"].initial = entrada.colecciones.all()
+
+class ListaIdsField(forms.Field):
+    # Lista de ids enteros (ej. los checkboxes de las entradas elegidas en mis_entradas)
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            return list(dict.fromkeys(int(valor) for valor in value))
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Identificadores inválidos.")
+
+ACCION_AGREGAR = 'agregar'
+ACCION_QUITAR = 'quitar'
+
+class OrganizarEntradasForm(forms.Form):
+    # Agregar o quitar varias entradas de varias colecciones a la vez (desde mis_entradas)
+    entradas = ListaIdsField(error_messages={'required': "Seleccione al menos una entrada."})
+    accion = forms.ChoiceField(
+        choices=[(ACCION_AGREGAR, "Agregar a"), (ACCION_QUITAR, "Quitar de")],
+        initial=ACCION_AGREGAR,
+        widget=forms.RadioSelect,
+        label="Entradas seleccionadas"
+    )
+    colecciones = forms.TypedMultipleChoiceField(
+        choices=[],
+        coerce=int,
+        widget=forms.CheckboxSelectMultiple,
+        error_messages={'required': "Seleccione al menos una colección."},
+        label="Colecciones"
+    )
+
+    def __init__(self, *args, usuario=None, colecciones=None, **kwargs):
+        # Igual que en FiltrosEntradaForm, "colecciones" son los pares (id, nombre) ya consultados
+        super().__init__(*args, **kwargs)
+        if colecciones is None and usuario:
+            colecciones = Coleccion.objects.filter(usuario=usuario).values_list('id', 'nombre_coleccion')
+        if colecciones is not None:
+            self.fields["colecciones"].choices = list(colecciones)
+
+class ImportarEntradasForm(forms.Form):
+    archivo_importacion = forms.FileField(
+        label="Archivo",
+        help_text="JSON Lines (una entrada o colección por línea) o CSV con las columnas detalle_entrada, fecha_entrada, tipo_entrada y colecciones.",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.jsonl,.csv'}),
+    )
+    formato = forms.ChoiceField(
+        choices=[('', 'Según la extensión del archivo')] + OPCIONES_FORMATO,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+
+    def clean_archivo_importacion(self):
+        archivo = self.cleaned_data['archivo_importacion']
+        if getattr(archivo, 'error_subida', None):
+            raise forms.ValidationError(archivo.error_subida)
+        verificar_codificacion(archivo)
+        return archivo
+
+    def clean(self):
+        cleaned_data = super().clean()
+        archivo = cleaned_data.get('archivo_importacion')
+        if archivo and not cleaned_data.get('formato'):
+            cleaned_data['formato'] = FORMATO_CSV if archivo.name.lower().endswith('.csv') else FORMATO_JSONL
+        return cleaned_data
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher, ScryptPasswordHasher
+
+# Los hashers de Django con el costo que indica settings (ver PASSWORD_HASHERS). Conservan el nombre del
+# algoritmo, asi los hashes que ya estan guardados se siguen verificando. Al iniciar sesion Django vuelve a
+# calcular el hash si el usuario tiene otro algoritmo que el preferido o el costo cambio
+
+class PBKDF2Configurable(PBKDF2PasswordHasher):
+    iterations = settings.BITACORA_PBKDF2_ITERACIONES
+
+class ScryptConfigurable(ScryptPasswordHasher):
+    work_factor = settings.BITACORA_SCRYPT_WORK_FACTOR
+
+class Argon2Configurable(Argon2PasswordHasher):
+    time_cost = settings.BITACORA_ARGON2_TIME_COST
+    memory_cost = settings.BITACORA_ARGON2_MEMORY_COST
+    parallelism = settings.BITACORA_ARGON2_PARALELISMO
@@ -0,0 +1,104 @@
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .metricas import medir
+
+logger = logging.getLogger(__name__)
+
+# Ancho maximo (en px) de cada version que se genera de una imagen subida
+VERSIONES_IMAGEN = {
+    'miniatura': 320,
+    'feed': 800,
+    'completa': 1600,
+}
+
+# Cada version se guarda en WebP y en JPEG (para los navegadores que no soportan WebP).
+# Como no se le pasa exif= a Pillow, los metadatos EXIF de la foto original no se copian
+FORMATOS_IMAGEN = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_pool = None
+
+def pool_imagenes():
+    # El pool se crea recien cuando se sube la primera imagen. Alcanza con hilos porque Pillow libera el GIL
+    # mientras redimensiona y comprime
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.BITACORA_IMAGENES_WORKERS,
+                                   thread_name_prefix='bitacora-imagenes')
+    return _pool
+
+def generar_versiones(nombre):
+    '''
+        Genera las versiones redimensionadas de la imagen guardada en "nombre" y devuelve un diccionario
+        {version: {extension: {'nombre': ..., 'ancho': ...}}} con los archivos que se guardaron.
+    '''
+    # Solo cuenta en las metricas del request cuando se procesa en el mismo request (BITACORA_IMAGENES_SINCRONO)
+    with medir('imagenes'), default_storage.open(nombre) as archivo:
+        imagen = Image.open(archivo)
+        # Aplico la rotacion que indica el EXIF antes de descartarlo, si no las fotos del celular quedan giradas
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.load()
+        if imagen.mode not in ('RGB', 'L'):
+            imagen = imagen.convert('RGB')
+
+    base = os.path.splitext(os.path.basename(nombre))[0]
+    versiones = {}
+    for version, ancho in VERSIONES_IMAGEN.items():
+        with medir('imagenes'):
+            copia = imagen.copy()
+            copia.thumbnail((ancho, ancho * 4), Image.LANCZOS)  # Nunca agranda la imagen, solo la achica
+        for extension, (formato, opciones) in FORMATOS_IMAGEN.items():
+            buffer = BytesIO()
+            with medir('imagenes'):
+                copia.save(buffer, formato, **opciones)
+            guardado = default_storage.save(f'imagenes/versiones/{base}_{version}.{extension}', ContentFile(buffer.getvalue()))
+            versiones.setdefault(version, {})[extension] = {'nombre': guardado, 'ancho': copia.width}
+    return versiones
+
+def procesar_imagen(entrada_id, nombre):
+    from .models import Entrada
+    from .cache import invalidar_feed, invalidar_fragmentos_usuario
+
+    try:
+        # Con el almacenamiento por contenido, si otra entrada ya tiene la misma imagen reutilizo sus versiones
+        versiones = (Entrada.objects.filter(imagen=nombre).exclude(imagen_versiones={})
+                     .values_list('imagen_versiones', flat=True).first())
+        if not versiones:
+            versiones = generar_versiones(nombre)
+        # Solo guardo las versiones si la entrada sigue teniendo la misma imagen (la pudieron editar mientras tanto).
+        # Cambiar fecha_modificacion invalida la tarjeta cacheada de la entrada
+        actualizadas = (Entrada.objects.filter(id=entrada_id, imagen=nombre)
+                        .update(imagen_versiones=versiones, fecha_modificacion=timezone.now()))
+        datos = Entrada.objects.filter(id=entrada_id).values_list('usuario_id', 'tipo_entrada').first() if actualizadas else None
+        if datos:
+            usuario_id, tipo_entrada = datos
+            invalidar_fragmentos_usuario(usuario_id)
+            if tipo_entrada == 'publica':
+                invalidar_feed()
+    except Exception:
+        logger.exception("No se pudieron generar las versiones de la imagen %s de la entrada %s", nombre, entrada_id)
+
+def procesar_imagen_en_hilo(entrada_id, nombre):
+    try:
+        procesar_imagen(entrada_id, nombre)
+    finally:
+        connection.close()  # Cada hilo del pool abre su propia conexion a la base
+
+def encolar_procesamiento_imagen(entrada_id, nombre):
+    # Con BITACORA_IMAGENES_SINCRONO (tests) se procesa en el mismo request
+    if settings.BITACORA_IMAGENES_SINCRONO:
+        procesar_imagen(entrada_id, nombre)
+    else:
+        pool_imagenes().submit(procesar_imagen_en_hilo, entrada_id, nombre)
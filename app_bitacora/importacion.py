@@ -0,0 +1,260 @@
+import csv
+import io
+import json
+import logging
+import time
+
+from collections import Counter
+from django import forms
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Entrada, Coleccion, EntradaColeccion
+from .cache import invalidar_fragmentos_usuario, invalidar_feed
+from .validaciones import validar_fecha_no_futura, validar_campo_no_repetido
+from .contadores import sumar_entradas_usuario, sumar_vinculos
+
+logger = logging.getLogger(__name__)
+
+FORMATO_JSONL = 'jsonl'
+FORMATO_CSV = 'csv'
+OPCIONES_FORMATO = [
+    (FORMATO_JSONL, 'JSON Lines (.jsonl)'),
+    (FORMATO_CSV, 'CSV (.csv)'),
+]
+
+# En el CSV solo van entradas; las colecciones de cada entrada se separan con "|"
+COLUMNAS_CSV = ['detalle_entrada', 'fecha_entrada', 'tipo_entrada', 'colecciones']
+SEPARADOR_COLECCIONES = '|'
+
+LOTE_IMPORTACION = 1000
+MAXIMO_ERRORES_REPORTADOS = 100
+
+def verificar_codificacion(archivo):
+    '''
+        Recorre el archivo de a una linea y verifica que este en UTF-8 antes de importar nada: si falla a mitad
+        de la importacion los lotes anteriores ya quedaron guardados. Un CSV guardado desde Excel suele venir
+        en Latin-1.
+    '''
+    binario = getattr(archivo, 'file', archivo)
+    binario.seek(0)
+    try:
+        for numero, linea in enumerate(binario, start=1):
+            try:
+                linea.decode('utf-8-sig' if numero == 1 else 'utf-8')
+            except UnicodeDecodeError:
+                raise forms.ValidationError(f"El archivo no está codificado en UTF-8 (línea {numero}). "
+                                            "Vuelva a guardarlo como UTF-8 e intente nuevamente.")
+    finally:
+        binario.seek(0)
+
+def leer_filas(archivo, formato):
+    '''
+        Lee el archivo de a una fila por vez (nunca entero en memoria) y devuelve pares (numero de linea, fila).
+        En JSONL cada linea es una entrada, o una coleccion si tiene "nombre_coleccion".
+    '''
+    texto = io.TextIOWrapper(getattr(archivo, 'file', archivo), encoding='utf-8-sig', newline='')
+    if formato == FORMATO_CSV:
+        lector = csv.DictReader(texto)
+        while True:
+            try:
+                fila = next(lector)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                # Comillas mal cerradas, bytes nulos o un campo enorme: desde ahi no se puede seguir leyendo
+                yield lector.line_num, forms.ValidationError(f"El CSV no es válido ({e}), no se leyó el resto del archivo.")
+                return
+            colecciones = fila.get('colecciones') or ''
+            fila['colecciones'] = [nombre for nombre in colecciones.split(SEPARADOR_COLECCIONES) if nombre.strip()]
+            yield lector.line_num, fila
+    else:
+        for numero, linea in enumerate(texto, start=1):
+            if not linea.strip():
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                fila = None
+            yield numero, fila
+
+def validar_coleccion(fila, nombres_usados):
+    nombre = str(fila.get('nombre_coleccion') or '').strip()
+    detalle = str(fila.get('detalle_coleccion') or '').strip()
+    if not nombre or len(nombre) > 80:
+        raise forms.ValidationError("El nombre de la colección es obligatorio y no puede superar los 80 caracteres.")
+    if len(detalle) > 400:
+        raise forms.ValidationError("El detalle de la colección no puede superar los 400 caracteres.")
+    validar_campo_no_repetido(nombre, nombres_usados)
+    return nombre, detalle
+
+def validar_entrada(fila):
+    detalle = str(fila.get('detalle_entrada') or '').strip()
+    if not detalle or len(detalle) > 800:
+        raise forms.ValidationError("El detalle de la entrada es obligatorio y no puede superar los 800 caracteres.")
+
+    try:
+        fecha = parse_datetime(str(fila.get('fecha_entrada') or ''))
+    except ValueError:  # Bien formada pero inexistente, ej. 2024-02-30
+        fecha = None
+    if fecha is None:
+        raise forms.ValidationError("La fecha no tiene un formato válido (se espera ISO 8601, por ejemplo 2024-05-01T18:30).")
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    validar_fecha_no_futura(fecha)
+
+    tipo = fila.get('tipo_entrada') or 'privada'
+    if not isinstance(tipo, str) or tipo not in Entrada.OPCIONES_TIPO_ENTRADA:
+        raise forms.ValidationError(f"El tipo de entrada tiene que ser {' o '.join(Entrada.OPCIONES_TIPO_ENTRADA)}.")
+
+    colecciones = fila.get('colecciones') or []
+    if not isinstance(colecciones, list):
+        raise forms.ValidationError("Las colecciones tienen que ser una lista de nombres.")
+    nombres = [str(nombre).strip() for nombre in colecciones if str(nombre).strip()]
+    if any(len(nombre) > 80 for nombre in nombres):
+        raise forms.ValidationError("Los nombres de las colecciones no pueden superar los 80 caracteres.")
+    return detalle, fecha, tipo, nombres
+
+class Importacion:
+    '''
+        Importa las filas en lotes: cada LOTE_IMPORTACION entradas validas se guardan con un bulk_create
+        (y otro para los vinculos con las colecciones), asi la memoria no crece con el tamanio del archivo.
+        Las filas con errores se saltean y se informan con su numero de linea.
+    '''
+
+    def __init__(self, usuario, lote=None):
+        self.usuario = usuario
+        self.lote = lote or LOTE_IMPORTACION
+        self.colecciones = dict(Coleccion.objects.filter(usuario=usuario).values_list('nombre_coleccion', 'id'))
+        self.pendientes = []  # (Entrada, [nombres de colecciones])
+        self.importadas = 0
+        self.colecciones_creadas = 0
+        self.errores = []
+        self.cantidad_errores = 0
+        self.hay_publicas = False
+
+    def agregar_error(self, numero, mensaje):
+        self.cantidad_errores += 1
+        if len(self.errores) < MAXIMO_ERRORES_REPORTADOS:
+            self.errores.append((numero, mensaje))
+
+    def procesar(self, filas):
+        inicio = time.perf_counter()
+        for numero, fila in filas:
+            if isinstance(fila, forms.ValidationError):  # El archivo no se pudo seguir leyendo (ver leer_filas)
+                self.agregar_error(numero, fila.messages[0])
+                continue
+            if not isinstance(fila, dict):
+                self.agregar_error(numero, "La línea no es un objeto JSON válido.")
+                continue
+            try:
+                if 'nombre_coleccion' in fila:
+                    nombre, detalle = validar_coleccion(fila, list(self.colecciones))
+                    self.colecciones[nombre] = Coleccion.objects.create(
+                        nombre_coleccion=nombre, detalle_coleccion=detalle, usuario=self.usuario).id
+                    self.colecciones_creadas += 1
+                    continue
+                detalle, fecha, tipo, colecciones = validar_entrada(fila)
+            except forms.ValidationError as e:
+                self.agregar_error(numero, e.messages[0])
+                continue
+            except (ValueError, TypeError):
+                # Cualquier otro valor inesperado invalida la fila, no la importacion entera
+                logger.warning("Fila %d con valores invalidos", numero, exc_info=True)
+                self.agregar_error(numero, "La fila tiene valores con un formato inválido.")
+                continue
+
+            self.pendientes.append((Entrada(detalle_entrada=detalle, fecha_entrada=fecha, tipo_entrada=tipo,
+                                            usuario=self.usuario), colecciones))
+            self.hay_publicas = self.hay_publicas or tipo == 'publica'
+            if len(self.pendientes) >= self.lote:
+                self.guardar_lote()
+        self.guardar_lote()
+
+        # bulk_create no dispara las signals, asi que los caches se invalidan una sola vez al final
+        invalidar_fragmentos_usuario(self.usuario.id)
+        if self.hay_publicas:
+            invalidar_feed()
+
+        segundos = time.perf_counter() - inicio
+        resultado = {
+            'importadas': self.importadas,
+            'colecciones_creadas': self.colecciones_creadas,
+            'errores': self.errores,
+            'cantidad_errores': self.cantidad_errores,
+            'segundos': round(segundos, 2),
+            'filas_por_segundo': round((self.importadas + self.cantidad_errores) / segundos) if segundos else None,
+        }
+        logger.info("Importacion de %s: %d entradas, %d errores, %s filas/s", self.usuario,
+                    self.importadas, self.cantidad_errores, resultado['filas_por_segundo'])
+        return resultado
+
+    def guardar_lote(self):
+        if not self.pendientes:
+            return
+        with transaction.atomic():
+            # Las colecciones que se nombran en las entradas y todavia no existen se crean juntas
+            nuevas = {nombre for _, nombres in self.pendientes for nombre in nombres if nombre not in self.colecciones}
+            if nuevas:
+                creadas = Coleccion.objects.bulk_create([
+                    Coleccion(nombre_coleccion=nombre, detalle_coleccion='Importada', usuario=self.usuario)
+                    for nombre in sorted(nuevas)
+                ])
+                self.colecciones.update((coleccion.nombre_coleccion, coleccion.id) for coleccion in creadas)
+                self.colecciones_creadas += len(creadas)
+
+            entradas = Entrada.objects.bulk_create([entrada for entrada, _ in self.pendientes])
+            vinculos = EntradaColeccion.objects.bulk_create([
+                EntradaColeccion(entrada_id=entrada.id, coleccion_id=self.colecciones[nombre])
+                for entrada, (_, nombres) in zip(entradas, self.pendientes)
+                for nombre in set(nombres)
+            ])
+            # bulk_create no envia señales, los contadores se actualizan una vez por lote
+            sumar_entradas_usuario(self.usuario.id, Counter(entrada.tipo_entrada for entrada in entradas))
+            sumar_vinculos((vinculo.entrada_id, vinculo.coleccion_id) for vinculo in vinculos)
+        self.importadas += len(entradas)
+        self.pendientes = []
+
+def importar_entradas(usuario, archivo, formato, lote=None):
+    return Importacion(usuario, lote=lote).procesar(leer_filas(archivo, formato))
+
+class Eco:
+    # "Archivo" que devuelve lo que se le escribe, para generar el CSV de a una linea con csv.writer
+    def write(self, valor):
+        return valor
+
+def exportar_entradas(usuario, formato, tamanio_lote=2000):
+    '''
+        Generador con las lineas del archivo exportado, para usar con StreamingHttpResponse.
+        Las entradas se leen con iterator(), de a tamanio_lote por vez con sus colecciones precargadas.
+    '''
+    inicio = time.perf_counter()
+    cantidad = 0
+    entradas = (Entrada.objects.filter(usuario=usuario)
+                .only('detalle_entrada', 'fecha_entrada', 'tipo_entrada')
+                .prefetch_related(Prefetch('colecciones', queryset=Coleccion.objects.only('nombre_coleccion')))
+                .order_by('fecha_entrada', 'id'))
+
+    if formato == FORMATO_CSV:
+        escritor = csv.writer(Eco())
+        yield escritor.writerow(COLUMNAS_CSV)
+    else:
+        colecciones = Coleccion.objects.filter(usuario=usuario).order_by('nombre_coleccion').values_list('nombre_coleccion', 'detalle_coleccion')
+        for nombre, detalle in colecciones.iterator(chunk_size=tamanio_lote):
+            yield json.dumps({'nombre_coleccion': nombre, 'detalle_coleccion': detalle}, ensure_ascii=False) + '\n'
+
+    for entrada in entradas.iterator(chunk_size=tamanio_lote):
+        nombres = [coleccion.nombre_coleccion for coleccion in entrada.colecciones.all()]
+        fecha = entrada.fecha_entrada.isoformat()
+        if formato == FORMATO_CSV:
+            yield escritor.writerow([entrada.detalle_entrada, fecha, entrada.tipo_entrada, SEPARADOR_COLECCIONES.join(nombres)])
+        else:
+            yield json.dumps({'detalle_entrada': entrada.detalle_entrada, 'fecha_entrada': fecha,
+                              'tipo_entrada': entrada.tipo_entrada, 'colecciones': nombres}, ensure_ascii=False) + '\n'
+        cantidad += 1
+
+    segundos = time.perf_counter() - inicio
+    logger.info("Exportacion de %s: %d entradas en %.2f s (%s filas/s)", usuario, cantidad, segundos,
+                round(cantidad / segundos) if segundos else None)
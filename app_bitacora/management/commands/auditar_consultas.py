@@ -0,0 +1,121 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app_bitacora.datos_sinteticos import generar_entradas, generar_colecciones
+from app_bitacora.models import Usuario, Coleccion
+
+def urls_a_auditar(coleccion):
+    # Las vistas de lectura con sus filtros mas comunes (tambien las recorre perf_report)
+    url_entradas = reverse('bitacora:mis_entradas')
+    return {
+        'pagina_principal': reverse('bitacora:pagina_principal'),
+        'mis_entradas': url_entradas,
+        'mis_entradas (tipo)': f"{url_entradas}?tipo_entrada=publica",
+        'mis_entradas (coleccion)': f"{url_entradas}?coleccion={coleccion.id}",
+        'mis_entradas (coleccion + tipo)': f"{url_entradas}?coleccion={coleccion.id}&tipo_entrada=privada",
+        'mis_entradas (busqueda)': f"{url_entradas}?busqueda_x_detalle_entrada=caminata",
+        'mis_entradas (busqueda parcial)': f"{url_entradas}?busqueda_x_detalle_entrada=camin&modo_busqueda=parcial",
+        'mis_colecciones': reverse('bitacora:mis_colecciones'),
+        'detalle_coleccion': reverse('bitacora:detalle_coleccion', args=[coleccion.id]),
+        'api_entradas': f"{reverse('bitacora:api_entradas')}?tipo_entrada=publica&fields=id,fecha_entrada,colecciones",
+        'api_feed': reverse('bitacora:api_feed'),
+    }
+
+class Command(BaseCommand):
+    help = ("Carga datos sinteticos, recorre las vistas con el cliente de pruebas y corre EXPLAIN ANALYZE "
+            "sobre cada consulta de la app, con el plan que elegiria el motor. Falla si alguna consulta lee con "
+            "un Seq Scan mas de --filas-seqscan filas. Con --forzar-indices se deshabilita enable_seqscan y falla "
+            "cualquier Seq Scan (muestra que falta un indice, aunque el motor podria no usarlo). "
+            "Solo funciona con PostgreSQL y los datos generados se descartan al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=20)
+        parser.add_argument('--entradas-por-usuario', type=int, default=1000)
+        parser.add_argument('--colecciones-por-usuario', type=int, default=10)
+        parser.add_argument('--filas-seqscan', type=int, default=1000,
+                            help="Filas que puede leer un Seq Scan antes de considerarlo un problema (en tablas chicas es lo mas rapido)")
+        parser.add_argument('--forzar-indices', action='store_true',
+                            help="Deshabilita enable_seqscan: el planificador usa un indice siempre que exista uno que sirva")
+
+    def nodos_del_plan(self, nodo):
+        yield nodo
+        for hijo in nodo.get('Plans', []):
+            yield from self.nodos_del_plan(hijo)
+
+    def explicar(self, sql, forzar_indices):
+        with connection.cursor() as cursor:
+            if forzar_indices:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+                plan = cursor.fetchone()[0]
+            finally:
+                if forzar_indices:
+                    # SET LOCAL dura hasta el final de la transaccion, no solo para esta consulta
+                    cursor.execute('RESET enable_seqscan')
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def seqscans(self, plan, filas_permitidas):
+        # (tabla, filas leidas) de los Seq Scan que son un problema
+        for nodo in self.nodos_del_plan(plan[0]['Plan']):
+            if nodo['Node Type'] != 'Seq Scan':
+                continue
+            filas = (nodo.get('Actual Rows', 0) + nodo.get('Rows Removed by Filter', 0)) * nodo.get('Actual Loops', 1)
+            if filas > filas_permitidas:
+                yield nodo['Relation Name'], filas
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("La auditoria usa EXPLAIN ANALYZE y solo funciona con PostgreSQL.")
+
+        setup_test_environment()  # Habilita el host 'testserver' del cliente de pruebas
+        problemas = []
+        try:
+            with transaction.atomic():
+                self.stdout.write("Generando datos...")
+                usuarios = []
+                for numero in range(options['usuarios']):
+                    usuario = Usuario.objects.create_user(username=f'auditoria{numero}', email=f'auditoria{numero}@bitacora.local')
+                    generar_entradas(usuario, options['entradas_por_usuario'], semilla=numero)
+                    generar_colecciones(usuario, options['colecciones_por_usuario'], semilla=numero)
+                    usuarios.append(usuario)
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+
+                cliente = Client()
+                cliente.force_login(usuarios[0])
+                coleccion = Coleccion.objects.filter(usuario=usuarios[0]).first()
+
+                for vista, url in urls_a_auditar(coleccion).items():
+                    with CaptureQueriesContext(connection) as contexto:
+                        respuesta = cliente.get(url)
+                    if respuesta.status_code != 200:
+                        problemas.append(f"{vista}: respondio {respuesta.status_code}")
+                        continue
+
+                    consultas = [c['sql'] for c in contexto.captured_queries
+                                 if c['sql'].startswith('SELECT') and 'app_bitacora_' in c['sql']]
+                    # Con --forzar-indices cualquier Seq Scan significa que falta un indice
+                    filas_permitidas = -1 if options['forzar_indices'] else options['filas_seqscan']
+                    for numero, sql in enumerate(consultas, start=1):
+                        plan = self.explicar(sql, options['forzar_indices'])
+                        secuenciales = ', '.join(f'{tabla} ({filas} filas)' for tabla, filas in self.seqscans(plan, filas_permitidas))
+                        tiempo = plan[0]['Execution Time']
+                        if secuenciales:
+                            problemas.append(f"{vista} [{numero}]: Seq Scan sobre {secuenciales}\n    {sql}")
+                            self.stdout.write(self.style.ERROR(f"  {vista} [{numero}]: {tiempo:.2f} ms SEQ SCAN ({secuenciales})"))
+                        else:
+                            self.stdout.write(f"  {vista} [{numero}]: {tiempo:.2f} ms")
+
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+        if problemas:
+            raise CommandError("Consultas con Seq Scan:\n" + "\n".join(problemas))
+        self.stdout.write(self.style.SUCCESS("Ninguna consulta tiene un Seq Scan problematico."))
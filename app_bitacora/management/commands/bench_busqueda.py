@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from app_bitacora.busqueda import buscar_por_icontains, buscar_texto_completo, separar_palabras, usa_postgres
+from app_bitacora.datos_sinteticos import generar_entradas
+from app_bitacora.models import Usuario, Entrada
+
+class Command(BaseCommand):
+    help = ("Compara la busqueda de mis_entradas con la cadena de icontains contra la busqueda de texto completo "
+            "a distintos volumenes de entradas. Los datos generados se descartan al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanios', nargs='+', type=int, default=[10_000, 100_000, 1_000_000],
+                            help="Cantidades de entradas del usuario a medir")
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--busquedas', nargs='+', default=['caminata montaña', 'cancion', 'cafe amigos noche'])
+        parser.add_argument('--resultados', type=int, default=50, help="Cantidad de resultados que se traen en cada busqueda")
+
+    def medir(self, armar_consulta, repeticiones, resultados):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            encontrados = list(armar_consulta().values_list('id', flat=True)[:resultados])
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return statistics.median(tiempos), len(encontrados)
+
+    def handle(self, *args, **options):
+        postgres = usa_postgres(Entrada.objects.all())
+        if not postgres:
+            self.stdout.write(self.style.WARNING("La base no es PostgreSQL: solo se mide la cadena de icontains."))
+
+        self.stdout.write(f"{'entradas':>9} | {'busqueda':<20} | {'icontains ms':>12} | {'encontradas':>11} | {'texto completo ms':>17} | {'encontradas':>11}")
+        with transaction.atomic():
+            usuario = Usuario.objects.create_user(username='bench_busqueda', email='bench_busqueda@bitacora.local')
+            entradas = Entrada.objects.filter(usuario=usuario).order_by('-fecha_entrada')
+            generadas = 0
+            for tamanio in sorted(options['tamanios']):
+                generar_entradas(usuario, tamanio - generadas, semilla=tamanio)
+                generadas = tamanio
+                if postgres:
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE app_bitacora_entrada')
+
+                for busqueda in options['busquedas']:
+                    ms_icontains, encontradas_icontains = self.medir(
+                        lambda: buscar_por_icontains(entradas, busqueda.split()), options['repeticiones'], options['resultados'])
+                    fila = f"{tamanio:>9} | {busqueda:<20} | {ms_icontains:>12.2f} | {encontradas_icontains:>11}"
+                    if postgres:
+                        ms_texto, encontradas_texto = self.medir(
+                            lambda: buscar_texto_completo(entradas, separar_palabras(busqueda)), options['repeticiones'], options['resultados'])
+                        fila += f" | {ms_texto:>17.2f} | {encontradas_texto:>11}"
+                    self.stdout.write(fila)
+
+            # No dejo los datos del benchmark en la base
+            transaction.set_rollback(True)
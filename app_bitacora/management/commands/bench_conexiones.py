@@ -0,0 +1,88 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app_bitacora.management.commands.carga_lectura import percentil
+from app_bitacora.models import Usuario
+
+# Modos a comparar: (nombre, CONN_MAX_AGE, opciones del pool)
+MODOS = [
+    ('sin pool', 0, None),
+    ('persistentes', 600, None),
+    ('pool', 0, {'min_size': 1, 'max_size': 10}),
+]
+
+class Command(BaseCommand):
+    help = ("Mide la latencia de una vista contra PostgreSQL abriendo una conexion nueva por request, con conexiones "
+            "persistentes y con el pool de psycopg. Los requests se hacen dentro del proceso, cerrando las conexiones "
+            "al terminar cada uno como lo hace el servidor, asi la diferencia es solo el costo de conectarse.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help="Pide mis_entradas con este usuario (por defecto se pide api/feed)")
+        parser.add_argument('--ruta', help="Ruta a pedir")
+        parser.add_argument('--requests', type=int, default=500, help="Requests por hilo en cada modo")
+        parser.add_argument('--hilos', type=int, default=4, help="Hilos simultaneos (como los hilos de un worker)")
+
+    def cliente(self, ruta, usuario, cantidad, latencias, lock):
+        cliente = Client()
+        if usuario:
+            cliente.force_login(usuario)
+        propias = []
+        for _ in range(cantidad):
+            inicio = time.perf_counter()
+            close_old_connections()  # request_started
+            respuesta = cliente.get(ruta)
+            close_old_connections()  # request_finished: cierra la conexion o la devuelve al pool
+            propias.append(time.perf_counter() - inicio)
+            if respuesta.status_code != 200:
+                raise CommandError(f"{ruta} respondio {respuesta.status_code}.")
+        connection.close()
+        with lock:
+            latencias.extend(propias)
+
+    def medir(self, nombre, ruta, usuario, options):
+        latencias, lock = [], threading.Lock()
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['hilos']) as pool:
+            futuros = [pool.submit(self.cliente, ruta, usuario, options['requests'], latencias, lock)
+                       for _ in range(options['hilos'])]
+            for futuro in futuros:
+                futuro.result()
+        segundos = time.perf_counter() - inicio
+        latencias.sort()
+        self.stdout.write(f"{nombre:>13}: {len(latencias) / segundos:8.1f} req/s  "
+                          f"p50 {percentil(latencias, 0.50) * 1000:6.2f} ms  p99 {percentil(latencias, 0.99) * 1000:6.2f} ms")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("El benchmark de conexiones es para PostgreSQL.")
+        usuario = None
+        if options['usuario']:
+            try:
+                usuario = Usuario.objects.get(username=options['usuario'])
+            except Usuario.DoesNotExist:
+                raise CommandError(f"No existe el usuario {options['usuario']}.")
+        ruta = options['ruta'] or reverse('bitacora:mis_entradas' if usuario else 'bitacora:api_feed')
+
+        configuracion = connection.settings_dict
+        original = (configuracion['CONN_MAX_AGE'], configuracion['OPTIONS'].get('pool'))
+        setup_test_environment()  # Habilita el host 'testserver' del cliente de pruebas
+        try:
+            for nombre, edad_maxima, pool in MODOS:
+                connections.close_all()
+                connection.close_pool()
+                configuracion['CONN_MAX_AGE'] = edad_maxima
+                configuracion['OPTIONS']['pool'] = pool
+                self.medir(nombre, ruta, usuario, options)
+        finally:
+            connections.close_all()
+            connection.close_pool()
+            configuracion['CONN_MAX_AGE'], configuracion['OPTIONS']['pool'] = original
+            teardown_test_environment()
@@ -0,0 +1,99 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app_bitacora.acceso import cache_login
+from app_bitacora.management.commands.carga_lectura import percentil
+from app_bitacora.models import Usuario
+
+PASSWORD = 'bench-login-correcta'
+SIN_LIMITE = {'BITACORA_LOGIN_INTENTOS_IP': 10 ** 9, 'BITACORA_LOGIN_INTENTOS_USUARIO': 10 ** 9}
+
+class Command(BaseCommand):
+    help = ("Mide cuantos inicios de sesion por segundo atiende un proceso con una mezcla de ataque: usuarios "
+            "legitimos, credential stuffing sobre cuentas existentes y sobre nombres que no existen, desde unas "
+            "pocas IPs. Compara cada hasher de contraseñas con y sin el limite de intentos. Los usuarios que se "
+            "crean se descartan al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashers', nargs='+', help="Hashers a comparar (por defecto todos los de PASSWORD_HASHERS)")
+        parser.add_argument('--intentos', type=int, default=500, help="Pedidos de cada combinacion")
+        parser.add_argument('--proporcion-legitimos', type=float, default=0.1)
+        parser.add_argument('--proporcion-inexistentes', type=float, default=0.5,
+                            help="De los intentos del ataque, cuantos usan nombres que no existen")
+        parser.add_argument('--usuarios', type=int, default=20)
+        parser.add_argument('--ips-atacantes', type=int, default=5)
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def hashers(self, elegidos):
+        # Nombre corto (como en PASSWORD_HASHER) -> ruta de la clase
+        disponibles = {ruta.rsplit('.', 1)[1].replace('Configurable', '').lower(): ruta
+                       for ruta in settings.PASSWORD_HASHERS if ruta.startswith('app_bitacora.')}
+        faltantes = set(elegidos or []) - set(disponibles)
+        if faltantes:
+            raise CommandError(f"Hashers no disponibles: {', '.join(faltantes)} (hay {', '.join(disponibles)}).")
+        return {nombre: ruta for nombre, ruta in disponibles.items() if not elegidos or nombre in elegidos}
+
+    def intentos(self, usernames, options):
+        # (username, password, ip, legitimo), siempre la misma secuencia para cada combinacion
+        aleatorio = random.Random(options['semilla'])
+        ips = [f'203.0.113.{numero}' for numero in range(options['ips_atacantes'])]
+        for numero in range(options['intentos']):
+            if aleatorio.random() < options['proporcion_legitimos']:
+                yield aleatorio.choice(usernames), PASSWORD, f'198.51.100.{numero % 250}', True
+            elif aleatorio.random() < options['proporcion_inexistentes']:
+                yield f'filtrado{aleatorio.randint(0, 10 ** 6)}', 'password123', aleatorio.choice(ips), False
+            else:
+                yield aleatorio.choice(usernames), f'password{aleatorio.randint(0, 10 ** 6)}', aleatorio.choice(ips), False
+
+    def medir(self, usernames, options):
+        cache_login().clear()
+        url = reverse('bitacora:iniciar_sesion')
+        latencias_legitimos, legitimos, aceptados, bloqueados = [], 0, 0, 0
+        inicio = time.perf_counter()
+        for username, password, ip, legitimo in self.intentos(usernames, options):
+            cliente = Client()
+            comienzo = time.perf_counter()
+            respuesta = cliente.post(url, {'nombre': username, 'password': password}, REMOTE_ADDR=ip)
+            if respuesta.status_code == 429:
+                bloqueados += 1
+            if legitimo:
+                legitimos += 1
+                latencias_legitimos.append((time.perf_counter() - comienzo) * 1000)
+                aceptados += respuesta.status_code == 302
+        segundos = time.perf_counter() - inicio
+        latencias_legitimos.sort()
+        return (options['intentos'] / segundos, bloqueados / options['intentos'],
+                aceptados / legitimos if legitimos else 1, percentil(latencias_legitimos, 0.5) if legitimos else 0)
+
+    def handle(self, *args, **options):
+        hashers = self.hashers(options['hashers'])
+        self.stdout.write(f"{'hasher':<8} {'limite':<6} {'req/s':>8} {'bloqueados':>10} {'legitimos ok':>12} {'p50 legitimos':>14}")
+        setup_test_environment()  # Habilita el host 'testserver' del cliente de pruebas
+        try:
+            for nombre, ruta in hashers.items():
+                # El hasher medido va primero, si no cada login correcto volveria a hashear con el preferido
+                preferidos = [ruta] + [otro for otro in settings.PASSWORD_HASHERS if otro != ruta]
+                with transaction.atomic(), override_settings(PASSWORD_HASHERS=preferidos):
+                    hash_password = make_password(PASSWORD)
+                    usuarios = Usuario.objects.bulk_create([
+                        Usuario(username=f'bench_login{numero}', email=f'bench_login{numero}@bitacora.local', password=hash_password)
+                        for numero in range(options['usuarios'])
+                    ])
+                    usernames = [usuario.username for usuario in usuarios]
+                    for limite, ajustes in (('no', SIN_LIMITE), ('si', {})):
+                        with override_settings(**ajustes):
+                            por_segundo, bloqueados, aceptados, mediana = self.medir(usernames, options)
+                        self.stdout.write(f"{nombre:<8} {limite:<6} {por_segundo:>8.1f} {bloqueados:>10.0%} "
+                                          f"{aceptados:>12.0%} {mediana:>11.1f} ms")
+                    transaction.set_rollback(True)
+        finally:
+            cache_login().clear()
+            teardown_test_environment()
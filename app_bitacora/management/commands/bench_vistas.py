@@ -0,0 +1,196 @@
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from app_bitacora.datos_sinteticos import generar_dataset
+from app_bitacora.forms import ACCION_AGREGAR, ACCION_QUITAR
+from app_bitacora.management.commands.carga_lectura import percentil
+from app_bitacora.models import Entrada, Coleccion
+
+# Una regresion es una latencia mediana o una memoria pico mayor que la del baseline en mas de esta proporcion
+# (y de un minimo absoluto, para no fallar por ruido en las vistas mas rapidas) o cualquier consulta de mas
+TOLERANCIA_LATENCIA = 0.25
+MINIMO_LATENCIA_MS = 2
+TOLERANCIA_MEMORIA = 0.25
+MINIMO_MEMORIA_KB = 64
+
+def escenarios_lectura(coleccion):
+    url_entradas = reverse('bitacora:mis_entradas')
+    escenarios = {
+        'pagina_principal': reverse('bitacora:pagina_principal'),
+        'mis_colecciones': reverse('bitacora:mis_colecciones'),
+        'detalle_coleccion': reverse('bitacora:detalle_coleccion', args=[coleccion.id]),
+    }
+    # mis_entradas con cada combinacion de filtros
+    tipos = ['', 'publica', 'privada']
+    colecciones = ['', str(coleccion.id)]
+    busquedas = [{}, {'busqueda_x_detalle_entrada': 'caminata montaña'},
+                 {'busqueda_x_detalle_entrada': 'camin', 'modo_busqueda': 'parcial'}]
+    for tipo, id_coleccion, busqueda in itertools.product(tipos, colecciones, busquedas):
+        filtros = {'tipo_entrada': tipo, 'coleccion': id_coleccion, **busqueda}
+        nombre = ' + '.join(f'{campo}={valor}' for campo, valor in filtros.items() if valor) or 'sin filtros'
+        escenarios[f'mis_entradas ({nombre})'] = f"{url_entradas}?{'&'.join(f'{c}={v}' for c, v in filtros.items() if v)}"
+    hoy = timezone.localdate()
+    escenarios['mis_entradas (ultima semana)'] = f"{url_entradas}?fecha_desde={hoy - timedelta(days=7)}&fecha_hasta={hoy}"
+    return {nombre: (lambda url=url: ('get', url, None)) for nombre, url in escenarios.items()}
+
+def escenarios_escritura(usuario, coleccion):
+    # Cada escenario arma el pedido de cada repeticion; lo que prepara (ej. la entrada a eliminar) no se mide
+    fecha = (timezone.now() - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M')
+    entradas = list(Entrada.objects.filter(usuario=usuario).order_by('-fecha_entrada').values_list('id', flat=True)[:20])
+    contador = itertools.count()
+
+    def agregar_entrada():
+        return 'post', reverse('bitacora:agregar_entrada'), {
+            'detalle_entrada': 'Entrada del benchmark', 'fecha_entrada': fecha, 'tipo_entrada': 'publica'}
+
+    def editar_entrada():
+        return 'post', reverse('bitacora:editar_entrada', args=[entradas[0]]), {
+            'detalle_entrada': f'Editada {next(contador)}', 'fecha_entrada': fecha, 'tipo_entrada': 'privada'}
+
+    def eliminar_entrada():
+        entrada = Entrada.objects.create(detalle_entrada='A eliminar', fecha_entrada=timezone.now(),
+                                         tipo_entrada='publica', usuario=usuario)
+        return 'post', reverse('bitacora:eliminar_entrada', args=[entrada.id]), {}
+
+    def agregar_coleccion():
+        return 'post', reverse('bitacora:agregar_coleccion'), {
+            'nombre_coleccion': f'Benchmark {next(contador)}', 'detalle_coleccion': 'Coleccion del benchmark'}
+
+    def organizar_entradas():
+        # Alterna entre agregar y quitar las mismas entradas, asi cada pedido cambia algo
+        accion = ACCION_AGREGAR if next(contador) % 2 == 0 else ACCION_QUITAR
+        return 'post', reverse('bitacora:organizar_entradas'), {
+            'accion': accion, 'entradas': entradas, 'colecciones': [coleccion.id]}
+
+    return {'agregar_entrada': agregar_entrada, 'editar_entrada': editar_entrada, 'eliminar_entrada': eliminar_entrada,
+            'agregar_coleccion': agregar_coleccion, 'organizar_entradas': organizar_entradas}
+
+class Command(BaseCommand):
+    help = ("Benchmark reproducible de las vistas: genera un conjunto de datos sintetico (ver seed_bitacora), "
+            "recorre con el cliente de pruebas pagina_principal, mis_entradas con cada combinacion de filtros, "
+            "mis_colecciones y las vistas de escritura, y mide percentiles de latencia, consultas y memoria pico "
+            "de cada una. Con --guardar los resultados quedan como baseline; sin --guardar se comparan con el "
+            "baseline y el comando falla si hay regresiones. Los datos se descartan al terminar (las imagenes "
+            "sinteticas quedan en MEDIA_ROOT, siempre las mismas).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=50)
+        parser.add_argument('--entradas', type=int, default=20_000)
+        parser.add_argument('--proporcion-imagenes', type=float, default=0.1)
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--repeticiones', type=int, default=30, help="Pedidos medidos de cada escenario")
+        parser.add_argument('--calentamiento', type=int, default=3, help="Pedidos previos que no se miden")
+        parser.add_argument('--escenario', action='append', dest='escenarios', help="Solo los escenarios que empiezan asi")
+        parser.add_argument('--baseline', default='bench_vistas.json', help="Archivo JSON del baseline")
+        parser.add_argument('--guardar', action='store_true', help="Guarda los resultados como baseline")
+
+    def pedir(self, cliente, pedido):
+        metodo, url, datos = pedido
+        respuesta = getattr(cliente, metodo)(url, datos)
+        if respuesta.status_code not in (200, 302):
+            raise CommandError(f"{metodo.upper()} {url} respondio {respuesta.status_code}.")
+
+    def medir(self, cliente, armar, options):
+        cache.clear()
+        for _ in range(options['calentamiento']):
+            self.pedir(cliente, armar())
+        latencias, consultas = [], []
+        for _ in range(options['repeticiones']):
+            pedido = armar()
+            with CaptureQueriesContext(connection) as contexto:
+                inicio = time.perf_counter()
+                self.pedir(cliente, pedido)
+                latencias.append((time.perf_counter() - inicio) * 1000)
+            consultas.append(len(contexto))
+        # La memoria se mide en un pedido aparte, tracemalloc hace mas lento todo lo demas
+        pedido = armar()
+        tracemalloc.start()
+        try:
+            self.pedir(cliente, pedido)
+            memoria = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        latencias.sort()
+        return {
+            'p50_ms': round(percentil(latencias, 0.50), 2),
+            'p95_ms': round(percentil(latencias, 0.95), 2),
+            'p99_ms': round(percentil(latencias, 0.99), 2),
+            'consultas': max(consultas),
+            'memoria_kb': round(memoria / 1024),
+        }
+
+    def comparar(self, baseline, resultados):
+        regresiones = []
+        for nombre, actual in resultados.items():
+            anterior = baseline.get(nombre)
+            if anterior is None:
+                continue
+            if actual['p50_ms'] > anterior['p50_ms'] * (1 + TOLERANCIA_LATENCIA) + MINIMO_LATENCIA_MS:
+                regresiones.append(f"{nombre}: p50 {anterior['p50_ms']} -> {actual['p50_ms']} ms")
+            if actual['consultas'] > anterior['consultas']:
+                regresiones.append(f"{nombre}: {anterior['consultas']} -> {actual['consultas']} consultas")
+            if actual['memoria_kb'] > anterior['memoria_kb'] * (1 + TOLERANCIA_MEMORIA) + MINIMO_MEMORIA_KB:
+                regresiones.append(f"{nombre}: memoria {anterior['memoria_kb']} -> {actual['memoria_kb']} KB")
+        return regresiones
+
+    def handle(self, *args, **options):
+        datos = {clave: options[clave] for clave in ('usuarios', 'entradas', 'proporcion_imagenes', 'semilla')}
+        datos['base'] = connection.vendor
+        baseline = None
+        if not options['guardar']:
+            if not os.path.exists(options['baseline']):
+                raise CommandError(f"No existe el baseline {options['baseline']}, genere uno con --guardar.")
+            with open(options['baseline'], encoding='utf-8') as archivo:
+                baseline = json.load(archivo)
+            if baseline['datos'] != datos:
+                raise CommandError(f"El baseline se midio con otros datos: {baseline['datos']}.")
+
+        resultados = {}
+        setup_test_environment()  # Habilita el host 'testserver' del cliente de pruebas
+        # Sin muestreo de metricas ni del detector de consultas: agregan ruido al azar a las mediciones
+        try:
+            with transaction.atomic(), override_settings(BITACORA_METRICAS_MUESTREO=0, BITACORA_CONSULTAS_MUESTREO=0):
+                self.stdout.write("Generando datos...")
+                usuario = generar_dataset(options['usuarios'], options['entradas'], semilla=options['semilla'],
+                                          proporcion_imagenes=options['proporcion_imagenes'], prefijo='bench_vistas')[0]
+                coleccion = Coleccion.objects.filter(usuario=usuario).order_by('id').first()
+                cliente = Client()
+                cliente.force_login(usuario)
+
+                escenarios = {**escenarios_lectura(coleccion), **escenarios_escritura(usuario, coleccion)}
+                self.stdout.write(f"{'escenario':<60} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'consultas':>9} {'memoria KB':>10}")
+                for nombre, armar in escenarios.items():
+                    if options['escenarios'] and not any(nombre.startswith(prefijo) for prefijo in options['escenarios']):
+                        continue
+                    resultado = resultados[nombre] = self.medir(cliente, armar, options)
+                    self.stdout.write(f"{nombre:<60} {resultado['p50_ms']:>8} {resultado['p95_ms']:>8} {resultado['p99_ms']:>8} "
+                                      f"{resultado['consultas']:>9} {resultado['memoria_kb']:>10}")
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+        if options['guardar']:
+            with open(options['baseline'], 'w', encoding='utf-8') as archivo:
+                json.dump({'datos': datos, 'python': platform.python_version(), 'escenarios': resultados},
+                          archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Baseline guardado en {options['baseline']}."))
+            return
+
+        regresiones = self.comparar(baseline['escenarios'], resultados)
+        if regresiones:
+            raise CommandError("Regresiones respecto del baseline:\n" + "\n".join(regresiones))
+        self.stdout.write(self.style.SUCCESS("Sin regresiones respecto del baseline."))
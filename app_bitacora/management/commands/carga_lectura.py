@@ -0,0 +1,116 @@
+import http.client
+import math
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from app_bitacora.models import Usuario
+
+# Vistas de lectura que se piden por defecto, las de mis_ necesitan --usuario
+VISTAS_LECTURA = ['bitacora:pagina_principal', 'bitacora:mis_entradas', 'bitacora:mis_colecciones']
+
+def percentil(valores, proporcion):
+    return valores[max(0, math.ceil(proporcion * len(valores)) - 1)]
+
+class Command(BaseCommand):
+    help = ("Prueba de carga de las vistas de lectura contra servidores que ya estan corriendo, para comparar "
+            "WSGI y ASGI. Ej: gunicorn mysite.wsgi -b :8001 --threads 8 y uvicorn mysite.asgi:application --port 8002, "
+            "despues: manage.py carga_lectura --wsgi http://127.0.0.1:8001 --asgi http://127.0.0.1:8002 --usuario ana. "
+            "Los servidores tienen que usar la misma base que este comando (la sesion del usuario se crea en ella).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', help="URL base del servidor WSGI")
+        parser.add_argument('--asgi', help="URL base del servidor ASGI")
+        parser.add_argument('--usuario', help="Usuario con el que se piden mis_entradas y mis_colecciones")
+        parser.add_argument('--ruta', action='append', dest='rutas', help="Ruta a pedir (se puede repetir)")
+        parser.add_argument('--concurrencia', type=int, default=50, help="Clientes simultaneos")
+        parser.add_argument('--duracion', type=float, default=10, help="Segundos de carga por servidor")
+
+    def cookie_de_sesion(self, username):
+        # Igual que Client.force_login: una sesion autenticada guardada directamente en el backend de sesiones
+        try:
+            usuario = Usuario.objects.get(username=username)
+        except Usuario.DoesNotExist:
+            raise CommandError(f"No existe el usuario {username}.")
+        sesion = import_module(settings.SESSION_ENGINE).SessionStore()
+        sesion[SESSION_KEY] = str(usuario.pk)
+        sesion[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+        sesion.save()
+        return sesion, f'{settings.SESSION_COOKIE_NAME}={sesion.session_key}'
+
+    def cliente(self, url_base, rutas, cookie, fin, resultados, numero):
+        # Cada cliente reutiliza su conexion (keep-alive) y recorre las rutas en orden
+        partes = urlsplit(url_base)
+        conexion = None
+        latencias, errores, pedido = [], 0, numero
+        while time.monotonic() < fin:
+            ruta = rutas[pedido % len(rutas)]
+            pedido += 1
+            inicio = time.perf_counter()
+            try:
+                if conexion is None:
+                    conexion = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=30)
+                conexion.request('GET', ruta, headers={'Cookie': cookie} if cookie else {})
+                respuesta = conexion.getresponse()
+                respuesta.read()
+                if respuesta.status >= 400:
+                    errores += 1
+                else:
+                    latencias.append(time.perf_counter() - inicio)
+                if respuesta.getheader('Connection', '').lower() == 'close':
+                    conexion.close()
+                    conexion = None
+            except (OSError, http.client.HTTPException):
+                errores += 1
+                if conexion is not None:
+                    conexion.close()
+                conexion = None
+        if conexion is not None:
+            conexion.close()
+        with resultados['lock']:
+            resultados['latencias'].extend(latencias)
+            resultados['errores'] += errores
+
+    def medir(self, nombre, url_base, rutas, cookie, concurrencia, duracion):
+        resultados = {'lock': threading.Lock(), 'latencias': [], 'errores': 0}
+        inicio = time.monotonic()
+        fin = inicio + duracion
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            for numero in range(concurrencia):
+                pool.submit(self.cliente, url_base, rutas, cookie, fin, resultados, numero)
+        segundos = time.monotonic() - inicio
+
+        latencias = sorted(resultados['latencias'])
+        if not latencias:
+            raise CommandError(f"{nombre}: ningun pedido respondio bien ({resultados['errores']} errores).")
+        self.stdout.write(
+            f"{nombre:>5}: {len(latencias) / segundos:8.1f} req/s  "
+            f"p50 {percentil(latencias, 0.50) * 1000:7.1f} ms  "
+            f"p99 {percentil(latencias, 0.99) * 1000:7.1f} ms  "
+            f"({len(latencias)} respuestas, {resultados['errores']} errores)")
+
+    def handle(self, *args, **options):
+        servidores = [(nombre.upper(), options[nombre]) for nombre in ('wsgi', 'asgi') if options[nombre]]
+        if not servidores:
+            raise CommandError("Indica al menos un servidor con --wsgi o --asgi.")
+
+        sesion, cookie = self.cookie_de_sesion(options['usuario']) if options['usuario'] else (None, None)
+        # Sin sesion solo tiene sentido pedir el feed
+        rutas = options['rutas'] or [reverse(vista) for vista in VISTAS_LECTURA if cookie or 'mis_' not in vista]
+
+        self.stdout.write(f"{options['concurrencia']} clientes durante {options['duracion']} s sobre {', '.join(rutas)}")
+        try:
+            for nombre, url_base in servidores:
+                self.medir(nombre, url_base, rutas, cookie, options['concurrencia'], options['duracion'])
+        finally:
+            if sesion is not None:
+                sesion.delete()
@@ -0,0 +1,37 @@
+from django import forms
+from django.core.management.base import BaseCommand, CommandError
+
+from app_bitacora.importacion import importar_entradas, verificar_codificacion, LOTE_IMPORTACION, FORMATO_CSV, FORMATO_JSONL
+from app_bitacora.models import Usuario
+
+class Command(BaseCommand):
+    help = ("Importa entradas (y colecciones) desde un archivo JSON Lines o CSV a la cuenta de un usuario. "
+            "El archivo se lee de a una fila por vez y se guarda en lotes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('usuario', help="Nombre de usuario que recibe las entradas")
+        parser.add_argument('archivo')
+        parser.add_argument('--formato', choices=[FORMATO_JSONL, FORMATO_CSV],
+                            help="Por defecto se deduce de la extension del archivo")
+        parser.add_argument('--lote', type=int, default=LOTE_IMPORTACION)
+
+    def handle(self, *args, **options):
+        try:
+            usuario = Usuario.objects.get(username=options['usuario'])
+        except Usuario.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}.")
+        formato = options['formato'] or (FORMATO_CSV if options['archivo'].lower().endswith('.csv') else FORMATO_JSONL)
+
+        with open(options['archivo'], 'rb') as archivo:
+            try:
+                verificar_codificacion(archivo)
+            except forms.ValidationError as e:
+                raise CommandError(e.messages[0])
+            resultado = importar_entradas(usuario, archivo, formato, lote=options['lote'])
+
+        for linea, error in resultado['errores']:
+            self.stdout.write(self.style.ERROR(f"  linea {linea}: {error}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Se importaron {resultado['importadas']} entradas y {resultado['colecciones_creadas']} colecciones "
+            f"en {resultado['segundos']} s ({resultado['filas_por_segundo']} filas/s), "
+            f"{resultado['cantidad_errores']} filas con errores."))
@@ -0,0 +1,69 @@
+from datetime import date, datetime
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app_bitacora import particiones
+from app_bitacora.cache import invalidar_fragmentos_usuario, invalidar_feed
+
+def fecha(valor):
+    return timezone.make_aware(datetime.combine(date.fromisoformat(valor), datetime.min.time()))
+
+class Command(BaseCommand):
+    help = ("Particionado de la tabla de entradas por fecha_entrada (solo PostgreSQL). "
+            "--convertir pasa la tabla actual a una particionada por mes o por año (se hace una vez, con la app "
+            "detenida). Despues conviene correr el comando periodicamente (ej. una vez por semana desde cron) para "
+            "crear las particiones de los periodos siguientes, y --archivar-antes para desprender las viejas.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convertir', action='store_true', help="Convierte la tabla existente en particionada")
+        parser.add_argument('--intervalo', choices=[particiones.INTERVALO_MES, particiones.INTERVALO_ANIO],
+                            default=particiones.INTERVALO_MES, help="Rango de cada particion al convertir")
+        parser.add_argument('--futuras', type=int, default=3, help="Periodos hacia adelante que tienen que existir")
+        parser.add_argument('--archivar-antes', type=fecha, metavar='AAAA-MM-DD',
+                            help="Desprende y archiva las particiones que terminan antes de esa fecha")
+        parser.add_argument('--listar', action='store_true', help="Muestra las particiones y sus filas estimadas")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("El particionado solo funciona con PostgreSQL.")
+
+        if options['convertir']:
+            try:
+                resumen = particiones.convertir_tabla(options['intervalo'], options['futuras'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f"Tabla convertida: {len(resumen['particiones'])} particiones, {resumen['indices']} indices y "
+                f"{resumen['triggers']} triggers recreados."))
+            for referencia in resumen['referencias_eliminadas']:
+                self.stdout.write(self.style.WARNING(
+                    f"  Se elimino la clave foranea {referencia}: el borrado en cascada queda a cargo de Django "
+                    f"y reconciliar_contadores borra los vinculos que queden sueltos."))
+        else:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if not particiones.esta_particionada(cursor):
+                    raise CommandError(f"La tabla {particiones.TABLA} no esta particionada, usa --convertir.")
+                creadas = particiones.crear_particiones_futuras(cursor, options['futuras'])
+            self.stdout.write(self.style.SUCCESS(f"Particiones nuevas: {', '.join(creadas) or 'ninguna'}."))
+
+        if options['archivar_antes']:
+            try:
+                archivadas, usuarios = particiones.archivar_particiones(options['archivar_antes'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            if archivadas:
+                # Las entradas archivadas ya no cuentan ni se muestran
+                call_command('reconciliar_contadores', stdout=self.stdout)
+                for usuario_id in usuarios:
+                    invalidar_fragmentos_usuario(usuario_id)
+                invalidar_feed()
+            self.stdout.write(self.style.SUCCESS(f"Particiones archivadas: {', '.join(archivadas) or 'ninguna'}."))
+
+        if options['listar']:
+            with connection.cursor() as cursor:
+                for nombre, desde, hasta in particiones.listar_particiones(cursor):
+                    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [nombre])
+                    self.stdout.write(f"  {nombre}: {desde:%Y-%m-%d} a {hasta:%Y-%m-%d}, ~{max(cursor.fetchone()[0], 0)} filas")
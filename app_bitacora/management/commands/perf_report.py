@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from app_bitacora.consultas import REPETIDA, LENTA, reporte_consultas, limpiar_reporte_consultas
+from app_bitacora.datos_sinteticos import generar_entradas, generar_colecciones
+from app_bitacora.management.commands.auditar_consultas import urls_a_auditar
+from app_bitacora.models import Usuario, Coleccion
+
+class Command(BaseCommand):
+    help = ("Muestra las consultas repetidas (N+1) y lentas que encontro el detector de consultas, agrupadas por "
+            "vista y por huella. El reporte se acumula en el cache, asi que para ver el de produccion el cache "
+            "tiene que ser compartido (memcached, redis). Con --recorrer se generan datos sinteticos, se recorren "
+            "las vistas de lectura revisando todos los requests y los datos se descartan al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recorrer', action='store_true', help="Recorre las vistas antes de mostrar el reporte")
+        parser.add_argument('--entradas', type=int, default=500, help="Entradas sinteticas para --recorrer")
+        parser.add_argument('--limpiar', action='store_true', help="Borra el reporte acumulado (antes de recorrer)")
+        parser.add_argument('--limite', type=int, default=20, help="Hallazgos a mostrar de cada tipo")
+
+    def recorrer(self, cantidad):
+        setup_test_environment()  # Habilita el host 'testserver' del cliente de pruebas
+        try:
+            with transaction.atomic(), override_settings(BITACORA_CONSULTAS_ESTRICTO=False, BITACORA_CONSULTAS_MUESTREO=1):
+                usuario = Usuario.objects.create_user(username='perf_report', email='perf_report@bitacora.local')
+                generar_entradas(usuario, cantidad, semilla=0)
+                generar_colecciones(usuario, 5, semilla=0)
+                cliente = Client()
+                cliente.force_login(usuario)
+                for vista, url in urls_a_auditar(Coleccion.objects.filter(usuario=usuario).first()).items():
+                    respuesta = cliente.get(url)
+                    self.stdout.write(f"  {vista}: {respuesta.status_code}")
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+    def handle(self, *args, **options):
+        if options['limpiar']:
+            limpiar_reporte_consultas()
+        if options['recorrer']:
+            self.stdout.write("Recorriendo las vistas...")
+            self.recorrer(options['entradas'])
+
+        reporte = reporte_consultas()
+        if not reporte:
+            self.stdout.write(self.style.SUCCESS("No hay consultas repetidas ni lentas en el reporte."))
+            return
+        for tipo, titulo, unidad in ((REPETIDA, "Consultas repetidas", "veces"), (LENTA, "Consultas lentas", "ms")):
+            hallazgos = sorted(((clave, datos) for clave, datos in reporte.items() if clave[0] == tipo),
+                               key=lambda hallazgo: (hallazgo[1]['veces'], hallazgo[1]['peor']), reverse=True)
+            if not hallazgos:
+                continue
+            self.stdout.write(self.style.WARNING(f"{titulo} ({len(hallazgos)}):"))
+            for (_, vista, huella), datos in hallazgos[:options['limite']]:
+                self.stdout.write(f"  {vista}: en {datos['veces']} requests, peor {datos['peor']} {unidad}, "
+                                  f"ultima {datos['ultima']:%Y-%m-%d %H:%M}\n    {huella}")
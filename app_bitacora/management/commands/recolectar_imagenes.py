@@ -0,0 +1,62 @@
+import posixpath
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from app_bitacora.almacenamiento import ANTIGUEDAD_MINIMA_BORRADO
+from app_bitacora.models import Entrada
+from app_bitacora.particiones import imagenes_archivadas
+
+class Command(BaseCommand):
+    help = ("Borra las imagenes y versiones redimensionadas que ya no usa ninguna entrada. "
+            "Los archivos mas nuevos que --antiguedad-minima se dejan, porque pueden ser de una subida "
+            "cuya entrada todavia no se guardo o de versiones que se estan generando.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--antiguedad-minima', type=int, default=ANTIGUEDAD_MINIMA_BORRADO,
+                            help="Segundos que tiene que tener un archivo huerfano para borrarlo")
+        parser.add_argument('--simular', action='store_true', help="Solo lista lo que se borraria")
+
+    def archivos(self, carpeta):
+        try:
+            carpetas, archivos = default_storage.listdir(carpeta)
+        except FileNotFoundError:
+            return
+        for nombre in archivos:
+            if not nombre.startswith('.'):  # Temporales de subidas en curso (ver almacenamiento.py)
+                yield posixpath.join(carpeta, nombre)
+        for subcarpeta in carpetas:
+            yield from self.archivos(posixpath.join(carpeta, subcarpeta))
+
+    def referenciados(self):
+        nombres = set()
+        for imagen, versiones in Entrada.objects.exclude(imagen='').values_list('imagen', 'imagen_versiones').iterator(chunk_size=5000):
+            nombres.add(imagen)
+            for formatos in (versiones or {}).values():
+                nombres.update(archivo['nombre'] for archivo in formatos.values())
+        # Las entradas de particiones archivadas (ver particiones.py) tambien conservan sus imagenes
+        return nombres | imagenes_archivadas()
+
+    def handle(self, *args, **options):
+        # Primero se listan los archivos y despues se leen las referencias: un archivo que se sube en el medio
+        # aparece como referenciado o queda protegido por la antiguedad minima
+        limite = time.time() - options['antiguedad_minima']
+        candidatos = list(self.archivos('imagenes'))
+        referenciados = self.referenciados()
+
+        borrados, liberado = 0, 0
+        for nombre in candidatos:
+            if nombre in referenciados or default_storage.get_modified_time(nombre).timestamp() > limite:
+                continue
+            tamanio = default_storage.size(nombre)
+            if options['simular']:
+                self.stdout.write(f"  {nombre} ({tamanio} bytes)")
+            else:
+                default_storage.delete(nombre)
+            borrados += 1
+            liberado += tamanio
+
+        accion = "Se borrarian" if options['simular'] else "Se borraron"
+        self.stdout.write(self.style.SUCCESS(
+            f"{accion} {borrados} de {len(candidatos)} archivos ({liberado / 1024 / 1024:.2f} MB)."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from app_bitacora.contadores import reconciliar_usuarios, reconciliar_colecciones, borrar_vinculos_huerfanos
+from app_bitacora.models import Usuario, Coleccion, EntradaColeccion
+
+class Command(BaseCommand):
+    help = ("Recalcula los contadores de entradas de usuarios y colecciones y corrige los que esten desfasados. "
+            "Antes borra los vinculos con colecciones de entradas que ya no existen. Recorre las tablas por "
+            "rangos de id, de a --lote filas, para no bloquearlas mucho tiempo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000)
+
+    def reconciliar(self, modelo, funcion, lote):
+        maximo = modelo.objects.aggregate(maximo=Max('id'))['maximo'] or 0
+        corregidos = 0
+        for desde in range(0, maximo + 1, lote):
+            corregidos += funcion(desde, desde + lote)
+        return corregidos
+
+    def handle(self, *args, **options):
+        # Primero los vinculos huerfanos, si no se contarian en las colecciones
+        huerfanos = self.reconciliar(EntradaColeccion, borrar_vinculos_huerfanos, options['lote'])
+        if huerfanos:
+            self.stdout.write(self.style.WARNING(f"Se borraron {huerfanos} vinculos de entradas que ya no existen."))
+        usuarios = self.reconciliar(Usuario, reconciliar_usuarios, options['lote'])
+        colecciones = self.reconciliar(Coleccion, reconciliar_colecciones, options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Se corrigieron {usuarios} usuarios y {colecciones} colecciones."))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app_bitacora.contadores import contadores_en_lote
+from app_bitacora.datos_sinteticos import generar_dataset
+from app_bitacora.models import Usuario, Entrada
+
+class Command(BaseCommand):
+    help = ("Genera un conjunto de datos sintetico con bulk inserts: usuarios con cantidades de entradas muy "
+            "desparejas (unos pocos escriben la mayoria), colecciones con entradas compartidas e imagenes con sus "
+            "versiones. Con la misma --semilla se generan los mismos datos. Los usuarios se llaman <prefijo>0, "
+            "<prefijo>1, ... (el 0 es el que mas entradas tiene) y todos tienen la contraseña de --password.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=100)
+        parser.add_argument('--entradas', type=int, default=50_000, help="Entradas en total, repartidas entre los usuarios")
+        parser.add_argument('--colecciones-por-usuario', type=int, default=5)
+        parser.add_argument('--entradas-por-coleccion', type=int, default=20)
+        parser.add_argument('--proporcion-imagenes', type=float, default=0.1, help="Proporcion de entradas con imagen")
+        parser.add_argument('--imagenes-distintas', type=int, default=8)
+        parser.add_argument('--prefijo', default='seed')
+        parser.add_argument('--password', default='bitacora-seed')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--reemplazar', action='store_true', help="Borra antes los usuarios con el mismo prefijo")
+
+    def handle(self, *args, **options):
+        if options['usuarios'] < 1:
+            raise CommandError("Hace falta al menos un usuario.")
+        existentes = Usuario.objects.filter(username__startswith=options['prefijo'], email__endswith='@bitacora.local')
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            if options['reemplazar']:
+                with contadores_en_lote(Entrada.objects.filter(usuario__in=existentes)):
+                    existentes.delete()
+            elif existentes.exists():
+                raise CommandError(f"Ya hay usuarios con el prefijo {options['prefijo']}, use --reemplazar u otro --prefijo.")
+            usuarios = generar_dataset(
+                options['usuarios'], options['entradas'],
+                colecciones_por_usuario=options['colecciones_por_usuario'],
+                entradas_por_coleccion=options['entradas_por_coleccion'],
+                proporcion_imagenes=options['proporcion_imagenes'],
+                imagenes_distintas=options['imagenes_distintas'],
+                prefijo=options['prefijo'], password=options['password'], semilla=options['semilla'],
+            )
+        usuarios[0].refresh_from_db()
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['usuarios']} usuarios y {options['entradas']} entradas en {time.perf_counter() - inicio:.1f} s. "
+            f"{usuarios[0].username} tiene {usuarios[0].cantidad_entradas}."))
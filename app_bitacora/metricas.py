@@ -0,0 +1,207 @@
+import random
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+# Metricas de cada vista: latencia total, cantidad y tiempo de las consultas SQL, tiempo de renderizado de las
+# plantillas y de Pillow. Solo se mide una muestra de los requests (BITACORA_METRICAS_MUESTREO), el resto no
+# paga mas que un random(). Los histogramas viven en memoria, cada proceso del servidor tiene los suyos
+
+# Limites de los buckets, como los de los histogramas de Prometheus
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+ETAPAS = ('sql', 'plantillas', 'imagenes')
+SIN_RUTA = 'sin_ruta'
+
+class EstadoMetricas:
+    # Lo que se midio en el request en curso. Igual que en replicas.py, es un objeto mutable dentro de la
+    # ContextVar para que se sume tambien lo que pasa en los hilos de sync_to_async
+    def __init__(self):
+        self.consultas = 0
+        self.tiempos = dict.fromkeys(ETAPAS, 0.0)
+        self.midiendo = set()
+
+_estado = ContextVar('bitacora_estado_metricas', default=None)
+
+class Histograma:
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cantidades = [0] * (len(limites) + 1)  # El ultimo es el bucket +Inf
+        self.suma = 0.0
+        self.cantidad = 0
+
+    def observar(self, valor):
+        self.cantidades[bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+
+    def acumulados(self):
+        total = 0
+        for limite, cantidad in zip(self.limites + ('+Inf',), self.cantidades):
+            total += cantidad
+            yield limite, total
+
+# nombre: (descripcion, limites de los buckets)
+METRICAS = {
+    'bitacora_request_segundos': ("Latencia total de los requests medidos", LIMITES_SEGUNDOS),
+    'bitacora_request_consultas': ("Consultas SQL por request", LIMITES_CONSULTAS),
+    'bitacora_request_etapa_segundos': ("Tiempo de cada etapa del request (las etapas se pueden superponer, "
+                                        "ej. consultas que se hacen al renderizar)", LIMITES_SEGUNDOS),
+}
+
+_histogramas = {}
+_lock = threading.Lock()
+
+def observar(metrica, etiquetas, valor):
+    with _lock:
+        histograma = _histogramas.get((metrica, etiquetas))
+        if histograma is None:
+            histograma = _histogramas[(metrica, etiquetas)] = Histograma(METRICAS[metrica][1])
+        histograma.observar(valor)
+
+def reiniciar_metricas():
+    with _lock:
+        _histogramas.clear()
+
+def registrar_request(vista, estado, segundos):
+    observar('bitacora_request_segundos', (('vista', vista),), segundos)
+    observar('bitacora_request_consultas', (('vista', vista),), estado.consultas)
+    for etapa, tiempo in estado.tiempos.items():
+        # imagenes solo aparece en las vistas que usan Pillow, sql y plantillas siempre (aunque sean 0)
+        if tiempo or etapa != 'imagenes':
+            observar('bitacora_request_etapa_segundos', (('vista', vista), ('etapa', etapa)), tiempo)
+
+def escapar_etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatear_etiquetas(etiquetas):
+    return '{' + ','.join(f'{nombre}="{escapar_etiqueta(valor)}"' for nombre, valor in etiquetas) + '}'
+
+def exportar_prometheus():
+    '''
+        Los histogramas en el formato de texto de Prometheus, para que los lea un scraper
+        (ver la vista metricas_prometheus).
+    '''
+    with _lock:
+        copia = {clave: (list(histograma.acumulados()), histograma.suma, histograma.cantidad)
+                 for clave, histograma in _histogramas.items()}
+    lineas = []
+    for metrica, (descripcion, _) in METRICAS.items():
+        lineas += [f'# HELP {metrica} {descripcion}', f'# TYPE {metrica} histogram']
+        for (nombre, etiquetas), (acumulados, suma, cantidad) in sorted(copia.items()):
+            if nombre != metrica:
+                continue
+            for limite, total in acumulados:
+                lineas.append(f'{metrica}_bucket{formatear_etiquetas(etiquetas + (("le", limite),))} {total}')
+            lineas.append(f'{metrica}_sum{formatear_etiquetas(etiquetas)} {suma}')
+            lineas.append(f'{metrica}_count{formatear_etiquetas(etiquetas)} {cantidad}')
+    return '\n'.join(lineas) + '\n'
+
+@contextmanager
+def medir(etapa):
+    # Suma al request en curso el tiempo del bloque. Si la etapa ya se esta midiendo (ej. un render_to_string
+    # dentro de otro) el bloque de adentro no se cuenta dos veces
+    estado = _estado.get()
+    if estado is None or etapa in estado.midiendo:
+        yield
+        return
+    estado.midiendo.add(etapa)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        estado.tiempos[etapa] += time.perf_counter() - inicio
+        estado.midiendo.discard(etapa)
+
+def medir_consulta(execute, sql, params, many, context):
+    # Execute wrapper que se instala en todas las conexiones (ver signals.py)
+    estado = _estado.get()
+    if estado is None:
+        return execute(sql, params, many, context)
+    estado.consultas += 1
+    with medir('sql'):
+        return execute(sql, params, many, context)
+
+class PlantillaMedida(Template):
+
+    def render(self, context=None, request=None):
+        with medir('plantillas'):
+            return super().render(context, request)
+
+class PlantillasMedidas(DjangoTemplates):
+    '''
+        El backend de plantillas de Django, midiendo el tiempo de cada render (render, render_to_string,
+        TemplateResponse). Los {% include %} quedan dentro del render que los incluye.
+    '''
+
+    def from_string(self, template_code):
+        return PlantillaMedida(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        plantilla = super().get_template(template_name)
+        return PlantillaMedida(plantilla.template, self)
+
+def server_timing(estado, segundos):
+    partes = [f'sql;dur={estado.tiempos["sql"] * 1000:.1f};desc="{estado.consultas} consultas"',
+              f'plantillas;dur={estado.tiempos["plantillas"] * 1000:.1f}']
+    if estado.tiempos['imagenes']:
+        partes.append(f'imagenes;dur={estado.tiempos["imagenes"] * 1000:.1f}')
+    partes.append(f'total;dur={segundos * 1000:.1f}')
+    return ', '.join(partes)
+
+class MetricasMiddleware:
+    '''
+        Mide los requests de la muestra y suma sus tiempos a los histogramas de la vista. Con
+        BITACORA_SERVER_TIMING la respuesta lleva el desglose en el header Server-Timing (lo muestra
+        la pestaña de red del navegador). Va primero en MIDDLEWARE para medir tambien a los demas.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.BITACORA_METRICAS_MUESTREO:
+            return self.get_response(request)
+        estado = EstadoMetricas()
+        token = _estado.set(estado)
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self.registrar(request, respuesta, estado, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.BITACORA_METRICAS_MUESTREO:
+            return await self.get_response(request)
+        estado = EstadoMetricas()
+        token = _estado.set(estado)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self.registrar(request, respuesta, estado, time.perf_counter() - inicio)
+
+    def registrar(self, request, respuesta, estado, segundos):
+        # El nombre de la ruta (ej. bitacora:mis_entradas) y no el path, asi la cantidad de series es acotada
+        ruta = getattr(request, 'resolver_match', None)
+        registrar_request(ruta.view_name if ruta else SIN_RUTA, estado, segundos)
+        if settings.BITACORA_SERVER_TIMING:
+            respuesta['Server-Timing'] = server_timing(estado, segundos)
+        return respuesta
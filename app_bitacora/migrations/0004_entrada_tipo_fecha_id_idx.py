@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0003_coleccion_entrada_colecciones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entrada',
+            index=models.Index(fields=['tipo_entrada', '-fecha_entrada', '-id'], name='entrada_tipo_fecha_id_idx'),
+        ),
+    ]
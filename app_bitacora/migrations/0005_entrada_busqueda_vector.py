@@ -0,0 +1,72 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:52
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Configuracion de busqueda en español que ademas ignora los acentos (canción == cancion)
+CREAR_BUSQUEDA = """
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+        ALTER TEXT SEARCH CONFIGURATION es_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION app_bitacora_entrada_busqueda_vector() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.busqueda_vector IS NULL
+       OR NEW.detalle_entrada IS DISTINCT FROM OLD.detalle_entrada THEN
+        NEW.busqueda_vector := to_tsvector('es_unaccent', coalesce(NEW.detalle_entrada, ''));
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER entrada_busqueda_vector_trigger
+    BEFORE INSERT OR UPDATE ON app_bitacora_entrada
+    FOR EACH ROW EXECUTE FUNCTION app_bitacora_entrada_busqueda_vector();
+
+UPDATE app_bitacora_entrada SET busqueda_vector = to_tsvector('es_unaccent', coalesce(detalle_entrada, ''));
+
+CREATE INDEX entrada_busqueda_gin_idx ON app_bitacora_entrada USING gin (busqueda_vector);
+"""
+
+ELIMINAR_BUSQUEDA = """
+DROP INDEX IF EXISTS entrada_busqueda_gin_idx;
+DROP TRIGGER IF EXISTS entrada_busqueda_vector_trigger ON app_bitacora_entrada;
+DROP FUNCTION IF EXISTS app_bitacora_entrada_busqueda_vector();
+DROP TEXT SEARCH CONFIGURATION IF EXISTS es_unaccent;
+"""
+
+
+# El trigger y el indice GIN solo existen en PostgreSQL, en SQLite la columna queda sin usar
+def crear_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREAR_BUSQUEDA, params=None)
+
+
+def eliminar_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(ELIMINAR_BUSQUEDA, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0004_entrada_tipo_fecha_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrada',
+            name='busqueda_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(crear_busqueda, eliminar_busqueda),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:31
+
+from django.db import migrations
+
+
+# Por cada columna hay dos indices GIN de trigramas:
+#   - sobre UPPER(columna), que es la expresion que genera icontains (UPPER(col) LIKE UPPER('%texto%'))
+#   - sobre la columna, que es la que usan los operadores de similitud de pg_trgm (%, %>)
+CREAR_INDICES_TRIGRAMAS = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX entrada_detalle_upper_trgm_idx ON app_bitacora_entrada USING gin (UPPER(detalle_entrada::text) gin_trgm_ops);
+CREATE INDEX entrada_detalle_trgm_idx ON app_bitacora_entrada USING gin (detalle_entrada gin_trgm_ops);
+CREATE INDEX coleccion_nombre_upper_trgm_idx ON app_bitacora_coleccion USING gin (UPPER(nombre_coleccion::text) gin_trgm_ops);
+CREATE INDEX coleccion_nombre_trgm_idx ON app_bitacora_coleccion USING gin (nombre_coleccion gin_trgm_ops);
+"""
+
+ELIMINAR_INDICES_TRIGRAMAS = """
+DROP INDEX IF EXISTS entrada_detalle_upper_trgm_idx;
+DROP INDEX IF EXISTS entrada_detalle_trgm_idx;
+DROP INDEX IF EXISTS coleccion_nombre_upper_trgm_idx;
+DROP INDEX IF EXISTS coleccion_nombre_trgm_idx;
+"""
+
+
+# pg_trgm solo existe en PostgreSQL, en SQLite la busqueda por subcadena sigue siendo un icontains comun
+def crear_indices_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREAR_INDICES_TRIGRAMAS, params=None)
+
+
+def eliminar_indices_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(ELIMINAR_INDICES_TRIGRAMAS, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0005_entrada_busqueda_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_trigramas, eliminar_indices_trigramas),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0006_busqueda_trigramas'),
+    ]
+
+    operations = [
+        # La tabla app_bitacora_entrada_colecciones ya existe (la creo Django para el ManyToManyField),
+        # asi que EntradaColeccion solo se agrega al estado de las migraciones, sin tocar la base
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='EntradaColeccion',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('coleccion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app_bitacora.coleccion')),
+                        ('entrada', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app_bitacora.entrada')),
+                    ],
+                    options={
+                        'db_table': 'app_bitacora_entrada_colecciones',
+                        'unique_together': {('entrada', 'coleccion')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='entrada',
+                    name='colecciones',
+                    field=models.ManyToManyField(blank=True, related_name='entradas', through='app_bitacora.EntradaColeccion', to='app_bitacora.coleccion'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='entradacoleccion',
+            index=models.Index(fields=['coleccion', 'entrada'], name='entrada_coleccion_inversa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coleccion',
+            index=models.Index(fields=['usuario', 'nombre_coleccion'], name='coleccion_usuario_nombre_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='entrada',
+            name='entrada_tipo_fecha_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='entrada',
+            index=models.Index(condition=models.Q(('tipo_entrada', 'publica')), fields=['-fecha_entrada', '-id'], name='entrada_publica_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entrada',
+            index=models.Index(fields=['usuario', '-fecha_entrada', '-id'], name='entrada_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entrada',
+            index=models.Index(fields=['usuario', 'tipo_entrada', '-fecha_entrada'], name='entrada_usuario_tipo_fecha_idx'),
+        ),
+    ]
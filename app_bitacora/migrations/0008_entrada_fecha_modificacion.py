@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0007_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrada',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0008_entrada_fecha_modificacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrada',
+            name='imagen_versiones',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0009_entrada_imagen_versiones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entrada',
+            index=models.Index(condition=models.Q(('imagen', ''), _negated=True), fields=['imagen'], name='entrada_imagen_idx'),
+        ),
+    ]
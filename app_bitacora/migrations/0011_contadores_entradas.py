@@ -0,0 +1,50 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:48
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def contar(modelo, campo_grupo, **filtro):
+    # Subconsulta con la cantidad de filas de "modelo" agrupadas por campo_grupo = OuterRef('id')
+    return Coalesce(Subquery(
+        modelo.objects.filter(**{campo_grupo: OuterRef('id')}, **filtro)
+        .order_by().values(campo_grupo).annotate(cantidad=Count('id')).values('cantidad'),
+        output_field=IntegerField()), Value(0))
+
+
+def calcular_contadores(apps, schema_editor):
+    # Un solo UPDATE por tabla con los valores actuales; de ahi en adelante se mantienen incrementalmente
+    Usuario = apps.get_model('app_bitacora', 'Usuario')
+    Coleccion = apps.get_model('app_bitacora', 'Coleccion')
+    Entrada = apps.get_model('app_bitacora', 'Entrada')
+    EntradaColeccion = apps.get_model('app_bitacora', 'EntradaColeccion')
+    Usuario.objects.update(cantidad_entradas_publicas=contar(Entrada, 'usuario', tipo_entrada='publica'),
+                           cantidad_entradas_privadas=contar(Entrada, 'usuario', tipo_entrada='privada'))
+    Coleccion.objects.update(cantidad_entradas=contar(EntradaColeccion, 'coleccion'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bitacora', '0010_entrada_imagen_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coleccion',
+            name='cantidad_entradas',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='cantidad_entradas_privadas',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='cantidad_entradas_publicas',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
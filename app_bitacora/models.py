@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Q
 
 class Usuario(AbstractUser):
     # El nombre de usuario y la contraseña la maneja el AbstractUser
@@ -9,6 +11,15 @@ class Usuario(AbstractUser):
     # Otros campos personalizados
     pais = models.CharField(max_length=50, blank=True, null=True)
 
+    # Contadores de entradas del usuario, se mantienen al crear/eliminar/cambiar el tipo de una entrada
+    # (ver contadores.py) para no hacer un COUNT en cada pagina
+    cantidad_entradas_publicas = models.PositiveIntegerField(default=0, editable=False)
+    cantidad_entradas_privadas = models.PositiveIntegerField(default=0, editable=False)
+
+    @property
+    def cantidad_entradas(self):
+        return self.cantidad_entradas_publicas + self.cantidad_entradas_privadas
+
     def __str__(self):
         return self.username
 
@@ -16,6 +27,14 @@ class Coleccion(models.Model):
     nombre_coleccion = models.CharField(max_length=80)
     detalle_coleccion = models.CharField(max_length=400)
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE) # Relación uno a muchos
+    # Cantidad de entradas de la coleccion, se mantiene al agregar o quitar entradas (ver contadores.py)
+    cantidad_entradas = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # mis_colecciones y los filtros listan las colecciones del usuario ordenadas por nombre
+            models.Index(fields=['usuario', 'nombre_coleccion'], name='coleccion_usuario_nombre_idx'),
+        ]
 
     def __str__(self):
         return self.nombre_coleccion
@@ -24,6 +43,8 @@ class Entrada(models.Model):
     detalle_entrada = models.CharField(max_length=800)
     # video_entrada = ...
     fecha_entrada = models.DateTimeField("date published")
+    # Se actualiza en cada save() y sirve de version para el cache de fragmentos de la entrada
+    fecha_modificacion = models.DateTimeField(auto_now=True)
 
     OPCIONES_TIPO_ENTRADA = {
         "privada": "Entrada Privada",
@@ -38,6 +59,64 @@ class Entrada(models.Model):
         null=True, # El campo acepta nulos en la BD
         blank=True # El campo es opcional al momento de completar el formulario
     )
-    colecciones = models.ManyToManyField(Coleccion, related_name='entradas', blank=True)  # Relación muchos a muchos
+    # Versiones redimensionadas de la imagen, las genera en segundo plano app_bitacora/imagenes.py
+    imagen_versiones = models.JSONField(default=dict, blank=True, editable=False)
+    colecciones = models.ManyToManyField(Coleccion, related_name='entradas', blank=True, through='EntradaColeccion')  # Relación muchos a muchos
+    # Vector de busqueda de texto completo de detalle_entrada. En PostgreSQL lo mantiene un trigger y tiene
+    # un indice GIN (ver migracion 0005), en SQLite queda vacio y la busqueda usa icontains
+    busqueda_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Indice parcial que respalda la paginacion por cursor del feed publico: solo guarda las entradas
+            # publicas y ya las tiene en el orden (fecha_entrada, id) en que se recorren
+            models.Index(fields=['-fecha_entrada', '-id'], name='entrada_publica_fecha_id_idx',
+                         condition=Q(tipo_entrada='publica')),
+            # mis_entradas: entradas del usuario por fecha, con y sin el filtro de tipo de entrada
+            models.Index(fields=['usuario', '-fecha_entrada', '-id'], name='entrada_usuario_fecha_idx'),
+            models.Index(fields=['usuario', 'tipo_entrada', '-fecha_entrada'], name='entrada_usuario_tipo_fecha_idx'),
+            # Cuenta de referencias de cada archivo del almacenamiento por contenido (ver almacenamiento.py)
+            models.Index(fields=['imagen'], name='entrada_imagen_idx', condition=~Q(imagen='')),
+        ]
+
+    # Tipo de entrada e imagen con los que se cargo de la base, para detectar cambios al guardar
+    tipo_entrada_original = None
+    imagen_original = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia.tipo_entrada_original = instancia.__dict__.get('tipo_entrada')
+        instancia.imagen_original = instancia.__dict__.get('imagen')
+        return instancia
+
+    def imagen_cambio(self):
+        return (self.imagen.name or None) != (self.imagen_original or None)
+
+    def save(self, *args, **kwargs):
+        if 'imagen' in self.__dict__ and self.imagen_cambio():
+            self.imagen_versiones = {}  # Las versiones de la imagen anterior ya no sirven
+        super().save(*args, **kwargs)  # Las señales post_save todavia ven los valores originales
+        self.tipo_entrada_original = self.tipo_entrada
+        if 'imagen' in self.__dict__:
+            self.imagen_original = self.imagen.name
+
+    def __str__(self):
+        return self.detalle_entrada
+
+class EntradaColeccion(models.Model):
+    # Tabla intermedia de Entrada.colecciones. Antes la creaba Django automaticamente, la hice explicita
+    # (sobre la misma tabla) para poder indexarla
+    entrada = models.ForeignKey(Entrada, on_delete=models.CASCADE)
+    coleccion = models.ForeignKey(Coleccion, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'app_bitacora_entrada_colecciones'
+        unique_together = [('entrada', 'coleccion')]
+        indexes = [
+            # Busqueda inversa de mis_entradas (entradas de una coleccion) sin volver a la tabla
+            models.Index(fields=['coleccion', 'entrada'], name='entrada_coleccion_inversa_idx'),
+        ]
+
     def __str__(self):
-        return self.detalle_entrada
\ No newline at end of file
+        return f"{self.entrada_id} -> {self.coleccion_id}"
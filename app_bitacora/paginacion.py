@@ -0,0 +1,63 @@
+import base64
+
+from datetime import datetime
+from django.db.models import Q
+
+# Cantidad fija de entradas que se muestran por pagina en los listados paginados por cursor
+ENTRADAS_POR_PAGINA = 20
+
+def codificar_cursor(fecha_entrada, id_entrada):
+    # El cursor es opaco para el cliente: solo codifico la fecha y el id de la ultima entrada mostrada
+    valor = f"{fecha_entrada.isoformat()}|{id_entrada}"
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor):
+    '''
+        Devuelve la tupla (fecha_entrada, id) que esta codificada en el cursor.
+        Si el cursor fue manipulado o no es valido devuelve None, y en ese caso se muestra la primera pagina.
+    '''
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha, id_entrada = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        return datetime.fromisoformat(fecha), int(id_entrada)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def consulta_pagina(entradas, cursor, tamanio):
+    entradas = entradas.order_by('-fecha_entrada', '-id')
+
+    posicion = decodificar_cursor(cursor) if cursor else None
+    if posicion:
+        fecha, id_entrada = posicion
+        # El filtro fecha_entrada__lte es redundante pero le permite al motor acotar el rango del indice
+        entradas = entradas.filter(fecha_entrada__lte=fecha).filter(
+            Q(fecha_entrada__lt=fecha) | Q(fecha_entrada=fecha, id__lt=id_entrada)
+        )
+
+    # Pido una entrada de mas para saber si existe una pagina siguiente sin hacer un COUNT
+    return entradas[:tamanio + 1]
+
+def cortar_pagina(pagina, tamanio):
+    siguiente_cursor = None
+    if len(pagina) > tamanio:
+        pagina = pagina[:tamanio]
+        ultima = pagina[-1]
+        if isinstance(ultima, dict):
+            siguiente_cursor = codificar_cursor(ultima['fecha_entrada'], ultima['id'])
+        else:
+            siguiente_cursor = codificar_cursor(ultima.fecha_entrada, ultima.id)
+    return pagina, siguiente_cursor
+
+def paginar_por_cursor(entradas, cursor=None, tamanio=ENTRADAS_POR_PAGINA):
+    '''
+        Pagina un queryset de entradas por keyset sobre (fecha_entrada, id), de la mas nueva a la mas vieja.
+        A diferencia de OFFSET, la base de datos salta directo a la posicion del cursor usando el indice,
+        asi que una pagina profunda cuesta lo mismo que la primera.
+        Devuelve la lista de entradas de la pagina y el cursor de la pagina siguiente (None si no hay mas).
+        Sirve tanto para querysets de modelos como para .values() (que tiene que incluir fecha_entrada e id).
+    '''
+    return cortar_pagina(list(consulta_pagina(entradas, cursor, tamanio)), tamanio)
+
+async def apaginar_por_cursor(entradas, cursor=None, tamanio=ENTRADAS_POR_PAGINA):
+    # Igual que paginar_por_cursor pero con el ORM async, para las vistas async
+    return cortar_pagina([entrada async for entrada in consulta_pagina(entradas, cursor, tamanio)], tamanio)
@@ -0,0 +1,221 @@
+import json
+import re
+
+from datetime import datetime
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Entrada, EntradaColeccion
+
+# Particionado opcional (solo PostgreSQL) de la tabla de entradas por rangos de fecha_entrada.
+# Las consultas que filtran o paginan por fecha (el feed, mis_entradas con fecha_desde/fecha_hasta, el cursor)
+# solo leen las particiones del rango pedido, y las particiones viejas se pueden desprender y archivar.
+# Todo se maneja con el comando particionar_entradas; sin convertir la tabla la app funciona igual que antes
+
+TABLA = Entrada._meta.db_table
+TABLA_VINCULOS = EntradaColeccion._meta.db_table
+PARTICION_DEFAULT = f'{TABLA}_p_default'
+PREFIJO_ARCHIVO = f'{TABLA}_archivo_'
+
+INTERVALO_MES = 'mes'
+INTERVALO_ANIO = 'anio'
+
+def inicio_periodo(fecha, intervalo):
+    fecha = timezone.localtime(fecha) if timezone.is_aware(fecha) else fecha
+    inicio = datetime(fecha.year, fecha.month if intervalo == INTERVALO_MES else 1, 1)
+    return timezone.make_aware(inicio)
+
+def siguiente_periodo(inicio, intervalo):
+    if intervalo == INTERVALO_ANIO:
+        return inicio.replace(year=inicio.year + 1)
+    if inicio.month == 12:
+        return inicio.replace(year=inicio.year + 1, month=1)
+    return inicio.replace(month=inicio.month + 1)
+
+def nombre_particion(inicio, intervalo):
+    sufijo = f'{inicio.year}_{inicio.month:02d}' if intervalo == INTERVALO_MES else f'{inicio.year}'
+    return f'{TABLA}_p{sufijo}'
+
+def intervalo_de(nombre):
+    # El intervalo con el que se convirtio la tabla se deduce del nombre de las particiones
+    return INTERVALO_MES if re.search(r'_p\d{4}_\d{2}$', nombre) else INTERVALO_ANIO
+
+def esta_particionada(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLA])
+    fila = cursor.fetchone()
+    return bool(fila) and fila[0] == 'p'
+
+def listar_particiones(cursor):
+    # Devuelve (nombre, desde, hasta) de cada particion por rango, ordenadas por fecha (sin la default)
+    cursor.execute("""
+        SELECT hija.relname,
+               (regexp_match(pg_get_expr(hija.relpartbound, hija.oid), 'FROM \\(''([^'']+)''\\) TO \\(''([^'']+)''\\)'))
+        FROM pg_inherits JOIN pg_class hija ON hija.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+    """, [TABLA])
+    particiones = []
+    for nombre, limites in cursor.fetchall():
+        if limites:
+            desde, hasta = (datetime.fromisoformat(limite) for limite in limites)
+            particiones.append((nombre, desde, hasta))
+    return sorted(particiones, key=lambda particion: particion[1])
+
+def crear_particion(cursor, inicio, intervalo):
+    # Los limites son fechas que arma este modulo, no datos del usuario
+    fin = siguiente_periodo(inicio, intervalo)
+    nombre = nombre_particion(inicio, intervalo)
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF {TABLA} "
+                   f"FOR VALUES FROM ('{inicio.isoformat()}') TO ('{fin.isoformat()}')")
+    return nombre
+
+def crear_particiones_futuras(cursor, cantidad, intervalo=None):
+    '''
+        Se asegura de que existan las particiones del periodo actual y de los "cantidad" siguientes, para que
+        las entradas nuevas no caigan en la particion default. Devuelve los nombres de las que creo.
+    '''
+    existentes = listar_particiones(cursor)
+    intervalo = intervalo or (intervalo_de(existentes[-1][0]) if existentes else INTERVALO_MES)
+    nombres_existentes = {nombre for nombre, _, _ in existentes}
+    creadas = []
+    inicio = inicio_periodo(timezone.now(), intervalo)
+    for _ in range(cantidad + 1):
+        nombre = nombre_particion(inicio, intervalo)
+        if nombre not in nombres_existentes:
+            creadas.append(crear_particion(cursor, inicio, intervalo))
+        inicio = siguiente_periodo(inicio, intervalo)
+    return creadas
+
+def definiciones_a_copiar(cursor):
+    # Indices, triggers y claves foraneas de la tabla actual, para volver a crearlos sobre la particionada
+    cursor.execute("""
+        SELECT pg_get_indexdef(indexrelid) FROM pg_index
+        WHERE indrelid = to_regclass(%s) AND NOT indisprimary
+    """, [TABLA])
+    indices = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute("SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal", [TABLA])
+    triggers = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f'
+    """, [TABLA])
+    foraneas = cursor.fetchall()
+    cursor.execute("""
+        SELECT conrelid::regclass::text, conname FROM pg_constraint
+        WHERE confrelid = to_regclass(%s) AND contype = 'f'
+    """, [TABLA])
+    referencias = cursor.fetchall()
+    return indices, triggers, foraneas, referencias
+
+def convertir_tabla(intervalo=INTERVALO_MES, periodos_futuros=3):
+    '''
+        Convierte la tabla de entradas en una tabla particionada por rango de fecha_entrada, en una sola
+        transaccion (la tabla queda bloqueada mientras se copian los datos).
+
+        PostgreSQL exige que la clave primaria de una tabla particionada incluya la columna de particion, asi
+        que la PK pasa a ser (id, fecha_entrada) y las claves foraneas que apuntan a la tabla (la de la tabla
+        intermedia con colecciones) se eliminan: Django sigue borrando en cascada desde el ORM, pero la base
+        ya no lo garantiza por su cuenta. Devuelve un resumen con lo que se hizo.
+    '''
+    viejo = f'{TABLA}_sin_particionar'
+    with transaction.atomic(), connection.cursor() as cursor:
+        if esta_particionada(cursor):
+            raise ValueError(f"La tabla {TABLA} ya esta particionada.")
+        cursor.execute(f"LOCK TABLE {TABLA} IN ACCESS EXCLUSIVE MODE")
+        indices, triggers, foraneas, referencias = definiciones_a_copiar(cursor)
+        cursor.execute("SELECT attidentity FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'id'", [TABLA])
+        identidad = cursor.fetchone()[0]
+        cursor.execute(f"SELECT min(fecha_entrada), max(id) FROM {TABLA}")
+        fecha_minima, id_maximo = cursor.fetchone()
+        cursor.execute("""
+            SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute
+            WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+        """, [TABLA])
+        columnas = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {TABLA} RENAME TO {viejo}")
+        cursor.execute(f"CREATE TABLE {TABLA} (LIKE {viejo} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED "
+                       f"INCLUDING CONSTRAINTS INCLUDING STORAGE) PARTITION BY RANGE (fecha_entrada)")
+        if not identidad:
+            # Columna serial: la secuencia pasa a ser de la tabla nueva, si no se borraria junto con la vieja
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [viejo])
+            cursor.execute(f"ALTER SEQUENCE {cursor.fetchone()[0]} OWNED BY {TABLA}.id")
+
+        # Una particion por periodo desde la entrada mas vieja hasta unos periodos hacia adelante, y la default
+        # para cualquier fecha fuera de esos rangos
+        inicio = inicio_periodo(fecha_minima or timezone.now(), intervalo)
+        actual = inicio_periodo(timezone.now(), intervalo)
+        particiones = []
+        while inicio < actual:
+            particiones.append(crear_particion(cursor, inicio, intervalo))
+            inicio = siguiente_periodo(inicio, intervalo)
+        particiones += crear_particiones_futuras(cursor, periodos_futuros, intervalo)
+        cursor.execute(f"CREATE TABLE {PARTICION_DEFAULT} PARTITION OF {TABLA} DEFAULT")
+
+        cursor.execute(f"INSERT INTO {TABLA} ({columnas}) SELECT {columnas} FROM {viejo}")
+        if identidad:
+            cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [TABLA, id_maximo or 1])
+        # Se borra la tabla vieja (y las claves foraneas que la referencian) antes de crear los indices con sus nombres
+        cursor.execute(f"DROP TABLE {viejo} CASCADE")
+
+        cursor.execute(f"ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_pkey PRIMARY KEY (id, fecha_entrada)")
+        # Las definiciones se leyeron antes de renombrar, asi que ya nombran a la tabla nueva
+        for definicion in indices + triggers:
+            cursor.execute(definicion)
+        for nombre, definicion in foraneas:
+            cursor.execute(f"ALTER TABLE {TABLA} ADD CONSTRAINT {nombre} {definicion}")
+        cursor.execute(f"ANALYZE {TABLA}")
+
+    return {'particiones': particiones, 'indices': len(indices), 'triggers': len(triggers),
+            'referencias_eliminadas': [f'{tabla}.{nombre}' for tabla, nombre in referencias]}
+
+def archivar_particiones(antes_de):
+    '''
+        Desprende las particiones que terminan antes de la fecha "antes_de" y las deja como tablas sueltas
+        ({TABLA}_archivo_...), junto con una copia de sus vinculos con colecciones. Las entradas dejan de
+        verse en la app; las tablas archivadas se pueden respaldar con pg_dump -t y despues borrar.
+        Devuelve los nombres de las tablas archivadas y los ids de los usuarios afectados.
+    '''
+    archivadas, usuarios = [], set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not esta_particionada(cursor):
+            raise ValueError(f"La tabla {TABLA} no esta particionada.")
+        for nombre, desde, hasta in listar_particiones(cursor):
+            if hasta > antes_de:
+                continue
+            archivo = PREFIJO_ARCHIVO + nombre[len(TABLA) + 1:]
+            cursor.execute(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre}")
+            cursor.execute(f"ALTER TABLE {nombre} RENAME TO {archivo}")
+            cursor.execute(f"CREATE TABLE {archivo}_colecciones AS SELECT vinculos.* FROM {TABLA_VINCULOS} vinculos "
+                           f"JOIN {archivo} archivo ON archivo.id = vinculos.entrada_id")
+            cursor.execute(f"DELETE FROM {TABLA_VINCULOS} vinculos USING {archivo} archivo WHERE archivo.id = vinculos.entrada_id")
+            cursor.execute(f"SELECT DISTINCT usuario_id FROM {archivo}")
+            usuarios.update(fila[0] for fila in cursor.fetchall())
+            archivadas.append(archivo)
+    return archivadas, usuarios
+
+def tablas_archivadas(cursor):
+    cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE %s AND relname NOT LIKE %s",
+                   [PREFIJO_ARCHIVO.replace('_', r'\_') + '%', '%' + r'\_colecciones'])
+    return [fila[0] for fila in cursor.fetchall()]
+
+def imagenes_archivadas(nombre=None):
+    '''
+        Nombres de las imagenes (y versiones) que usan las entradas archivadas, para que el recolector de
+        imagenes no las borre. Con "nombre" solo se busca esa imagen.
+    '''
+    if connection.vendor != 'postgresql':
+        return set()
+    nombres = set()
+    with connection.cursor() as cursor:
+        for archivo in tablas_archivadas(cursor):
+            if nombre is None:
+                cursor.execute(f"SELECT imagen, imagen_versiones FROM {archivo} WHERE imagen <> ''")
+            else:
+                cursor.execute(f"SELECT imagen, imagen_versiones FROM {archivo} WHERE imagen = %s", [nombre])
+            for imagen, versiones in cursor.fetchall():
+                nombres.add(imagen)
+                if isinstance(versiones, str):  # Con un cursor crudo el jsonb llega como texto
+                    versiones = json.loads(versiones)
+                for formatos in (versiones or {}).values():
+                    nombres.update(archivo_version['nombre'] for archivo_version in formatos.values())
+    return nombres
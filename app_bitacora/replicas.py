@@ -0,0 +1,164 @@
+import random
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Lecturas en replicas: las vistas marcadas con @lectura_en_replica leen de una replica (si hay alguna configurada
+# en BITACORA_REPLICAS y esta al dia), todo lo demas va a la base principal. Despues de escribir, el usuario queda
+# fijado a la principal unos segundos (cookie) para que vea enseguida lo que acaba de guardar
+
+COOKIE_PRIMARIA = 'bitacora_primaria'
+INTERVALO_CONTROL_RETRASO = 2  # Segundos que se reutiliza la medicion del retraso de cada replica
+
+class EstadoConsultas:
+    # A que base van las lecturas del request en curso. Es un objeto mutable dentro de la ContextVar para que
+    # los cambios se vean tambien desde los hilos de sync_to_async (que trabajan con una copia del contexto)
+    def __init__(self):
+        self.replica = False
+        self.alias = None
+        self.escribio = False
+
+_estado = ContextVar('bitacora_estado_consultas', default=None)
+_retrasos = {}
+
+def retraso_replica(alias):
+    '''
+        Segundos de retraso de la replica respecto de la principal (inf si no responde). En PostgreSQL, si la
+        replica ya aplico todo lo que recibio el retraso es 0 aunque la principal no haya escrito hace rato.
+    '''
+    ahora = time.monotonic()
+    guardado = _retrasos.get(alias)
+    if guardado and ahora - guardado[0] < INTERVALO_CONTROL_RETRASO:
+        return guardado[1]
+
+    conexion = connections[alias]
+    retraso = 0.0
+    if conexion.vendor == 'postgresql':
+        try:
+            with conexion.cursor() as cursor:
+                cursor.execute("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END
+                """)
+                retraso = float(cursor.fetchone()[0])
+        except DatabaseError:
+            retraso = float('inf')
+    _retrasos[alias] = (ahora, retraso)
+    return retraso
+
+def elegir_replica():
+    # Una replica al azar entre las que estan al dia, o None si ninguna lo esta
+    replicas = list(settings.BITACORA_REPLICAS)
+    random.shuffle(replicas)
+    for alias in replicas:
+        if retraso_replica(alias) <= settings.BITACORA_REPLICA_RETRASO_MAXIMO:
+            return alias
+    return None
+
+def fijado_a_primaria(request):
+    try:
+        return float(request.COOKIES.get(COOKIE_PRIMARIA, 0)) > time.time()
+    except ValueError:
+        return False
+
+class RouterReplicas:
+
+    def db_for_read(self, model, **hints):
+        estado = _estado.get()
+        if estado is None or not estado.replica or estado.escribio:
+            return DEFAULT_DB_ALIAS
+        if estado.alias is None:
+            # Todas las lecturas del request van a la misma replica, asi la pagina es consistente
+            estado.alias = elegir_replica() or DEFAULT_DB_ALIAS
+        return estado.alias
+
+    def db_for_write(self, model, **hints):
+        estado = _estado.get()
+        if estado is not None:
+            estado.escribio = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las replicas tienen los mismos datos que la principal
+        return True
+
+def lectura_en_replica(vista):
+    '''
+        Decorador para vistas de solo lectura: los GET leen de una replica, salvo que el usuario haya escrito
+        hace poco. Va debajo de @login_required, asi la sesion y el usuario se leen de la principal.
+    '''
+    def marcar(request):
+        estado = _estado.get()
+        if estado is not None and request.method in ('GET', 'HEAD') and not fijado_a_primaria(request):
+            estado.replica = True
+
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            marcar(request)
+            return await vista(request, *args, **kwargs)
+    else:
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            marcar(request)
+            return vista(request, *args, **kwargs)
+    return envoltura
+
+@contextmanager
+def en_primaria():
+    # Para lo que se guarda en un cache compartido (ej. el feed): no puede salir de una replica atrasada
+    estado = _estado.get()
+    anterior = estado.replica if estado is not None else None
+    if estado is not None:
+        estado.replica = False
+    try:
+        yield
+    finally:
+        if estado is not None:
+            estado.replica = anterior
+
+class ReplicasMiddleware:
+    '''
+        Crea el estado de consultas de cada request y, si en el request se escribio algo, fija al usuario a la
+        base principal por BITACORA_PRIMARIA_TRAS_ESCRIBIR segundos. Funciona en modo sync y async.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        estado = EstadoConsultas()
+        token = _estado.set(estado)
+        try:
+            return self.fijar(self.get_response(request), estado)
+        finally:
+            _estado.reset(token)
+
+    async def __acall__(self, request):
+        estado = EstadoConsultas()
+        token = _estado.set(estado)
+        try:
+            return self.fijar(await self.get_response(request), estado)
+        finally:
+            _estado.reset(token)
+
+    def fijar(self, respuesta, estado):
+        if estado.escribio and settings.BITACORA_REPLICAS:
+            segundos = settings.BITACORA_PRIMARIA_TRAS_ESCRIBIR
+            respuesta.set_cookie(COOKIE_PRIMARIA, str(int(time.time() + segundos)), max_age=segundos,
+                                 httponly=True, samesite='Lax')
+        return respuesta
@@ -0,0 +1,117 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Entrada, Coleccion
+from .cache import invalidar_fragmentos_usuario, invalidar_feed
+from .imagenes import encolar_procesamiento_imagen
+from .almacenamiento import liberar_imagen
+from .tiempo_real import publicar_entrada
+from .contadores import sumar_entradas_usuario, sumar_vinculos, vinculos_existentes, contando_en_lote
+from .metricas import medir_consulta
+from .consultas import vigilar_consulta
+
+# Cualquier cambio en las entradas o colecciones de un usuario invalida sus fragmentos cacheados
+
+@receiver([post_save, post_delete], sender=Entrada)
+def invalidar_fragmentos_entrada(sender, instance, **kwargs):
+    invalidar_fragmentos_usuario(instance.usuario_id)
+
+@receiver([post_save, post_delete], sender=Coleccion)
+def invalidar_fragmentos_coleccion(sender, instance, **kwargs):
+    invalidar_fragmentos_usuario(instance.usuario_id)
+
+@receiver(m2m_changed, sender=Entrada.colecciones.through)
+def invalidar_fragmentos_vinculos(sender, instance, action, **kwargs):
+    # instance puede ser la entrada o la coleccion segun de que lado se modifico la relacion
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidar_fragmentos_usuario(instance.usuario_id)
+
+# El feed publico cacheado solo se invalida si la entrada es publica o lo era antes de guardarla. Se invalida
+# despues del commit: si no, un request anonimo podria regenerar el feed con los datos de antes del commit y
+# guardarlo con la version nueva, y quedaria viejo hasta que venza
+
+@receiver(post_save, sender=Entrada)
+def invalidar_feed_al_guardar(sender, instance, **kwargs):
+    if instance.tipo_entrada == 'publica' or instance.tipo_entrada_original == 'publica':
+        transaction.on_commit(invalidar_feed)
+
+@receiver(post_delete, sender=Entrada)
+def invalidar_feed_al_eliminar(sender, instance, **kwargs):
+    if instance.tipo_entrada_original == 'publica':
+        transaction.on_commit(invalidar_feed)
+
+# Las entradas que pasan a ser publicas se envian al feed en vivo (SSE) despues del commit
+
+@receiver(post_save, sender=Entrada)
+def publicar_en_feed_en_vivo(sender, instance, **kwargs):
+    if instance.tipo_entrada == 'publica' and instance.tipo_entrada_original != 'publica':
+        entrada_id = instance.id
+        transaction.on_commit(lambda: publicar_entrada(entrada_id))
+
+# Cuando se sube una imagen nueva se generan sus versiones en segundo plano. Se encola recien despues del
+# commit para que el hilo que la procesa ya vea la entrada guardada
+
+@receiver(post_save, sender=Entrada)
+def procesar_imagen_nueva(sender, instance, **kwargs):
+    if 'imagen' in instance.__dict__ and instance.imagen and instance.imagen_cambio():
+        entrada_id, nombre = instance.id, instance.imagen.name
+        transaction.on_commit(lambda: encolar_procesamiento_imagen(entrada_id, nombre))
+
+# Cuando una entrada deja de usar una imagen, el archivo se borra si ninguna otra entrada lo comparte
+
+@receiver(post_save, sender=Entrada)
+def liberar_imagen_reemplazada(sender, instance, **kwargs):
+    if 'imagen' in instance.__dict__ and instance.imagen_original and instance.imagen_cambio():
+        nombre = instance.imagen_original
+        transaction.on_commit(lambda: liberar_imagen(nombre))
+
+@receiver(post_delete, sender=Entrada)
+def liberar_imagen_eliminada(sender, instance, **kwargs):
+    if instance.imagen_original:
+        nombre = instance.imagen_original
+        transaction.on_commit(lambda: liberar_imagen(nombre))
+
+# Contadores de entradas por usuario (publicas/privadas) y por coleccion (ver contadores.py)
+
+@receiver(post_save, sender=Entrada)
+def contar_entrada_guardada(sender, instance, created, **kwargs):
+    if created:
+        sumar_entradas_usuario(instance.usuario_id, {instance.tipo_entrada: 1})
+    elif instance.tipo_entrada_original and instance.tipo_entrada != instance.tipo_entrada_original:
+        sumar_entradas_usuario(instance.usuario_id, {instance.tipo_entrada: 1, instance.tipo_entrada_original: -1})
+
+@receiver(pre_delete, sender=Entrada)
+def descontar_entrada_eliminada(sender, instance, **kwargs):
+    # En pre_delete todavia existen los vinculos con las colecciones (despues los borra el CASCADE). Los borrados
+    # de muchas entradas juntas se descuentan agrupados (ver contadores.contadores_en_lote)
+    if contando_en_lote():
+        return
+    sumar_entradas_usuario(instance.usuario_id, {instance.tipo_entrada_original or instance.tipo_entrada: -1})
+    sumar_vinculos(vinculos_existentes(entrada_ids=[instance.id]), -1)
+
+@receiver(m2m_changed, sender=Entrada.colecciones.through)
+def contar_vinculos(sender, instance, action, reverse, pk_set, **kwargs):
+    # Desde la entrada (reverse=False) pk_set son ids de colecciones; desde la coleccion son ids de entradas
+    if action == 'post_add' and pk_set:
+        vinculos = [(instance.id, pk) for pk in pk_set] if not reverse else [(pk, instance.id) for pk in pk_set]
+        sumar_vinculos(vinculos)
+    elif action in ('pre_remove', 'pre_clear'):
+        # Lo que se va a quitar se calcula antes, para descontar solo los vinculos que existian
+        if reverse:
+            instance._vinculos_a_quitar = vinculos_existentes(entrada_ids=pk_set, coleccion_ids=[instance.id])
+        else:
+            instance._vinculos_a_quitar = vinculos_existentes(entrada_ids=[instance.id], coleccion_ids=pk_set)
+    elif action in ('post_remove', 'post_clear'):
+        sumar_vinculos(instance.__dict__.pop('_vinculos_a_quitar', []), -1)
+
+# Las consultas de todas las conexiones (tambien las de las replicas) se cuentan en las metricas del request
+# y pasan por el detector de consultas repetidas y lentas
+
+@receiver(connection_created)
+def instalar_medicion_consultas(sender, connection, **kwargs):
+    # Al principio de la lista: connection.execute_wrapper() quita el ultimo al salir del bloque
+    for wrapper in (vigilar_consulta, medir_consulta):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, wrapper)
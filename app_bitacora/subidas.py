@@ -0,0 +1,85 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .cache import sumar_contador
+
+logger = logging.getLogger(__name__)
+
+CLAVE_SUBIDAS = 'bitacora:subidas:cantidad'
+CLAVE_SUBIDAS_RECHAZADAS = 'bitacora:subidas:rechazadas'
+CLAVE_SUBIDAS_BYTES = 'bitacora:subidas:bytes'
+CLAVE_SUBIDAS_MILISEGUNDOS = 'bitacora:subidas:milisegundos'
+
+def tamanio_maximo(campo):
+    # El archivo de importacion de entradas puede ser mas grande que una imagen (ver importacion.py)
+    if campo == 'archivo_importacion':
+        return settings.BITACORA_IMPORTACION_TAMANIO_MAXIMO
+    return settings.BITACORA_IMAGEN_TAMANIO_MAXIMO
+
+class SubidaEnDiscoHandler(FileUploadHandler):
+    '''
+        Reemplaza a los handlers de Django (ver FILE_UPLOAD_HANDLERS): cada archivo se escribe en un archivo
+        temporal de a pedazos de 64 KB, nunca entero en memoria. Si el archivo supera el tamanio maximo de
+        su campo se deja de escribir apenas se pasa del limite, y el archivo que llega al formulario viene
+        marcado con error_subida para que la validacion lo rechace con un mensaje claro (en vez de que la
+        entrada se guarde sin imagen).
+    '''
+    chunk_size = 64 * 2 ** 10
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.tamanio_request = content_length
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.archivo = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.inicio = time.perf_counter()
+        self.recibidos = 0
+        self.error = None
+        self.limite = tamanio_maximo(self.field_name)
+        # Si el request completo ya es mas grande que el limite (mas un margen para los otros campos),
+        # el archivo no puede entrar y no hace falta escribir nada a disco
+        if getattr(self, 'tamanio_request', 0) > self.limite + 2 ** 20 or (self.content_length or 0) > self.limite:
+            self.error = self.mensaje_tamanio()
+
+    def mensaje_tamanio(self):
+        return f"El archivo no puede pesar más de {self.limite // 2 ** 20} MB."
+
+    def receive_data_chunk(self, raw_data, start):
+        self.recibidos += len(raw_data)
+        if self.error is None and self.recibidos > self.limite:
+            self.error = self.mensaje_tamanio()
+            self.archivo.seek(0)
+            self.archivo.truncate()  # Lo que ya se escribio no sirve, se libera el disco
+        if self.error is None:
+            self.archivo.write(raw_data)
+        return None  # Ningun otro handler recibe el pedazo
+
+    def file_complete(self, file_size):
+        self.archivo.seek(0)
+        self.archivo.size = 0 if self.error else file_size
+        self.archivo.error_subida = self.error
+
+        milisegundos = (time.perf_counter() - self.inicio) * 1000
+        self.archivo.metricas = {'bytes': self.recibidos, 'milisegundos': round(milisegundos, 2)}
+        logger.info("Subida de %s: %d bytes en %.2f ms%s", self.file_name, self.recibidos, milisegundos,
+                    f" (rechazada: {self.error})" if self.error else "")
+        sumar_contador(CLAVE_SUBIDAS, 1)
+        sumar_contador(CLAVE_SUBIDAS_RECHAZADAS, 1 if self.error else 0)
+        sumar_contador(CLAVE_SUBIDAS_BYTES, self.recibidos)
+        sumar_contador(CLAVE_SUBIDAS_MILISEGUNDOS, round(milisegundos))
+        return self.archivo
+
+def estadisticas_subidas():
+    contadores = cache.get_many([CLAVE_SUBIDAS, CLAVE_SUBIDAS_RECHAZADAS, CLAVE_SUBIDAS_BYTES, CLAVE_SUBIDAS_MILISEGUNDOS])
+    cantidad = contadores.get(CLAVE_SUBIDAS, 0)
+    return {
+        'subidas': cantidad,
+        'rechazadas': contadores.get(CLAVE_SUBIDAS_RECHAZADAS, 0),
+        'bytes': contadores.get(CLAVE_SUBIDAS_BYTES, 0),
+        'milisegundos_promedio': round(contadores.get(CLAVE_SUBIDAS_MILISEGUNDOS, 0) / cantidad, 2) if cantidad else None,
+    }
@@ -0,0 +1,30 @@
+from django import template
+from django.core.files.storage import default_storage
+
+register = template.Library()
+
+def armar_srcset(versiones, extension):
+    # Una version por ancho: si la imagen original era chica, varias versiones pueden haber quedado del mismo tamaño
+    anchos = {}
+    for archivos in versiones.values():
+        archivo = archivos.get(extension)
+        if archivo:
+            anchos.setdefault(archivo['ancho'], archivo['nombre'])
+    return ', '.join(f"{default_storage.url(nombre)} {ancho}w" for ancho, nombre in sorted(anchos.items()))
+
+@register.inclusion_tag('app_bitacora/imagen_entrada.html')
+def imagen_entrada(entrada):
+    '''
+        Muestra la imagen de la entrada. Si ya se generaron sus versiones usa <picture> con srcset,
+        asi el navegador descarga la version del tamaño que necesita (en WebP si lo soporta).
+        Mientras tanto se muestra la imagen original.
+    '''
+    versiones = entrada.imagen_versiones if entrada.imagen else {}
+    contexto = {'entrada': entrada, 'versiones': bool(versiones)}
+    if versiones:
+        contexto.update({
+            'srcset_webp': armar_srcset(versiones, 'webp'),
+            'srcset_jpeg': armar_srcset(versiones, 'jpeg'),
+            'src_jpeg': default_storage.url(versiones['feed']['jpeg']['nombre']),
+        })
+    return contexto
@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+from asgiref.sync import sync_to_async
+from PIL import Image, ImageFile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Usuario, Entrada, Coleccion, EntradaColeccion
+from .cache import estadisticas_cache
+from .subidas import estadisticas_subidas
+from .tiempo_real import hub
+from .replicas import COOKIE_PRIMARIA
+from .metricas import reiniciar_metricas
+from .contadores import contadores_en_lote
+from .acceso import cache_login, clave_usuario, reservar_intento
+from .datos_sinteticos import generar_dataset, repartir_con_sesgo
+from .management.commands.bench_vistas import Command as BenchVistas
+from .management.commands.auditar_consultas import urls_a_auditar
+from .consultas import DetectorConsultasMiddleware, ConsultasProblematicas, huella_consulta, reporte_consultas
+from .particiones import inicio_periodo, siguiente_periodo, nombre_particion, intervalo_de, INTERVALO_MES, INTERVALO_ANIO
+
+class ConsultasPorVistaTests(TestCase):
+    '''
+        Arnes de regresion contra N+1: la cantidad de consultas de cada vista
+        tiene que tener un tope y no puede crecer a medida que crecen los datos.
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        self.creadas = 0
+
+    def crear_datos(self, cantidad):
+        # Cada tanda crea otro autor con entradas publicas y privadas, y colecciones con entradas adentro
+        self.creadas += 1
+        autor = Usuario.objects.create_user(username=f'autor{self.creadas}', email=f'autor{self.creadas}@mail.com')
+        ahora = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):  # El feed cacheado se invalida despues del commit
+            for i in range(cantidad):
+                for usuario in (self.usuario, autor):
+                    entrada = Entrada.objects.create(
+                        detalle_entrada=f'entrada {self.creadas}-{i}',
+                        fecha_entrada=ahora - timedelta(minutes=i),
+                        tipo_entrada='publica' if i % 2 else 'privada',
+                        usuario=usuario,
+                    )
+                    coleccion = Coleccion.objects.create(nombre_coleccion=f'coleccion {self.creadas}-{i}',
+                                                         detalle_coleccion='detalle', usuario=usuario)
+                    entrada.colecciones.add(coleccion)
+
+    def contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as contexto:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(contexto)
+
+    def assertConsultasAcotadas(self, url, maximo):
+        self.crear_datos(2)
+        con_pocos_datos = self.contar_consultas(url)
+        self.crear_datos(10)
+        con_muchos_datos = self.contar_consultas(url)
+        self.assertEqual(con_pocos_datos, con_muchos_datos)
+        self.assertLessEqual(con_muchos_datos, maximo)
+
+    def test_pagina_principal(self):
+        # La cuarta consulta es el ultimo id para el feed en vivo (solo cuando se regenera la pagina cacheada)
+        self.assertConsultasAcotadas(reverse('bitacora:pagina_principal'), 4)
+
+    def test_mis_entradas(self):
+        self.assertConsultasAcotadas(reverse('bitacora:mis_entradas'), 4)
+
+    def test_mis_entradas_con_filtros(self):
+        url = reverse('bitacora:mis_entradas') + '?tipo_entrada=publica&busqueda_x_detalle_entrada=entrada'
+        self.assertConsultasAcotadas(url, 4)
+
+    def test_mis_colecciones(self):
+        # Solo el resumen: la cantidad de entradas sale del contador de cada coleccion
+        self.assertConsultasAcotadas(reverse('bitacora:mis_colecciones'), 3)
+
+class BusquedaEntradasTests(TestCase):
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        for detalle in ('Caminata por la montaña', 'Caminata por la playa', 'Tarde de lectura'):
+            Entrada.objects.create(detalle_entrada=detalle, fecha_entrada=timezone.now(),
+                                   tipo_entrada='privada', usuario=self.usuario)
+
+    def buscar(self, texto):
+        respuesta = self.client.get(reverse('bitacora:mis_entradas'), {'busqueda_x_detalle_entrada': texto})
+        return sorted(entrada.detalle_entrada for entrada in respuesta.context['entradas'])
+
+    def test_todas_las_palabras_tienen_que_coincidir(self):
+        self.assertEqual(self.buscar('caminata montaña'), ['Caminata por la montaña'])
+
+    def test_coincidencia_parcial(self):
+        self.assertEqual(self.buscar('camin'), ['Caminata por la montaña', 'Caminata por la playa'])
+
+    def test_palabras_vacias_siguen_encontrando(self):
+        # En PostgreSQL "de" no queda en el tsquery: tiene que resolverlo icontains
+        self.assertEqual(self.buscar('de'), ['Tarde de lectura'])
+
+    def test_busqueda_de_colecciones_por_nombre(self):
+        for nombre in ('Viajes 2024', 'Recetas', 'Viajes de trabajo'):
+            Coleccion.objects.create(nombre_coleccion=nombre, detalle_coleccion='detalle', usuario=self.usuario)
+        respuesta = self.client.get(reverse('bitacora:mis_colecciones'), {'busqueda_x_nombre_coleccion': 'viaj'})
+        nombres = sorted(coleccion.nombre_coleccion for coleccion in respuesta.context['colecciones'])
+        self.assertEqual(nombres, ['Viajes 2024', 'Viajes de trabajo'])
+
+class CacheFragmentosTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        self.entrada = Entrada.objects.create(detalle_entrada='Primera version', fecha_entrada=timezone.now(),
+                                              tipo_entrada='privada', usuario=self.usuario)
+
+    def test_la_segunda_visita_sale_del_cache(self):
+        self.client.get(reverse('bitacora:mis_entradas'))
+        respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertContains(respuesta, '<strong>Detalle:</strong> Primera version')
+        self.assertEqual(estadisticas_cache()['aciertos'], 1)
+        self.assertEqual(estadisticas_cache()['fallos'], 1)
+
+    def test_editar_la_entrada_invalida_su_tarjeta(self):
+        self.client.get(reverse('bitacora:mis_entradas'))
+        self.entrada.detalle_entrada = 'Segunda version'
+        self.entrada.save()
+        respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertContains(respuesta, 'Segunda version')
+        self.assertNotContains(respuesta, 'Primera version')
+
+    def test_crear_una_coleccion_invalida_las_tarjetas_del_usuario(self):
+        self.client.get(reverse('bitacora:mis_entradas'))
+        Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='detalle', usuario=self.usuario)
+        self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertEqual(estadisticas_cache()['aciertos'], 0)
+
+class CacheFeedPublicoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.entrada = Entrada.objects.create(detalle_entrada='Entrada publica', fecha_entrada=timezone.now(),
+                                              tipo_entrada='publica', usuario=self.usuario)
+        self.url = reverse('bitacora:pagina_principal')
+
+    def test_visitante_que_vuelve_recibe_304(self):
+        respuesta = self.client.get(self.url)
+        self.assertContains(respuesta, 'Entrada publica')
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_la_copia_cacheada_no_consulta_la_base(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as contexto:
+            self.client.get(self.url)
+        self.assertEqual(len(contexto), 0)
+
+    def test_una_entrada_privada_no_invalida_el_feed(self):
+        etag = self.client.get(self.url)['ETag']
+        Entrada.objects.create(detalle_entrada='Entrada privada', fecha_entrada=timezone.now(),
+                               tipo_entrada='privada', usuario=self.usuario)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_hacer_privada_una_entrada_la_saca_del_feed(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entrada.tipo_entrada = 'privada'
+            self.entrada.save()
+            # Hasta el commit el feed no se invalida, asi nadie lo regenera con los datos de antes
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotContains(respuesta, 'Entrada publica')
+
+    def test_eliminar_una_entrada_publica_la_saca_del_feed(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Entrada.objects.get(id=self.entrada.id).delete()
+        self.assertNotContains(self.client.get(self.url), 'Entrada publica')
+
+def crear_imagen_jpeg(ancho=2000, alto=1000, color='red'):
+    exif = Image.Exif()
+    exif[0x010F] = 'Camara de prueba'  # Make
+    buffer = BytesIO()
+    Image.new('RGB', (ancho, alto), color).save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+class ProcesamientoImagenesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media, BITACORA_IMAGENES_SINCRONO=True)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+
+    def subir_entrada(self, contenido):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bitacora:agregar_entrada'), {
+                'detalle_entrada': 'Con foto',
+                'fecha_entrada': (timezone.now() - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+                'tipo_entrada': 'privada',
+                'imagen': SimpleUploadedFile('foto.jpg', contenido, content_type='image/jpeg'),
+            })
+        return Entrada.objects.filter(usuario=self.usuario).latest('id')
+
+    def test_genera_las_versiones_sin_exif(self):
+        entrada = self.subir_entrada(crear_imagen_jpeg())
+        self.assertEqual(set(entrada.imagen_versiones), {'miniatura', 'feed', 'completa'})
+        for version, ancho in (('miniatura', 320), ('feed', 800), ('completa', 1600)):
+            for extension in ('webp', 'jpeg'):
+                archivo = entrada.imagen_versiones[version][extension]
+                self.assertEqual(archivo['ancho'], ancho)
+                with default_storage.open(archivo['nombre']) as imagen:
+                    self.assertEqual(len(Image.open(imagen).getexif()), 0)
+
+    def test_la_tarjeta_usa_srcset(self):
+        self.subir_entrada(crear_imagen_jpeg())
+        respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertContains(respuesta, 'type="image/webp"')
+        self.assertContains(respuesta, '320w')
+
+    def envejecer_archivos(self):
+        # Simula que los archivos se subieron hace rato, para que se puedan borrar
+        hace_un_dia = time.time() - 60 * 60 * 24
+        for carpeta, _, archivos in os.walk(self.media):
+            for archivo in archivos:
+                os.utime(os.path.join(carpeta, archivo), (hace_un_dia, hace_un_dia))
+
+    def eliminar(self, entrada):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bitacora:eliminar_entrada', args=[entrada.id]))
+
+    def test_imagenes_iguales_se_guardan_una_vez(self):
+        contenido = crear_imagen_jpeg()
+        primera = self.subir_entrada(contenido)
+        segunda = self.subir_entrada(contenido)
+        self.assertEqual(primera.imagen.name, segunda.imagen.name)
+        self.assertEqual(primera.imagen_versiones, segunda.imagen_versiones)
+
+        self.envejecer_archivos()
+        self.eliminar(primera)
+        self.assertTrue(default_storage.exists(segunda.imagen.name))  # La sigue usando la segunda entrada
+        self.eliminar(segunda)
+        self.assertFalse(default_storage.exists(segunda.imagen.name))
+
+    def test_recolectar_borra_solo_los_huerfanos(self):
+        entrada = self.subir_entrada(crear_imagen_jpeg())
+        huerfano = default_storage.save('imagenes/huerfano.jpg', SimpleUploadedFile('huerfano.jpg', b'sin entrada'))
+        reciente = default_storage.save('imagenes/reciente.jpg', SimpleUploadedFile('reciente.jpg', b'recien subido'))
+        self.envejecer_archivos()
+        os.utime(default_storage.path(reciente))
+
+        call_command('recolectar_imagenes', stdout=StringIO())
+
+        self.assertFalse(default_storage.exists(huerfano))
+        self.assertTrue(default_storage.exists(reciente))
+        self.assertTrue(default_storage.exists(entrada.imagen.name))
+        self.assertTrue(default_storage.exists(entrada.imagen_versiones['feed']['webp']['nombre']))
+
+@override_settings(BITACORA_IMAGENES_SINCRONO=True)
+class SubidaImagenesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+
+    def subir(self, contenido):
+        return self.client.post(reverse('bitacora:agregar_entrada'), {
+            'detalle_entrada': 'Con foto',
+            'fecha_entrada': (timezone.now() - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'tipo_entrada': 'privada',
+            'imagen': SimpleUploadedFile('foto.jpg', contenido, content_type='image/jpeg'),
+        })
+
+    @override_settings(BITACORA_IMAGEN_TAMANIO_MAXIMO=100 * 1024)
+    def test_rechaza_archivos_que_superan_el_tamanio(self):
+        respuesta = self.subir(crear_imagen_jpeg(200, 100) + b'\0' * 200 * 1024)
+        self.assertContains(respuesta, 'no puede pesar más de')
+        self.assertFalse(Entrada.objects.exists())
+        self.assertEqual(estadisticas_subidas()['rechazadas'], 1)
+
+    def test_rechaza_archivos_que_no_son_imagenes(self):
+        respuesta = self.subir(b'esto no es una imagen')
+        self.assertContains(respuesta, 'no es una imagen')
+        self.assertFalse(Entrada.objects.exists())
+
+    @override_settings(BITACORA_IMAGEN_LADO_MAXIMO=1000)
+    def test_rechaza_dimensiones_sin_decodificar_la_imagen(self):
+        contenido = crear_imagen_jpeg(2000, 1000)
+        with patch.object(ImageFile.ImageFile, 'load', side_effect=AssertionError("no deberia decodificarse")):
+            respuesta = self.subir(contenido)
+        self.assertContains(respuesta, 'demasiado grande')
+        self.assertFalse(Entrada.objects.exists())
+
+    def test_registra_las_metricas_de_las_subidas(self):
+        contenido = crear_imagen_jpeg(200, 100)
+        self.subir(contenido)
+        self.assertTrue(Entrada.objects.exists())
+        estadisticas = estadisticas_subidas()
+        self.assertEqual(estadisticas['subidas'], 1)
+        self.assertEqual(estadisticas['bytes'], len(contenido))
+
+class ImportacionExportacionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+
+    def importar(self, nombre, contenido):
+        return self.client.post(reverse('bitacora:importar_entradas'), {
+            'archivo_importacion': SimpleUploadedFile(nombre, contenido.encode()),
+        })
+
+    def test_importa_jsonl_en_lotes_con_colecciones(self):
+        lineas = ['{"nombre_coleccion": "Viajes", "detalle_coleccion": "Mis viajes"}']
+        lineas += [json.dumps({'detalle_entrada': f'Entrada {numero}', 'fecha_entrada': '2024-05-01T18:30',
+                               'tipo_entrada': 'publica', 'colecciones': ['Viajes', 'Nueva']}) for numero in range(25)]
+        lineas += ['{"detalle_entrada": "Del futuro", "fecha_entrada": "2999-01-01T00:00"}', 'no es json',
+                   '{"nombre_coleccion": "Viajes", "detalle_coleccion": "Repetida"}']
+
+        with patch('app_bitacora.importacion.LOTE_IMPORTACION', 10), CaptureQueriesContext(connection) as contexto:
+            respuesta = self.importar('entradas.jsonl', '\n'.join(lineas))
+        inserciones = [c['sql'] for c in contexto.captured_queries if c['sql'].startswith('INSERT INTO "app_bitacora_entrada"')]
+        self.assertEqual(len(inserciones), 3)  # 25 entradas en lotes de 10
+
+        self.assertContains(respuesta, 'Se importaron 25 entradas')
+        self.assertContains(respuesta, 'Línea 27: La fecha no puede estar en el futuro.')
+        self.assertContains(respuesta, 'Línea 28')
+        self.assertContains(respuesta, 'Línea 29')
+        self.assertEqual(Entrada.objects.filter(usuario=self.usuario).count(), 25)
+        self.assertEqual(sorted(Coleccion.objects.values_list('nombre_coleccion', flat=True)), ['Nueva', 'Viajes'])
+        self.assertEqual(Coleccion.objects.get(nombre_coleccion='Viajes').entradas.count(), 25)
+
+    def test_la_exportacion_se_puede_volver_a_importar(self):
+        self.importar('entradas.csv', 'detalle_entrada,fecha_entrada,tipo_entrada,colecciones\n'
+                                      'Primera,2024-05-01T18:30,privada,Viajes|Trabajo\n'
+                                      '"Segunda, con coma",2024-05-02T10:00,publica,\n')
+        respuesta = self.client.get(reverse('bitacora:exportar_entradas') + '?formato=csv')
+        self.assertTrue(respuesta.streaming)
+        exportado = b''.join(respuesta.streaming_content).decode()
+
+        otro = Usuario.objects.create_user(username='beto', email='beto@mail.com', password='clave-segura-123')
+        self.client.force_login(otro)
+        self.importar('entradas.csv', exportado)
+        self.assertEqual(sorted(Entrada.objects.filter(usuario=otro).values_list('detalle_entrada', flat=True)),
+                         ['Primera', 'Segunda, con coma'])
+        self.assertEqual(Coleccion.objects.filter(usuario=otro).count(), 2)
+
+    def test_filas_con_valores_invalidos_no_cortan_la_importacion(self):
+        lineas = ['{"detalle_entrada": "Fecha imposible", "fecha_entrada": "2024-02-30T10:00"}',
+                  '{"detalle_entrada": "Tipo lista", "fecha_entrada": "2024-05-01T18:30", "tipo_entrada": ["publica"]}',
+                  '{"detalle_entrada": "Valida", "fecha_entrada": "2024-05-01T18:30"}']
+        respuesta = self.importar('entradas.jsonl', '\n'.join(lineas))
+        self.assertContains(respuesta, 'Se importaron 1 entradas')
+        self.assertContains(respuesta, 'Línea 1: La fecha no tiene un formato válido')
+        self.assertContains(respuesta, 'Línea 2: El tipo de entrada tiene que ser')
+
+    def test_csv_mal_formado_se_informa_sin_cortar_la_importacion(self):
+        contenido = ('detalle_entrada,fecha_entrada,tipo_entrada,colecciones\n'
+                     'Primera,2024-05-01T18:30,privada,\n'
+                     f'"{"x" * 200_000}",2024-05-01T18:30,privada,\n'
+                     'Despues del error,2024-05-01T18:30,privada,\n')
+        respuesta = self.importar('entradas.csv', contenido)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, 'Se importaron 1 entradas')
+        self.assertContains(respuesta, 'El CSV no es válido (field larger than field limit')
+        self.assertEqual(list(Entrada.objects.filter(usuario=self.usuario).values_list('detalle_entrada', flat=True)), ['Primera'])
+
+    def test_nombre_de_coleccion_largo_rechaza_la_fila(self):
+        linea = json.dumps({'detalle_entrada': 'Con coleccion', 'fecha_entrada': '2024-05-01T18:30', 'colecciones': ['x' * 81]})
+        respuesta = self.importar('entradas.jsonl', linea)
+        self.assertContains(respuesta, 'Línea 1: Los nombres de las colecciones no pueden superar los 80 caracteres.')
+        self.assertFalse(Coleccion.objects.filter(usuario=self.usuario).exists())
+
+    def test_archivo_que_no_es_utf8(self):
+        contenido = 'detalle_entrada,fecha_entrada,tipo_entrada,colecciones\nCañón,2024-05-01T18:30,privada,\n'
+        respuesta = self.client.post(reverse('bitacora:importar_entradas'), {
+            'archivo_importacion': SimpleUploadedFile('entradas.csv', contenido.encode('latin-1')),
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, 'El archivo no está codificado en UTF-8 (línea 2)')
+        self.assertFalse(Entrada.objects.filter(usuario=self.usuario).exists())
+
+class ApiEntradasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        self.coleccion = Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='Mis viajes', usuario=self.usuario)
+        for numero in range(5):
+            entrada = Entrada.objects.create(detalle_entrada=f'Entrada {numero}', tipo_entrada='publica' if numero % 2 else 'privada',
+                                             fecha_entrada=timezone.now() - timedelta(days=numero), usuario=self.usuario)
+            if numero < 2:
+                entrada.colecciones.add(self.coleccion)
+
+    def test_campos_filtros_y_cursor(self):
+        url = reverse('bitacora:api_entradas')
+        respuesta = self.client.get(url, {'fields': 'detalle_entrada,colecciones', 'tamanio': 3})
+        datos = respuesta.json()
+        self.assertEqual(datos['resultados'][0], {'detalle_entrada': 'Entrada 0', 'colecciones': [self.coleccion.id]})
+        self.assertEqual(len(datos['resultados']), 3)
+
+        siguiente = self.client.get(url, {'fields': 'detalle_entrada', 'tamanio': 3, 'cursor': datos['siguiente_cursor']}).json()
+        self.assertEqual([fila['detalle_entrada'] for fila in siguiente['resultados']], ['Entrada 3', 'Entrada 4'])
+        self.assertIsNone(siguiente['siguiente_cursor'])
+
+        publicas = self.client.get(url, {'fields': 'id', 'tipo_entrada': 'publica'}).json()
+        self.assertEqual(len(publicas['resultados']), 2)
+        self.assertEqual(self.client.get(url, {'fields': 'id,clave'}).status_code, 400)
+
+    def test_filtros_invalidos_devuelven_400(self):
+        url = reverse('bitacora:api_entradas')
+        for filtros, campo in (({'coleccion': 999}, 'coleccion'), ({'tipo_entrada': 'foo'}, 'tipo_entrada'),
+                               ({'fecha_desde': '2024-13-01'}, 'fecha_desde')):
+            respuesta = self.client.get(url, filtros)
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertIn(campo, respuesta.json()['campos'])
+            self.assertNotIn('ETag', respuesta)
+            # If-None-Match: * coincide con cualquier ETag, pero el filtro invalido sigue siendo un 400
+            self.assertEqual(self.client.get(url, filtros, HTTP_IF_NONE_MATCH='*').status_code, 400)
+
+    def test_etag_devuelve_304_sin_consultar_las_entradas(self):
+        url = reverse('bitacora:api_entradas')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as contexto:
+            respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertFalse([c for c in contexto.captured_queries if 'app_bitacora_entrada' in c['sql']])
+
+        Entrada.objects.first().colecciones.add(self.coleccion)  # Cualquier cambio genera un etag nuevo
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_feed_publico_sin_sesion(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('bitacora:api_entradas')).status_code, 401)
+        datos = self.client.get(reverse('bitacora:api_feed'), {'fields': 'usuario,detalle_entrada'}).json()
+        self.assertEqual(datos['resultados'], [{'usuario': 'ana', 'detalle_entrada': 'Entrada 1'},
+                                               {'usuario': 'ana', 'detalle_entrada': 'Entrada 3'}])
+
+class VistasAsyncTests(TestCase):
+    '''
+        Recorre las vistas async con el cliente async (como bajo ASGI): si alguna consulta quedara
+        fuera del ORM async, Django lanzaria SynchronousOnlyOperation.
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.coleccion = Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='Mis viajes', usuario=self.usuario)
+        entrada = Entrada.objects.create(detalle_entrada='Subida al cerro', tipo_entrada='publica',
+                                         fecha_entrada=timezone.now() - timedelta(days=1), usuario=self.usuario)
+        entrada.colecciones.add(self.coleccion)
+
+    async def test_vistas_de_lectura(self):
+        respuesta = await self.async_client.get(reverse('bitacora:pagina_principal'))
+        self.assertContains(respuesta, 'Subida al cerro')
+        self.assertEqual((await self.async_client.get(reverse('bitacora:mis_entradas'))).status_code, 302)
+
+        await self.async_client.aforce_login(self.usuario)
+        respuesta = await self.async_client.get(reverse('bitacora:mis_entradas'), {'coleccion': ''})
+        self.assertContains(respuesta, 'Subida al cerro')
+        respuesta = await self.async_client.get(reverse('bitacora:mis_colecciones'))
+        self.assertContains(respuesta, 'Viajes')
+        respuesta = await self.async_client.get(reverse('bitacora:detalle_coleccion', args=[self.coleccion.id]))
+        self.assertContains(respuesta, 'Subida al cerro')
+
+    async def test_el_cache_de_tarjetas_no_bloquea_el_event_loop(self):
+        # Con un cache de red get_many es I/O bloqueante: tiene que correr en un hilo, fuera del event loop
+        en_el_loop = []
+
+        def get_many(claves):
+            try:
+                asyncio.get_running_loop()
+                en_el_loop.append(True)
+            except RuntimeError:
+                en_el_loop.append(False)
+            return {}
+
+        await self.async_client.aforce_login(self.usuario)
+        with patch('app_bitacora.cache.cache.get_many', side_effect=get_many):
+            await self.async_client.get(reverse('bitacora:mis_entradas'))
+            await self.async_client.get(reverse('bitacora:detalle_coleccion', args=[self.coleccion.id]))
+        self.assertEqual(en_el_loop, [False, False])
+
+class FeedEnVivoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+
+    def crear(self, detalle, tipo='publica'):
+        return Entrada.objects.create(detalle_entrada=detalle, tipo_entrada=tipo,
+                                      fecha_entrada=timezone.now() - timedelta(hours=1), usuario=self.usuario)
+
+    def test_publicar_solo_entradas_que_pasan_a_publicas(self):
+        with patch('app_bitacora.signals.publicar_entrada') as publicar:
+            with self.captureOnCommitCallbacks(execute=True):
+                entrada = self.crear('Privada', tipo='privada')
+                entrada.detalle_entrada = 'Sigue privada'
+                entrada.save()
+            publicar.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                entrada.tipo_entrada = 'publica'
+                entrada.save()
+                entrada.save()
+        publicar.assert_called_once_with(entrada.id)
+
+    async def test_envia_lo_pendiente_y_lo_nuevo(self):
+        vieja = await sync_to_async(self.crear)('Vista en la pagina')
+        perdida = await sync_to_async(self.crear)('Publicada mientras estaba desconectado')
+
+        respuesta = await self.async_client.get(reverse('bitacora:feed_en_vivo'), headers={'Last-Event-ID': str(vieja.id)})
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        eventos = aiter(respuesta.streaming_content)
+        self.assertEqual(await anext(eventos), b'retry: 5000\n\n')
+        pendiente = (await anext(eventos)).decode()
+        self.assertIn(f'id: {perdida.id}', pendiente)
+        self.assertIn('Publicada mientras estaba desconectado', pendiente)
+
+        siguiente = asyncio.ensure_future(anext(eventos))
+        await asyncio.sleep(0)  # El generador queda esperando en la cola del hub
+        hub.publicar({'id': perdida.id + 1, 'html': '<li>Nueva</li>'})
+        nuevo = (await asyncio.wait_for(siguiente, 5)).decode()
+        self.assertIn(f'id: {perdida.id + 1}', nuevo)
+        self.assertIn('<li>Nueva</li>', nuevo)
+        await eventos.aclose()
+
+    def test_bajo_wsgi_no_se_abre_el_feed(self):
+        # El cliente de pruebas sincronico pasa por el handler WSGI
+        inicio = time.monotonic()
+        respuesta = self.client.get(reverse('bitacora:feed_en_vivo'))
+        self.assertEqual(respuesta.status_code, 204)
+        self.assertLess(time.monotonic() - inicio, 5)
+        self.assertNotContains(self.client.get(reverse('bitacora:pagina_principal')), 'EventSource')
+
+    async def test_bajo_asgi_la_pagina_abre_el_feed(self):
+        respuesta = await self.async_client.get(reverse('bitacora:pagina_principal'))
+        self.assertContains(respuesta, 'id="feed-en-vivo"')
+        self.assertContains(respuesta, 'EventSource')
+
+class ContadoresEntradasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.coleccion = Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='detalle', usuario=self.usuario)
+        self.otra = Coleccion.objects.create(nombre_coleccion='Libros', detalle_coleccion='detalle', usuario=self.usuario)
+
+    def crear(self, tipo='publica'):
+        return Entrada.objects.create(detalle_entrada='Entrada', tipo_entrada=tipo,
+                                      fecha_entrada=timezone.now() - timedelta(hours=1), usuario=self.usuario)
+
+    def contadores(self):
+        self.usuario.refresh_from_db()
+        self.coleccion.refresh_from_db()
+        self.otra.refresh_from_db()
+        return (self.usuario.cantidad_entradas_publicas, self.usuario.cantidad_entradas_privadas,
+                self.coleccion.cantidad_entradas, self.otra.cantidad_entradas)
+
+    def test_mantiene_contadores_incrementalmente(self):
+        publica, privada = self.crear(), self.crear('privada')
+        self.assertEqual(self.contadores(), (1, 1, 0, 0))
+
+        privada.tipo_entrada = 'publica'
+        privada.save()
+        self.assertEqual(self.contadores(), (2, 0, 0, 0))
+
+        publica.colecciones.set([self.coleccion, self.otra])
+        publica.colecciones.set([self.coleccion])  # Solo se quita Libros, Viajes no se cuenta dos veces
+        self.coleccion.entradas.add(privada)
+        self.assertEqual(self.contadores(), (2, 0, 2, 0))
+
+        self.coleccion.entradas.clear()
+        publica.colecciones.add(self.otra)
+        privada.colecciones.add(self.otra)
+        publica.delete()
+        self.assertEqual(self.contadores(), (1, 0, 0, 1))
+
+    def test_borrado_en_lote_descuenta_agrupado(self):
+        def borrar(cantidad):
+            entradas = [self.crear(tipo='publica' if numero % 2 else 'privada') for numero in range(cantidad)]
+            for entrada in entradas:
+                entrada.colecciones.add(self.coleccion)
+            borrar = Entrada.objects.filter(id__in=[entrada.id for entrada in entradas])
+            with CaptureQueriesContext(connection) as contexto, contadores_en_lote(borrar):
+                borrar.delete()
+            return len(contexto)
+
+        self.assertEqual(borrar(2), borrar(10))
+        self.assertEqual(self.contadores(), (0, 0, 0, 0))
+
+    def test_reconciliar_corrige_desfasajes(self):
+        entrada = self.crear()
+        entrada.colecciones.add(self.coleccion)
+        Usuario.objects.filter(id=self.usuario.id).update(cantidad_entradas_publicas=7, cantidad_entradas_privadas=3)
+        Coleccion.objects.filter(id=self.otra.id).update(cantidad_entradas=5)
+
+        salida = StringIO()
+        call_command('reconciliar_contadores', lote=1, stdout=salida)
+        self.assertEqual(self.contadores(), (1, 0, 1, 0))
+        self.assertIn('Se corrigieron 1 usuarios y 1 colecciones', salida.getvalue())
+
+    def test_reconciliar_borra_vinculos_huerfanos(self):
+        # Como un DELETE hecho a mano con la tabla particionada, que ya no tiene la clave foranea
+        entrada = self.crear()
+        entrada.colecciones.add(self.coleccion, self.otra)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Entrada._meta.db_table} WHERE id = %s', [entrada.id])
+        salida = StringIO()
+        call_command('reconciliar_contadores', stdout=salida)
+        self.assertFalse(EntradaColeccion.objects.exists())
+        self.assertIn('Se borraron 2 vinculos', salida.getvalue())
+        self.assertEqual(self.contadores(), (0, 0, 0, 0))
+
+class OrganizarEntradasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        self.viajes = Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='detalle', usuario=self.usuario)
+        self.libros = Coleccion.objects.create(nombre_coleccion='Libros', detalle_coleccion='detalle', usuario=self.usuario)
+        ahora = timezone.now()
+        self.entradas = Entrada.objects.bulk_create([
+            Entrada(detalle_entrada=f'Entrada {i}', fecha_entrada=ahora - timedelta(minutes=i),
+                    tipo_entrada='privada', usuario=self.usuario)
+            for i in range(50)
+        ])
+
+    def organizar(self, accion, entradas, colecciones):
+        with CaptureQueriesContext(connection) as contexto:
+            respuesta = self.client.post(reverse('bitacora:organizar_entradas'), {
+                'accion': accion,
+                'entradas': [entrada.id for entrada in entradas],
+                'colecciones': [coleccion.id for coleccion in colecciones],
+            })
+        self.assertRedirects(respuesta, reverse('bitacora:mis_entradas'), fetch_redirect_response=False)
+        return len(contexto.captured_queries)
+
+    def test_agrega_y_quita_en_lote(self):
+        self.entradas[0].colecciones.add(self.viajes)
+        consultas = self.organizar('agregar', self.entradas, [self.viajes, self.libros])
+        self.assertEqual(self.viajes.entradas.count(), 50)
+        self.assertEqual(self.libros.entradas.count(), 50)
+        # La cantidad de consultas no depende de cuantas entradas se organizan
+        self.assertLessEqual(consultas, 11)
+
+        self.organizar('quitar', self.entradas[:20], [self.viajes])
+        self.viajes.refresh_from_db()
+        self.assertEqual(self.viajes.cantidad_entradas, 30)
+        self.assertEqual(self.libros.entradas.count(), 50)
+
+    def test_ignora_entradas_y_colecciones_ajenas(self):
+        otro = Usuario.objects.create_user(username='beto', email='beto@mail.com', password='clave-segura-123')
+        ajena = Entrada.objects.create(detalle_entrada='Ajena', fecha_entrada=timezone.now(), tipo_entrada='privada', usuario=otro)
+        self.organizar('agregar', [ajena, self.entradas[0]], [self.viajes])
+        self.assertEqual(list(self.viajes.entradas.all()), [self.entradas[0]])
+        self.assertFalse(ajena.colecciones.exists())
+
+class DetalleColeccionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        self.coleccion = Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='detalle', usuario=self.usuario)
+        ahora = timezone.now()
+        for i in range(25):
+            entrada = Entrada.objects.create(detalle_entrada=f'Viaje numero {i}', fecha_entrada=ahora - timedelta(hours=i),
+                                             tipo_entrada='privada', usuario=self.usuario)
+            entrada.colecciones.add(self.coleccion)
+
+    def test_pagina_por_cursor_y_devuelve_fragmentos(self):
+        url = reverse('bitacora:detalle_coleccion', args=[self.coleccion.id])
+        respuesta = self.client.get(url)
+        self.assertContains(respuesta, 'Viaje numero 19')
+        self.assertNotContains(respuesta, 'Viaje numero 20')
+        siguiente = respuesta.context['siguiente_cursor']
+        self.assertIsNotNone(siguiente)
+
+        # El pedido que hace el navegador al hacer scroll: solo las tarjetas, sin el resto de la pagina
+        respuesta = self.client.get(url, {'cursor': siguiente, 'parcial': '1'})
+        self.assertContains(respuesta, 'Viaje numero 24')
+        self.assertNotContains(respuesta, 'Viaje numero 19')
+        self.assertNotContains(respuesta, '<html')
+        self.assertIsNone(respuesta.context['siguiente_cursor'])
+
+    def test_coleccion_ajena(self):
+        otro = Usuario.objects.create_user(username='beto', email='beto@mail.com', password='clave-segura-123')
+        ajena = Coleccion.objects.create(nombre_coleccion='Ajena', detalle_coleccion='detalle', usuario=otro)
+        self.assertEqual(self.client.get(reverse('bitacora:detalle_coleccion', args=[ajena.id])).status_code, 404)
+
+class FiltroFechasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        for dia, detalle in [(1, 'Primero de marzo'), (15, 'Mitad de marzo'), (31, 'Fin de marzo')]:
+            Entrada.objects.create(detalle_entrada=detalle, tipo_entrada='privada', usuario=self.usuario,
+                                   fecha_entrada=timezone.make_aware(timezone.datetime(2025, 3, dia, 23, 30)))
+
+    def test_rango_incluye_el_dia_hasta(self):
+        respuesta = self.client.get(reverse('bitacora:api_entradas'),
+                                    {'fecha_desde': '2025-03-15', 'fecha_hasta': '2025-03-31', 'fields': 'detalle_entrada'})
+        detalles = [entrada['detalle_entrada'] for entrada in respuesta.json()['resultados']]
+        self.assertEqual(detalles, ['Fin de marzo', 'Mitad de marzo'])
+
+    def test_periodos_de_particion(self):
+        inicio = inicio_periodo(timezone.make_aware(timezone.datetime(2025, 12, 20)), INTERVALO_MES)
+        self.assertEqual((inicio.year, inicio.month, inicio.day), (2025, 12, 1))
+        self.assertEqual(siguiente_periodo(inicio, INTERVALO_MES).month, 1)
+        self.assertEqual(nombre_particion(inicio, INTERVALO_MES), 'app_bitacora_entrada_p2025_12')
+        self.assertEqual(nombre_particion(inicio_periodo(inicio, INTERVALO_ANIO), INTERVALO_ANIO), 'app_bitacora_entrada_p2025')
+
+    def test_periodos_entre_anios_e_intervalo_por_nombre(self):
+        # Una fecha naive se toma como local, una aware se pasa a la hora local antes de cortar el periodo
+        self.assertEqual(inicio_periodo(timezone.datetime(2024, 2, 29, 23, 59), INTERVALO_ANIO),
+                         timezone.make_aware(timezone.datetime(2024, 1, 1)))
+        ultimo_minuto = timezone.make_aware(timezone.datetime(2024, 3, 31, 23, 59))
+        self.assertEqual(inicio_periodo(ultimo_minuto, INTERVALO_MES).month, 3)
+        inicio = inicio_periodo(ultimo_minuto, INTERVALO_ANIO)
+        self.assertEqual(siguiente_periodo(inicio, INTERVALO_ANIO), timezone.make_aware(timezone.datetime(2025, 1, 1)))
+        diciembre = timezone.make_aware(timezone.datetime(2024, 12, 1))
+        self.assertEqual(siguiente_periodo(diciembre, INTERVALO_MES), timezone.make_aware(timezone.datetime(2025, 1, 1)))
+        self.assertEqual(intervalo_de(nombre_particion(diciembre, INTERVALO_MES)), INTERVALO_MES)
+        self.assertEqual(intervalo_de(nombre_particion(diciembre, INTERVALO_ANIO)), INTERVALO_ANIO)
+
+# Las replicas se simulan con otro archivo SQLite: DB_REPLICAS=/tmp/replica.sqlite3 python manage.py test
+REPLICAS_SIMULADAS = [alias for alias, base in settings.DATABASES.items() if alias != 'default' and base['ENGINE'].endswith('sqlite3')]
+
+@override_settings(BITACORA_REPLICAS=REPLICAS_SIMULADAS)
+class ReplicasTests(TestCase):
+    databases = {'default', *REPLICAS_SIMULADAS}
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        self.crear('Recién guardada')
+        for alias in REPLICAS_SIMULADAS:
+            # La replica tiene al usuario pero todavia no recibio la ultima entrada
+            self.usuario.save(using=alias, force_insert=True)
+            self.crear('Replicada', using=alias)
+
+    def crear(self, detalle, using='default'):
+        Entrada(detalle_entrada=detalle, tipo_entrada='privada', fecha_entrada=timezone.now() - timedelta(hours=1),
+                usuario=self.usuario).save(using=using)
+
+    def test_sin_replicas_no_fija_a_la_principal(self):
+        with override_settings(BITACORA_REPLICAS=[]):
+            respuesta = self.client.post(reverse('bitacora:agregar_coleccion'),
+                                         {'nombre_coleccion': 'Viajes', 'detalle_coleccion': 'Mis viajes'})
+            self.assertNotIn(COOKIE_PRIMARIA, respuesta.cookies)
+            self.assertContains(self.client.get(reverse('bitacora:mis_entradas')), 'Recién guardada')
+
+    @skipUnless(REPLICAS_SIMULADAS, "Requiere DB_REPLICAS con una base SQLite aparte")
+    def test_lee_de_la_replica_hasta_que_el_usuario_escribe(self):
+        respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertContains(respuesta, 'Replicada')
+        self.assertNotContains(respuesta, 'Recién guardada')
+
+        respuesta = self.client.post(reverse('bitacora:agregar_coleccion'),
+                                     {'nombre_coleccion': 'Viajes', 'detalle_coleccion': 'Mis viajes'})
+        self.assertIn(COOKIE_PRIMARIA, respuesta.cookies)
+        # Con la cookie el usuario lee lo que acaba de escribir
+        self.assertContains(self.client.get(reverse('bitacora:mis_entradas')), 'Recién guardada')
+
+    @skipUnless(REPLICAS_SIMULADAS, "Requiere DB_REPLICAS con una base SQLite aparte")
+    def test_replica_atrasada_se_saltea(self):
+        with patch('app_bitacora.replicas.retraso_replica', return_value=60):
+            self.assertContains(self.client.get(reverse('bitacora:mis_entradas')), 'Recién guardada')
+
+@override_settings(BITACORA_METRICAS_MUESTREO=1, BITACORA_METRICAS_TOKEN='secreto', BITACORA_SERVER_TIMING=True)
+class MetricasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reiniciar_metricas()
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.client.force_login(self.usuario)
+        Entrada.objects.create(detalle_entrada='Medida', fecha_entrada=timezone.now(), tipo_entrada='privada', usuario=self.usuario)
+
+    def metricas(self):
+        respuesta = self.client.get(reverse('bitacora:metricas'), headers={'Authorization': 'Bearer secreto'})
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.content.decode()
+
+    def test_mide_consultas_plantillas_y_latencia_por_vista(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        cantidad = len(consultas)  # El proximo request vacia connection.queries
+        self.assertRegex(respuesta['Server-Timing'],
+                         rf'^sql;dur=[\d.]+;desc="{cantidad} consultas", plantillas;dur=[\d.]+, total;dur=[\d.]+$')
+
+        texto = self.metricas()
+        self.assertIn('bitacora_request_segundos_count{vista="bitacora:mis_entradas"} 1', texto)
+        self.assertIn(f'bitacora_request_consultas_sum{{vista="bitacora:mis_entradas"}} {float(cantidad)}', texto)
+        self.assertIn('bitacora_request_etapa_segundos_count{vista="bitacora:mis_entradas",etapa="plantillas"} 1', texto)
+        self.assertIn('bitacora_request_segundos_bucket{vista="bitacora:mis_entradas",le="+Inf"} 1', texto)
+
+    def test_server_timing_desactivado(self):
+        with override_settings(BITACORA_SERVER_TIMING=False):
+            respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertNotIn('Server-Timing', respuesta)
+        self.assertIn('bitacora:mis_entradas', self.metricas())
+
+    def test_requests_fuera_de_la_muestra_no_se_miden(self):
+        with override_settings(BITACORA_METRICAS_MUESTREO=0):
+            respuesta = self.client.get(reverse('bitacora:mis_entradas'))
+        self.assertNotIn('Server-Timing', respuesta)
+        self.assertNotIn('bitacora:mis_entradas', self.metricas())
+
+    def test_endpoint_requiere_token_o_staff(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('bitacora:metricas')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('bitacora:metricas'), headers={'Authorization': 'Bearer otro'}).status_code, 403)
+        self.metricas()
+
+class DetectorConsultasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.autores = [Usuario.objects.create_user(username=f'autor{i}', email=f'autor{i}@mail.com') for i in range(8)]
+        for autor in self.autores:
+            Entrada.objects.create(detalle_entrada='N+1', fecha_entrada=timezone.now(), tipo_entrada='publica', usuario=autor)
+
+    def vista_con_n_mas_uno(self, request):
+        # Como un template que hace entrada.usuario.username sin select_related
+        nombres = [entrada.usuario.username for entrada in Entrada.objects.all()]
+        return HttpResponse(', '.join(nombres))
+
+    def test_huella_sin_literales(self):
+        self.assertEqual(huella_consulta("SELECT * FROM t WHERE id IN (1, 2, 3) AND nombre = 'ana'  LIMIT 21"),
+                         huella_consulta('SELECT * FROM t WHERE id IN (%s, %s) AND nombre = %s LIMIT %s'))
+        self.assertIn('app_bitacora_entrada_p2025_12', huella_consulta('SELECT 1 FROM app_bitacora_entrada_p2025_12'))
+
+    def test_n_mas_uno_falla_en_modo_estricto(self):
+        detector = DetectorConsultasMiddleware(self.vista_con_n_mas_uno)
+        with override_settings(BITACORA_CONSULTAS_ESTRICTO=True):
+            with self.assertRaisesMessage(ConsultasProblematicas, 'se repite 8 veces'):
+                detector(RequestFactory().get('/'))
+
+    @override_settings(BITACORA_CONSULTAS_ESTRICTO=True, BITACORA_CONSULTA_LENTA_MS=0)
+    def test_consultas_lentas_no_fallan_en_modo_estricto(self):
+        detector = DetectorConsultasMiddleware(lambda request: HttpResponse(Entrada.objects.count()))
+        with self.assertLogs('app_bitacora.consultas', 'WARNING') as registro:
+            detector(RequestFactory().get('/'))
+        self.assertIn('[lenta]', registro.output[0])
+
+    @override_settings(BITACORA_CONSULTAS_ESTRICTO=False, BITACORA_CONSULTAS_MUESTREO=1)
+    def test_en_produccion_loguea_y_acumula_el_reporte(self):
+        detector = DetectorConsultasMiddleware(self.vista_con_n_mas_uno)
+        with self.assertLogs('app_bitacora.consultas', 'WARNING'):
+            detector(RequestFactory().get('/'))
+            detector(RequestFactory().get('/'))
+        [((tipo, vista, huella), datos)] = reporte_consultas().items()
+        self.assertEqual((tipo, datos['veces'], datos['peor']), ('repetida', 2, 8))
+        self.assertIn('FROM "app_bitacora_usuario"', huella)
+
+        salida = StringIO()
+        call_command('perf_report', stdout=salida)
+        self.assertIn('en 2 requests, peor 8 veces', salida.getvalue())
+
+    def test_urls_auditadas_responden(self):
+        # Las recorren auditar_consultas (solo PostgreSQL) y perf_report: tienen que resolver y responder 200
+        usuario = self.autores[0]
+        coleccion = Coleccion.objects.create(nombre_coleccion='Viajes', detalle_coleccion='detalle', usuario=usuario)
+        self.client.force_login(usuario)
+        for vista, url in urls_a_auditar(coleccion).items():
+            with self.subTest(vista=vista):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        if connection.vendor != 'postgresql':
+            with self.assertRaisesMessage(CommandError, 'solo funciona con PostgreSQL'):
+                call_command('auditar_consultas')
+
+class DatosSinteticosTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_dataset_con_sesgo_colecciones_e_imagenes(self):
+        self.assertEqual(repartir_con_sesgo(100, 4), [52, 23, 15, 10])
+        usuarios = generar_dataset(4, 200, colecciones_por_usuario=2, entradas_por_coleccion=5, proporcion_imagenes=0.5,
+                                   imagenes_distintas=2, prefijo='seed', semilla=1)
+        cantidades = [Entrada.objects.filter(usuario=usuario).count() for usuario in usuarios]
+        self.assertEqual(sum(cantidades), 200)
+        self.assertEqual(cantidades, sorted(cantidades, reverse=True))
+        # Los contadores quedan al dia aunque todo se inserto con bulk_create
+        for usuario, cantidad in zip(usuarios, cantidades):
+            usuario.refresh_from_db()
+            self.assertEqual(usuario.cantidad_entradas, cantidad)
+        for coleccion in Coleccion.objects.filter(usuario__in=usuarios):
+            self.assertEqual(coleccion.entradas.count(), coleccion.cantidad_entradas)
+        con_imagen = Entrada.objects.exclude(imagen='')
+        self.assertTrue(con_imagen.exists())
+        self.assertTrue(all(entrada.imagen_versiones for entrada in con_imagen))
+
+    def test_bench_detecta_regresiones(self):
+        baseline = {'mis_entradas': {'p50_ms': 10, 'consultas': 4, 'memoria_kb': 500}}
+        sin_cambios = {'mis_entradas': {'p50_ms': 12, 'consultas': 4, 'memoria_kb': 560}}
+        self.assertEqual(BenchVistas().comparar(baseline, sin_cambios), [])
+        peor = {'mis_entradas': {'p50_ms': 20, 'consultas': 5, 'memoria_kb': 1000}}
+        self.assertEqual(len(BenchVistas().comparar(baseline, peor)), 3)
+
+@override_settings(BITACORA_LOGIN_INTENTOS_USUARIO=2, BITACORA_LOGIN_INTENTOS_IP=10,
+                   BITACORA_LOGIN_ESPERA_INICIAL=30, BITACORA_LOGIN_ESPERA_MAXIMA=100)
+class LimiteLoginTests(TestCase):
+
+    def setUp(self):
+        cache_login().clear()
+        self.addCleanup(cache_login().clear)
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+
+    def intentar(self, password, nombre='ana', ip='203.0.113.1'):
+        return self.client.post(reverse('bitacora:iniciar_sesion'), {'nombre': nombre, 'password': password}, REMOTE_ADDR=ip)
+
+    def test_bloquea_sin_llegar_al_hasher(self):
+        for _ in range(3):
+            self.assertEqual(self.intentar('incorrecta').status_code, 200)
+        with patch('app_bitacora.views.authenticate') as authenticate:
+            respuesta = self.intentar('clave-segura-123')
+        authenticate.assert_not_called()
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertEqual(respuesta['Retry-After'], '30')
+        # Un atacante no bloquea la cuenta para las demas IPs, y otro usuario desde la misma IP sigue pudiendo intentar
+        self.assertEqual(self.intentar('clave-segura-123', ip='198.51.100.7').status_code, 302)
+        self.assertEqual(self.intentar('incorrecta', nombre='beto').status_code, 200)
+
+    def test_espera_exponencial_con_tope(self):
+        # Las reservas seguidas son como una rafaga simultanea: pasados los libres solo pasa un intento por espera
+        ip = '203.0.113.9'
+        esperas = [math.ceil(reservar_intento(ip, 'beto')) for _ in range(4)]
+        for _ in range(2):
+            cache_login().delete(f"{clave_usuario(ip, 'beto')}:bloqueo")  # Como si venciera la espera
+            esperas += [math.ceil(reservar_intento(ip, 'beto')) for _ in range(2)]
+        self.assertEqual(esperas, [0, 0, 0, 30, 0, 60, 0, 100])
+
+    def test_login_correcto_perdona_los_fallos_del_usuario(self):
+        self.intentar('incorrecta')
+        self.intentar('incorrecta')
+        self.assertEqual(self.intentar('clave-segura-123').status_code, 302)
+        self.client.logout()
+        self.intentar('incorrecta')
+        self.assertEqual(self.intentar('incorrecta').status_code, 200)
+
+    def test_ip_sin_intentos_libres_no_deja_afuera_a_los_demas(self):
+        # Detras de una NAT: alguien agota los fallos de la IP probando otras cuentas
+        for numero in range(11):
+            self.intentar('incorrecta', nombre=f'otro{numero}')
+        self.assertEqual(self.intentar('incorrecta', nombre='otro99').status_code, 429)
+        for _ in range(3):
+            self.assertEqual(self.intentar('clave-segura-123').status_code, 302)
+            self.client.logout()
+
+    @override_settings(BITACORA_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_ip_del_cliente_detras_de_un_proxy(self):
+        proxy = {'REMOTE_ADDR': '10.0.0.1'}
+        for _ in range(3):
+            self.client.post(reverse('bitacora:iniciar_sesion'), {'nombre': 'ana', 'password': 'incorrecta'},
+                             HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.5', **proxy)
+        # El cliente no puede elegir su IP agregando otra al principio del header
+        bloqueado = self.client.post(reverse('bitacora:iniciar_sesion'), {'nombre': 'ana', 'password': 'clave-segura-123'},
+                                     HTTP_X_FORWARDED_FOR='9.9.9.9, 203.0.113.5', **proxy)
+        self.assertEqual(bloqueado.status_code, 429)
+        otro = self.client.post(reverse('bitacora:iniciar_sesion'), {'nombre': 'ana', 'password': 'clave-segura-123'},
+                                HTTP_X_FORWARDED_FOR='198.51.100.8', **proxy)
+        self.assertEqual(otro.status_code, 302)
+
+    def test_rehash_al_iniciar_sesion(self):
+        self.assertTrue(self.usuario.password.startswith('pbkdf2_sha256$'))
+        with override_settings(PASSWORD_HASHERS=['app_bitacora.hashers.ScryptConfigurable', 'app_bitacora.hashers.PBKDF2Configurable']):
+            self.assertEqual(self.intentar('clave-segura-123').status_code, 302)
+        self.usuario.refresh_from_db()
+        self.assertTrue(self.usuario.password.startswith('scrypt$'))
+
+class SesionesTests(TestCase):
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(username='ana', email='ana@mail.com', password='clave-segura-123')
+        self.entrada = Entrada.objects.create(detalle_entrada='Publica', fecha_entrada=timezone.now(),
+                                              tipo_entrada='publica', usuario=self.usuario)
+
+    def consultas_sesion(self, contexto):
+        return [consulta['sql'] for consulta in contexto.captured_queries if 'django_session' in consulta['sql']]
+
+    def test_anonimo_no_usa_la_sesion(self):
+        url = reverse('bitacora:pagina_principal')
+        with CaptureQueriesContext(connection) as contexto:
+            respuesta = self.client.get(url)
+            # La segunda visita manda el ETag y recibe un 304
+            no_modificada = self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual((respuesta.status_code, no_modificada.status_code), (200, 304))
+        self.assertEqual(self.consultas_sesion(contexto), [])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, respuesta.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, no_modificada.cookies)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_sesion_en_cache_y_mensajes_en_cookie(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+        with CaptureQueriesContext(connection) as contexto:
+            self.client.get(reverse('bitacora:mis_entradas'))
+            respuesta = self.client.post(reverse('bitacora:eliminar_entrada', args=[self.entrada.id]))
+        self.assertEqual(self.consultas_sesion(contexto), [])
+        self.assertIn('messages', respuesta.cookies)
+        self.assertContains(self.client.get(reverse('bitacora:mis_entradas')), "Entrada eliminada correctamente.")
 
-# Create your tests here.
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, close_old_connections
+from django.template.loader import render_to_string
+
+from .models import Entrada
+
+logger = logging.getLogger(__name__)
+
+# Feed en vivo: las entradas que se publican se envian por SSE a los navegadores que tienen abierta la pagina
+# principal. Cada proceso tiene un HubFeed con las conexiones abiertas; con BITACORA_FEED_NOTIFY (solo PostgreSQL)
+# el aviso pasa por LISTEN/NOTIFY y llega a los hubs de todos los procesos, no solo al que guardo la entrada
+
+CANAL_NOTIFY = 'bitacora_feed'
+TAMANIO_COLA = 100
+TIEMPO_LATIDO = 15  # Un comentario cada tanto evita que los proxies corten la conexion por inactividad
+MAXIMO_REENVIO = 50  # Si al reconectar faltan mas entradas que estas, el cliente recarga la pagina
+
+RECARGAR = object()
+
+class HubFeed:
+    '''
+        Reparte los eventos a las conexiones SSE abiertas en este proceso. Cada conexion tiene su propia cola
+        en el event loop que la atiende; publicar() se puede llamar desde cualquier hilo.
+    '''
+
+    def __init__(self):
+        self.suscriptores = set()
+        self.lock = threading.Lock()
+
+    def suscribir(self):
+        suscriptor = (asyncio.get_running_loop(), asyncio.Queue(maxsize=TAMANIO_COLA))
+        with self.lock:
+            self.suscriptores.add(suscriptor)
+        return suscriptor
+
+    def desuscribir(self, suscriptor):
+        with self.lock:
+            self.suscriptores.discard(suscriptor)
+
+    def publicar(self, evento):
+        with self.lock:
+            suscriptores = list(self.suscriptores)
+        for loop, cola in suscriptores:
+            try:
+                loop.call_soon_threadsafe(self.entregar, cola, evento)
+            except RuntimeError:  # El event loop ya se cerro
+                self.desuscribir((loop, cola))
+
+    @staticmethod
+    def entregar(cola, evento):
+        try:
+            cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Un cliente que no lee a tiempo no frena a los demas: se le pide que recargue la pagina
+            while not cola.empty():
+                cola.get_nowait()
+            cola.put_nowait(RECARGAR)
+
+hub = HubFeed()
+
+def entradas_para_feed():
+    # Mismos campos que el feed de la pagina principal (ver views.renderizar_feed_publico)
+    return (Entrada.objects.filter(tipo_entrada='publica')
+            .select_related('usuario')
+            .only('detalle_entrada', 'fecha_entrada', 'tipo_entrada', 'imagen', 'imagen_versiones', 'usuario__username'))
+
+def armar_evento(entrada):
+    return {'id': entrada.id, 'html': render_to_string('app_bitacora/entrada_feed.html', {'entrada': entrada})}
+
+def evento_entrada(entrada_id):
+    # Se consulta y se renderiza una sola vez por proceso, no una vez por cada conexion abierta
+    entrada = entradas_para_feed().filter(id=entrada_id).first()
+    return armar_evento(entrada) if entrada else None
+
+def usa_notify():
+    return settings.BITACORA_FEED_NOTIFY and connection.vendor == 'postgresql'
+
+def publicar_entrada(entrada_id):
+    # Se llama despues del commit de una entrada que paso a ser publica (ver signals.py)
+    if usa_notify():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CANAL_NOTIFY, str(entrada_id)])
+        return
+    evento = evento_entrada(entrada_id)
+    if evento:
+        hub.publicar(evento)
+
+def escuchar_notificaciones():
+    import psycopg
+
+    parametros = connection.get_connection_params()
+    while True:
+        try:
+            with psycopg.connect(**parametros, autocommit=True) as conexion:
+                conexion.execute(f'LISTEN {CANAL_NOTIFY}')
+                for aviso in conexion.notifies():
+                    close_old_connections()
+                    evento = evento_entrada(int(aviso.payload))
+                    if evento:
+                        hub.publicar(evento)
+        except Exception:
+            logger.exception("Se corto la escucha de %s, se reintenta en 5 segundos", CANAL_NOTIFY)
+            time.sleep(5)
+
+_escucha = None
+_lock_escucha = threading.Lock()
+
+def iniciar_escucha():
+    # El hilo que escucha NOTIFY se crea con la primera conexion SSE del proceso
+    global _escucha
+    if not usa_notify() or _escucha is not None:
+        return
+    with _lock_escucha:
+        if _escucha is None:
+            _escucha = threading.Thread(target=escuchar_notificaciones, name='bitacora-feed-notify', daemon=True)
+            _escucha.start()
+
+def formatear_evento(evento, con_id=True):
+    lineas = [f"id: {evento['id']}"] if con_id else []
+    lineas += ['event: entrada', 'data: ' + json.dumps(evento, separators=(',', ':'))]
+    return '\n'.join(lineas) + '\n\n'
+
+async def eventos_feed(ultimo_id=None):
+    '''
+        Generador de la respuesta SSE. Si el cliente indica la ultima entrada que vio (Last-Event-ID al
+        reconectar, o ?ultimo= la primera vez) primero se envian las entradas publicas que se perdio, y
+        despues las que se van publicando.
+    '''
+    iniciar_escucha()
+    suscriptor = hub.suscribir()  # Antes de consultar lo pendiente, para no perder nada en el medio
+    _, cola = suscriptor
+    try:
+        yield 'retry: 5000\n\n'
+        enviados = set()
+        if ultimo_id is not None:
+            pendientes = [entrada async for entrada in entradas_para_feed().filter(id__gt=ultimo_id).order_by('id')[:MAXIMO_REENVIO + 1]]
+            if len(pendientes) > MAXIMO_REENVIO:
+                yield 'event: recargar\ndata: {}\n\n'
+                return
+            for entrada in pendientes:
+                enviados.add(entrada.id)
+                ultimo_id = entrada.id
+                yield formatear_evento(armar_evento(entrada))
+
+        while True:
+            try:
+                evento = await asyncio.wait_for(cola.get(), TIEMPO_LATIDO)
+            except asyncio.TimeoutError:
+                yield ': latido\n\n'
+                continue
+            if evento is RECARGAR:
+                yield 'event: recargar\ndata: {}\n\n'
+                return
+            if evento['id'] in enviados:
+                continue
+            # Una entrada vieja que se hizo publica se envia, pero sin mover el Last-Event-ID para atras
+            nuevo = ultimo_id is None or evento['id'] > ultimo_id
+            if nuevo:
+                ultimo_id = evento['id']
+            yield formatear_evento(evento, con_id=nuevo)
+    finally:
+        hub.desuscribir(suscriptor)
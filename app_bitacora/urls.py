@@ -1,7 +1,7 @@
 from django.urls import path
 from django.contrib.auth.views import LogoutView
 
-from . import views
+from . import views, api
 
 app_name = 'bitacora'
 urlpatterns = [
@@ -13,6 +13,8 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(next_page='/bitacora/iniciar_sesion'), name='logout'), #django proporciona una vista predefinida para el cierre de sesion
     # ex: /bitacora/pagina_principal/
     path('pagina_principal', views.pagina_principal, name='pagina_principal'),
+    # ex: /bitacora/feed_en_vivo?ultimo=120 (server-sent events)
+    path('feed_en_vivo', views.feed_en_vivo, name='feed_en_vivo'),
     # ex: /bitacora/mis__entradas
     path('mis_entradas/', views.mis_entradas, name='mis_entradas'),
     # ex: /bitacora/agregar_entrada/
@@ -23,6 +25,8 @@ urlpatterns = [
     path('eliminar_entrada/<int:entrada_id>/', views.eliminar_entrada, name='eliminar_entrada'),
     # ex: /bitacora/mis_colecciones
     path('mis_colecciones', views.mis_colecciones, name='mis_colecciones'),
+    # ex: /bitacora/coleccion/1?cursor=...
+    path('coleccion/<int:coleccion_id>/', views.detalle_coleccion, name='detalle_coleccion'),
     # ex: /bitacora/agregar_coleccion
     path('agregar_coleccion', views.agregar_coleccion, name='agregar_coleccion'),
     # ex: /bitacora/editar_coleccion/1
@@ -31,5 +35,21 @@ urlpatterns = [
     path('eliminar_coleccion/<int:coleccion_id>/', views.eliminar_coleccion, name='eliminar_coleccion'),
     # ex: /bitacora/agregar_entrada_a_coleccion/1
     path('agregar_entrada_a_coleccion/<int:entrada_id>/', views.agregar_entrada_a_coleccion, name='agregar_entrada_a_coleccion'),
+    # ex: /bitacora/organizar_entradas (POST con varias entradas y colecciones)
+    path('organizar_entradas', views.organizar_entradas, name='organizar_entradas'),
+    # ex: /bitacora/importar_entradas
+    path('importar_entradas', views.importar_entradas, name='importar_entradas'),
+    # ex: /bitacora/exportar_entradas?formato=csv
+    path('exportar_entradas', views.exportar_entradas, name='exportar_entradas'),
+    # ex: /bitacora/api/entradas?fields=id,fecha_entrada&cursor=...
+    path('api/entradas', api.api_entradas, name='api_entradas'),
+    # ex: /bitacora/api/feed?tamanio=50
+    path('api/feed', api.api_feed, name='api_feed'),
+    # ex: /bitacora/estadisticas_cache (solo staff)
+    path('estadisticas_cache', views.estadisticas_cache_fragmentos, name='estadisticas_cache'),
+    # ex: /bitacora/estadisticas_subidas (solo staff)
+    path('estadisticas_subidas', views.estadisticas_subidas_imagenes, name='estadisticas_subidas'),
+    # ex: /bitacora/metricas (formato de Prometheus, con token o solo staff)
+    path('metricas', views.metricas_prometheus, name='metricas'),
 ]
 
@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django import forms
 from django.utils import timezone
+from PIL import Image
 
 from .models import Usuario
 
@@ -40,3 +42,39 @@ def validar_campo_no_repetido(campo, lista_campo=None):
         raise ValueError("La lista de campos proporcionada no es válida.")
     if campo in lista_campo:
         raise forms.ValidationError("Ya estás usando este nombre para otro registro, intenta con otro.")
+
+# Primeros bytes de cada formato de imagen que se acepta
+FIRMAS_IMAGEN = {
+    'JPEG': (b'\xff\xd8\xff',),
+    'PNG': (b'\x89PNG\r\n\x1a\n',),
+    'GIF': (b'GIF87a', b'GIF89a'),
+    'WEBP': (b'RIFF',),  # Ademas tiene que decir WEBP en los bytes 8 a 12
+}
+
+def validar_cabecera_imagen(archivo):
+    '''
+        Revisa la firma y las dimensiones de una imagen leyendo solo su cabecera, antes de que Pillow
+        la decodifique entera. Asi una "bomba de descompresion" (un archivo chico que declara millones
+        de pixeles) se rechaza sin llegar a ocupar memoria.
+    '''
+    archivo.seek(0)
+    cabecera = archivo.read(12)
+    archivo.seek(0)
+    formato = next((formato for formato, firmas in FIRMAS_IMAGEN.items() if cabecera.startswith(firmas)), None)
+    if formato is None or (formato == 'WEBP' and cabecera[8:12] != b'WEBP'):
+        raise forms.ValidationError("El archivo no es una imagen JPEG, PNG, GIF o WebP.")
+
+    try:
+        # Image.open solo lee la cabecera, los pixeles no se decodifican hasta llamar a load()
+        with Image.open(archivo) as imagen:
+            ancho, alto = imagen.size
+    except Image.DecompressionBombError:
+        ancho, alto = float('inf'), float('inf')
+    except Exception:
+        raise forms.ValidationError("No se pudo leer la imagen, puede estar dañada.")
+    finally:
+        archivo.seek(0)
+
+    lado_maximo = settings.BITACORA_IMAGEN_LADO_MAXIMO
+    if ancho > lado_maximo or alto > lado_maximo or ancho * alto > settings.BITACORA_IMAGEN_PIXELES_MAXIMOS:
+        raise forms.ValidationError(f"La imagen es demasiado grande, no puede medir más de {lado_maximo} px por lado.")
@@ -1,14 +1,33 @@
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, render, redirect
+import hmac
+import math
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, aget_object_or_404, render, redirect
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, get_user_model
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django import forms
-from django.db.models import Q
+from django.db.models import Max
 
 from .models import Usuario, Entrada, Coleccion
-from .forms import LoginForm, RegistrarUsuarioForm, EntradaForm, ColeccionForm, FiltrosEntradaForm, AgregarEntradaEnColeccionForm
+from .forms import LoginForm, RegistrarUsuarioForm, EntradaForm, ColeccionForm, FiltrosEntradaForm, FiltrosColeccionForm, AgregarEntradaEnColeccionForm, ImportarEntradasForm, OrganizarEntradasForm, ACCION_AGREGAR
 from .validaciones import validar_email, validar_username, validar_password, validar_fecha_no_futura, validar_campo_no_repetido
+from .paginacion import apaginar_por_cursor
+from .busqueda import buscar_colecciones, MODO_APROXIMADO
+from .cache import arenderizar_tarjetas, estadisticas_cache, apagina_feed
+from .subidas import estadisticas_subidas
+from . import importacion
+from .tiempo_real import eventos_feed
+from .vinculos import actualizar_vinculos
+from .replicas import lectura_en_replica, en_primaria
+from .metricas import exportar_prometheus
+from .acceso import ip_cliente, reservar_intento, liberar_intento, registrar_fallo_ip
 
 # Obtengo el modelo de usuario personalizado
 Usuario = get_user_model()
@@ -16,6 +35,12 @@ Usuario = get_user_model()
 def index(request):
     return HttpResponse("la app 'bitacora' se creo correctamente")
 
+def demasiados_intentos(request, form, espera):
+    messages.error(request, f"Demasiados intentos fallidos. Intente nuevamente en {math.ceil(espera)} segundos.")
+    respuesta = render(request, 'app_bitacora/login.html', {'form': form}, status=429)
+    respuesta['Retry-After'] = str(math.ceil(espera))
+    return respuesta
+
 def iniciar_sesion(request):
     if request.method == 'POST':
         form = LoginForm(request.POST)
@@ -24,15 +49,28 @@ def iniciar_sesion(request):
             nombre = form.cleaned_data['nombre']
             password = form.cleaned_data['password']
 
+            # Con demasiados intentos fallidos para este usuario desde esta IP ni se llama a authenticate,
+            # hashear la contraseña es lo que mas CPU consume en un ataque. El intento se reserva antes de
+            # autenticar, asi una rafaga de intentos simultaneos no pasa toda junta (ver acceso.py)
+            ip = ip_cliente(request)
+            espera = reservar_intento(ip, nombre)
+            if espera:
+                return demasiados_intentos(request, form, espera)
+
             # Usar authenticate para validar credenciales
             usuario = authenticate(request, username=nombre, password=password)
 
             if usuario is not None:  # Usuario autenticado correctamente
+                liberar_intento(ip, nombre)
                 login(request, usuario)  # Inicia la sesión
                 messages.success(request, f"Bienvenido {usuario.username}!")
                 return redirect('/bitacora/pagina_principal')
-            else:
-                messages.error(request, "Las credenciales no son válidas. Intente nuevamente.")
+            # El limite de la IP solo se aplica a los intentos que fallan: la comparten todos los usuarios
+            # que estan detras del mismo proxy
+            espera = registrar_fallo_ip(ip)
+            if espera:
+                return demasiados_intentos(request, form, espera)
+            messages.error(request, "Las credenciales no son válidas. Intente nuevamente.")
         else:
             messages.error(request, "Formulario inválido. Por favor, verifica los datos.")
     else:  # Si es GET, renderiza el formulario vacío
@@ -96,40 +134,90 @@ def registrar_usuario(request):
 
     return render(request, 'app_bitacora/registrar_usuario.html', {'form': form})
 
-def pagina_principal(request):
-    entradas = Entrada.objects.filter(tipo_entrada = 'publica').order_by('-fecha_entrada')
-    context = { "entradas": entradas }
-    return render(request, 'app_bitacora/homepage.html', context)
+async def usuario_async(request):
+    '''
+        Usuario del request para las vistas async. Ademas lo dejo en request.user, porque el template
+        (context processor de auth) lo lee de ahi y desde una vista async no puede ir a la base a buscarlo.
+    '''
+    usuario = await request.auser()
+    request.user = usuario
+    return usuario
+
+async def renderizar_feed_publico(cursor):
+    # La pagina queda en el cache compartido, asi que se arma con la base principal y no con una replica atrasada
+    with en_primaria():
+        # Traigo el nombre del usuario en el mismo JOIN para no hacer una consulta por cada entrada del feed
+        entradas = (Entrada.objects.filter(tipo_entrada = 'publica')
+                    .select_related('usuario')
+                    .only('detalle_entrada', 'fecha_entrada', 'tipo_entrada', 'imagen', 'imagen_versiones', 'usuario__username'))
+        # Solo traigo una pagina del feed, la siguiente se pide con el cursor de la ultima entrada mostrada
+        entradas, siguiente_cursor = await apaginar_por_cursor(entradas, cursor)
+        context = { "entradas": entradas, "siguiente_cursor": siguiente_cursor, "primera_pagina": not cursor }
+        if not cursor:
+            # Ultima entrada creada al armar la pagina (sale del indice de la clave primaria): el feed en vivo
+            # envia solo las entradas publicas posteriores
+            context["ultimo_id"] = (await Entrada.objects.aaggregate(ultimo=Max('id')))['ultimo']
+    return render_to_string('app_bitacora/feed_publico.html', context)
+
+# Las vistas de lectura (pagina_principal, mis_entradas y mis_colecciones) son async: bajo ASGI un cliente lento
+# no ocupa un hilo del servidor mientras espera. Todo lo que va a la base se resuelve con el ORM async antes
+# de renderizar, el template solo recibe listas ya cargadas
+
+@lectura_en_replica
+async def pagina_principal(request):
+    cursor = request.GET.get('cursor')
+    # El listado es igual para todos los visitantes, asi que se comparte desde el cache (ver cache.apagina_feed)
+    pagina = await apagina_feed(cursor, lambda: renderizar_feed_publico(cursor))
+
+    # Los visitantes anonimos que vuelven reciben un 304 si el feed no cambio desde su ultima visita
+    anonimo = not (await usuario_async(request)).is_authenticated
+    if anonimo:
+        ultima_modificacion = int(pagina['modificado'].timestamp())
+        no_modificada = get_conditional_response(request, etag=pagina['etag'], last_modified=ultima_modificacion)
+        if no_modificada is not None:
+            return no_modificada
+
+    # El feed en vivo solo se ofrece bajo ASGI (ver feed_en_vivo)
+    en_vivo = isinstance(request, ASGIRequest)
+    respuesta = render(request, 'app_bitacora/homepage.html', {"feed": pagina['html'], "en_vivo": en_vivo})
+    if anonimo:
+        respuesta['ETag'] = pagina['etag']
+        respuesta['Last-Modified'] = http_date(ultima_modificacion)
+        respuesta['Cache-Control'] = 'no-cache'  # El navegador puede guardarla pero tiene que revalidarla
+    return respuesta
+
+async def feed_en_vivo(request):
+    # Server-sent events con las entradas publicas nuevas. Pensado para ASGI: la conexion queda abierta
+    # sin ocupar un hilo del servidor. Bajo WSGI el generador infinito retendria un hilo para siempre sin
+    # enviar nada: se responde 204, que ademas le indica al EventSource que no vuelva a conectarse
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    ultimo = request.headers.get('Last-Event-ID') or request.GET.get('ultimo') or ''
+    respuesta = StreamingHttpResponse(eventos_feed(int(ultimo) if ultimo.isdigit() else None),
+                                      content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    respuesta['X-Accel-Buffering'] = 'no'  # Que nginx no acumule los eventos antes de enviarlos
+    return respuesta
 
 @login_required
-def mis_entradas(request):
-    form = FiltrosEntradaForm(usuario=request.user, data=request.GET)
+@lectura_en_replica
+async def mis_entradas(request):
+    usuario = await usuario_async(request)
+    colecciones = [coleccion async for coleccion in Coleccion.objects.filter(usuario=usuario).values_list('id', 'nombre_coleccion')]
+    form = FiltrosEntradaForm(colecciones=colecciones, data=request.GET)
     # Filtrar solo las entradas del usuario autenticado
-    entradas = Entrada.objects.filter(usuario=request.user).order_by('-fecha_entrada')
-
-    # Lógica de los filtros
-    if form.is_valid():
-        # Filtrar por colección si el usuario seleccionó una
-        coleccion_id = form.cleaned_data.get("coleccion")
-        if coleccion_id:
-            entradas = entradas.filter(colecciones=coleccion_id)
-
-        # Filtrar por tipo de entrada
-        tipo_entrada = form.cleaned_data.get("tipo_entrada")
-        if tipo_entrada:
-            entradas = entradas.filter(tipo_entrada=tipo_entrada)
-
-        busqueda = form.cleaned_data.get("busqueda_x_detalle_entrada")
-        if busqueda:
-            palabras = busqueda.split()  # Divide la búsqueda en palabras
-            consulta = Q() # Creo una consulta con Q() para cada palabra en palabras
-            for palabra in palabras:
-                consulta &= Q(detalle_entrada__icontains=palabra)  # Filtra por cada palabra y con icontains pueden ser coincidencias parciales(asi evito tener que trabajar con coincidencias totales en la busqueda)
-                # Todas las palabras sueltas deben coincidir para que la entrada pase el filtro y se muestre
-                # Esto lo hago gracias a &= que funciona como un AND y asegura que todas las palabras de la búsqueda estén en detalle_entrada.
-            entradas = entradas.filter(consulta)
-
-    context = {"form": form, "entradas": entradas}
+    entradas = (Entrada.objects.filter(usuario=usuario)
+                .only('detalle_entrada', 'fecha_entrada', 'tipo_entrada', 'imagen', 'imagen_versiones', 'fecha_modificacion')
+                .order_by('-fecha_entrada'))
+
+    # Lógica de los filtros (coleccion, tipo de entrada y busqueda)
+    entradas = [entrada async for entrada in form.filtrar(entradas)]
+
+    # El contenido de cada tarjeta sale del cache de fragmentos (los botones con csrf se renderizan siempre)
+    tarjetas = await arenderizar_tarjetas(entradas, usuario.id)
+    form_organizar = OrganizarEntradasForm(colecciones=colecciones)
+    context = {"form": form, "entradas": entradas, "tarjetas": tarjetas, "modo_aproximado": MODO_APROXIMADO,
+               "form_organizar": form_organizar}
     return render(request, 'app_bitacora/mis_entradas.html', context)
 
 def agregar_entrada(request):
@@ -249,13 +337,15 @@ def eliminar_entrada(request, entrada_id):
 
 @login_required
 def agregar_entrada_a_coleccion(request, entrada_id):
-    entrada = get_object_or_404(Entrada, id=entrada_id)
+    entrada = get_object_or_404(Entrada, id=entrada_id, usuario=request.user)
 
     if request.method == "POST":
         form = AgregarEntradaEnColeccionForm(request.POST, usuario=request.user, entrada=entrada)
         if form.is_valid():
-            # Usamos set() para actualizar solo las colecciones elegidas
-            entrada.colecciones.set(form.cleaned_data["colecciones"])
+            # Se agregan las colecciones elegidas y se quitan las demas del usuario, solo lo que cambia
+            elegidas = {coleccion.id for coleccion in form.cleaned_data["colecciones"]}
+            todas = {coleccion.id for coleccion in form.fields["colecciones"].queryset}
+            actualizar_vinculos(request.user, [entrada.id], agregar=elegidas, quitar=todas - elegidas)
             return redirect("bitacora:mis_entradas")  # Volver a la página de entradas
     else:
         form = AgregarEntradaEnColeccionForm(usuario=request.user, entrada=entrada)
@@ -264,12 +354,61 @@ def agregar_entrada_a_coleccion(request, entrada_id):
 
 
 @login_required()
-def mis_colecciones(request):
-    # Filtrar solo las colecciones del usuario autenticado
-    colecciones = Coleccion.objects.filter(usuario=request.user).order_by('nombre_coleccion')
-    context = {"colecciones": colecciones}
+@lectura_en_replica
+async def mis_colecciones(request):
+    usuario = await usuario_async(request)
+    form = FiltrosColeccionForm(data=request.GET)
+    # Solo el resumen de cada coleccion (la cantidad de entradas es un contador), las entradas se ven en detalle_coleccion
+    colecciones = Coleccion.objects.filter(usuario=usuario).order_by('nombre_coleccion')
+
+    if form.is_valid() and form.cleaned_data.get("busqueda_x_nombre_coleccion"):
+        colecciones = buscar_colecciones(colecciones, form.cleaned_data["busqueda_x_nombre_coleccion"],
+                                         form.cleaned_data.get("modo_busqueda"))
+
+    # aiterator trae las colecciones de a lotes sin bloquear el event loop
+    colecciones = [coleccion async for coleccion in colecciones.aiterator(chunk_size=100)]
+    context = {"form": form, "colecciones": colecciones}
     return render(request, 'app_bitacora/mis_colecciones.html', context)
 
+@login_required
+@lectura_en_replica
+async def detalle_coleccion(request, coleccion_id):
+    usuario = await usuario_async(request)
+    coleccion = await aget_object_or_404(Coleccion, id=coleccion_id, usuario=usuario)
+    entradas = (Entrada.objects.filter(colecciones=coleccion)
+                .only('detalle_entrada', 'fecha_entrada', 'tipo_entrada', 'imagen', 'imagen_versiones', 'fecha_modificacion'))
+    # Una pagina por vez, por keyset como el feed; las siguientes las pide el navegador al hacer scroll
+    entradas, siguiente_cursor = await apaginar_por_cursor(entradas, request.GET.get('cursor'))
+    tarjetas = await arenderizar_tarjetas(entradas, usuario.id)
+    context = {"coleccion": coleccion, "tarjetas": tarjetas, "siguiente_cursor": siguiente_cursor}
+
+    # Con ?parcial=1 se devuelven solo las tarjetas nuevas para agregar al final de la lista
+    if request.GET.get('parcial'):
+        return render(request, 'app_bitacora/entradas_coleccion.html', context)
+    return render(request, 'app_bitacora/detalle_coleccion.html', context)
+
+@login_required
+def organizar_entradas(request):
+    # Agrega o quita las entradas marcadas en mis_entradas de las colecciones elegidas, en un solo POST
+    if request.method != "POST":
+        return redirect("bitacora:mis_entradas")
+
+    form = OrganizarEntradasForm(request.POST, usuario=request.user)
+    if not form.is_valid():
+        for errores in form.errors.values():
+            for error in errores:
+                messages.error(request, error)
+        return redirect("bitacora:mis_entradas")
+
+    colecciones = form.cleaned_data["colecciones"]
+    if form.cleaned_data["accion"] == ACCION_AGREGAR:
+        agregados, _ = actualizar_vinculos(request.user, form.cleaned_data["entradas"], agregar=colecciones)
+        messages.success(request, f"Se agregaron {agregados} entradas a las colecciones elegidas.")
+    else:
+        _, quitados = actualizar_vinculos(request.user, form.cleaned_data["entradas"], quitar=colecciones)
+        messages.success(request, f"Se quitaron {quitados} entradas de las colecciones elegidas.")
+    return redirect("bitacora:mis_entradas")
+
 @login_required()
 def agregar_coleccion(request):
     if request.method == 'POST':
@@ -389,3 +528,48 @@ def eliminar_coleccion(request, coleccion_id):
     # Si es GET, redirigir a la lista (en caso de intento directo en la URL)
     messages.warning(request, "No se ha confirmado la eliminación de la coleccion.")
     return redirect('bitacora:mis_colecciones')
+
+@login_required
+def importar_entradas(request):
+    resultado = None
+    if request.method == 'POST':
+        form = ImportarEntradasForm(request.POST, request.FILES)
+        if form.is_valid():
+            # El archivo ya esta en disco (ver subidas.py) y se lee de a una fila por vez
+            resultado = importacion.importar_entradas(request.user, form.cleaned_data['archivo_importacion'],
+                                                      form.cleaned_data['formato'])
+            messages.success(request, f"Se importaron {resultado['importadas']} entradas "
+                                      f"({resultado['filas_por_segundo']} filas por segundo).")
+            if resultado['cantidad_errores']:
+                messages.error(request, f"{resultado['cantidad_errores']} filas tenían errores y no se importaron.")
+    else:
+        form = ImportarEntradasForm()
+    return render(request, 'app_bitacora/importar_entradas.html', {'form': form, 'resultado': resultado})
+
+@login_required
+def exportar_entradas(request):
+    formato = importacion.FORMATO_CSV if request.GET.get('formato') == importacion.FORMATO_CSV else importacion.FORMATO_JSONL
+    # Las lineas se generan y se envian de a una, sin armar el archivo completo en memoria
+    respuesta = StreamingHttpResponse(
+        importacion.exportar_entradas(request.user, formato),
+        content_type='text/csv; charset=utf-8' if formato == importacion.FORMATO_CSV else 'application/x-ndjson; charset=utf-8',
+    )
+    respuesta['Content-Disposition'] = f'attachment; filename="bitacora-{request.user.username}.{formato}"'
+    return respuesta
+
+@staff_member_required
+def estadisticas_cache_fragmentos(request):
+    return JsonResponse(estadisticas_cache())
+
+@staff_member_required
+def estadisticas_subidas_imagenes(request):
+    return JsonResponse(estadisticas_subidas())
+
+def metricas_prometheus(request):
+    # Prometheus se identifica con el token de BITACORA_METRICAS_TOKEN, una persona con una sesion de staff
+    token = settings.BITACORA_METRICAS_TOKEN
+    autorizacion = request.headers.get('Authorization', '')
+    con_token = bool(token) and hmac.compare_digest(autorizacion.encode(), f'Bearer {token}'.encode())
+    if not con_token and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(exportar_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
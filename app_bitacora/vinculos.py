@@ -0,0 +1,42 @@
+from django.db import transaction
+
+from .models import Entrada, EntradaColeccion
+from .cache import invalidar_fragmentos_usuario
+from .contadores import sumar_vinculos
+
+def actualizar_vinculos(usuario, entrada_ids, agregar=(), quitar=()):
+    '''
+        Agrega las entradas a las colecciones de "agregar" y las quita de las de "quitar", todo sobre la tabla
+        intermedia: una consulta para ver que vinculos ya existen, un solo INSERT con los que faltan y un solo
+        DELETE con los que sobran, sin importar cuantas entradas sean. Solo se tocan entradas y colecciones del
+        usuario. Devuelve la cantidad de vinculos agregados y quitados.
+    '''
+    agregar, quitar = set(agregar), set(quitar) - set(agregar)
+    if not entrada_ids or not (agregar or quitar):
+        return 0, 0
+
+    with transaction.atomic():
+        entrada_ids = set(Entrada.objects.filter(usuario=usuario, id__in=entrada_ids).values_list('id', flat=True))
+        existentes = set(EntradaColeccion.objects
+                         .filter(entrada_id__in=entrada_ids, coleccion_id__in=agregar | quitar, coleccion__usuario=usuario)
+                         .values_list('entrada_id', 'coleccion_id'))
+        if agregar:
+            # Las colecciones que no son del usuario se descartan aca (las existentes ya vienen filtradas)
+            agregar &= set(usuario.coleccion_set.filter(id__in=agregar).values_list('id', flat=True))
+        nuevos = [(entrada_id, coleccion_id) for entrada_id in entrada_ids for coleccion_id in agregar
+                  if (entrada_id, coleccion_id) not in existentes]
+        sobrantes = [(entrada_id, coleccion_id) for entrada_id, coleccion_id in existentes if coleccion_id in quitar]
+
+        # bulk_create y el DELETE no envian m2m_changed, asi que los contadores se actualizan aca
+        if nuevos:
+            # ignore_conflicts por si otro request agrego el mismo vinculo en el medio
+            EntradaColeccion.objects.bulk_create([EntradaColeccion(entrada_id=entrada_id, coleccion_id=coleccion_id)
+                                                  for entrada_id, coleccion_id in nuevos], ignore_conflicts=True)
+            sumar_vinculos(nuevos)
+        if sobrantes:
+            EntradaColeccion.objects.filter(entrada_id__in={entrada_id for entrada_id, _ in sobrantes},
+                                            coleccion_id__in={coleccion_id for _, coleccion_id in sobrantes}).delete()
+            sumar_vinculos(sobrantes, -1)
+    if nuevos or sobrantes:
+        invalidar_fragmentos_usuario(usuario.id)
+    return len(nuevos), len(sobrantes)
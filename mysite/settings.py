@@ -9,8 +9,11 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import importlib.util
 import os
+import sys
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Cargar variables desde archivo .env
@@ -42,10 +45,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
+    # Primero, asi la latencia medida incluye a todos los demas middlewares
+    'app_bitacora.metricas.MetricasMiddleware',
+    'app_bitacora.consultas.DetectorConsultasMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Antes que la sesion, para enterarse tambien de las escrituras que hace al guardarla
+    'app_bitacora.replicas.ReplicasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,7 +67,8 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, midiendo el tiempo de renderizado para las metricas (ver app_bitacora/metricas.py)
+        'BACKEND': 'app_bitacora.metricas.PlantillasMedidas',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,7 +90,8 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Por defecto PostgreSQL. Con DB_ENGINE=django.db.backends.sqlite3 se pueden correr los tests localmente
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
@@ -89,6 +100,82 @@ DATABASES = {
     }
 }
 
+# Conexiones a PostgreSQL. Con DB_POOL=True (por defecto) cada proceso del servidor tiene su propio pool de psycopg
+# de DB_POOL_MIN a DB_POOL_MAX conexiones: DB_POOL_MAX conviene que sea la cantidad de hilos de cada worker, y
+# workers x DB_POOL_MAX tiene que quedar por debajo de max_connections del servidor. Con DB_POOL=False se usan
+# conexiones persistentes por hilo (DB_CONN_MAX_AGE segundos, solo sirven bajo WSGI). En los dos casos
+# DB_CONN_HEALTH_CHECKS verifica la conexion antes de reutilizarla. Ver "python manage.py bench_conexiones"
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+    if os.getenv('DB_POOL', 'True') == 'True':
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN', '2')),
+                'max_size': int(os.getenv('DB_POOL_MAX', '10')),
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),  # Espera maxima por una conexion libre
+                'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '300')),  # Se cierran las que sobran hace tanto
+                'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),  # Y todas se renuevan cada tanto
+            },
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+# Replicas de solo lectura (ver app_bitacora/replicas.py). DB_REPLICAS=host1,host2 agrega una conexion por host con
+# la misma base, usuario y clave que la principal. Con SQLite cada valor es la ruta de otro archivo, asi se puede
+# simular una replica en los tests (DB_REPLICAS=/tmp/replica.sqlite3)
+for numero, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        DATABASES[f'replica{numero}'] = {**DATABASES['default'], 'NAME': replica.strip()}
+    else:
+        # En los tests se usa la base de pruebas de la principal, la replica real puede ser de solo lectura
+        DATABASES[f'replica{numero}'] = {**DATABASES['default'], 'HOST': replica.strip(), 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['app_bitacora.replicas.RouterReplicas']
+# SQLite no replica, sus "replicas" solo existen para los tests (que las activan con override_settings)
+BITACORA_REPLICAS = [alias for alias, base in DATABASES.items() if alias != 'default' and not base['ENGINE'].endswith('sqlite3')]
+# Segundos que un usuario lee de la principal despues de escribir, y retraso maximo aceptado en una replica
+BITACORA_PRIMARIA_TRAS_ESCRIBIR = int(os.getenv('PRIMARIA_TRAS_ESCRIBIR', '10'))
+BITACORA_REPLICA_RETRASO_MAXIMO = float(os.getenv('REPLICA_RETRASO_MAXIMO', '5'))
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# LocMem por defecto (desarrollo y tests). En produccion se puede usar memcached o redis, por ejemplo
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache y CACHE_LOCATION=redis://127.0.0.1:6379
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    # Intentos fallidos de inicio de sesion (ver app_bitacora/acceso.py). Es local a cada proceso a proposito:
+    # se consulta antes de cada login y no puede depender de que responda un servidor de cache
+    'login': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bitacora-login',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
+# Sesiones (SESSION_BACKEND): con cached_db cada request autenticado lee la sesion del cache y solo va a la base
+# si no la encuentra; con signed_cookies la sesion viaja firmada en la cookie y no se lee ni escribe nada (pero no
+# se puede invalidar del lado del servidor: un logout solo borra la cookie). cached_db es el modo por defecto
+# cuando el cache es compartido; con LocMem cada proceso tiene su copia y un logout en un worker no llegaria a
+# los demas, asi que por defecto se usa db
+MOTORES_SESION = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+cache_local = CACHES['default']['BACKEND'].endswith('LocMemCache')
+motor_sesion = os.getenv('SESSION_BACKEND', 'db' if cache_local else 'cached_db')
+if motor_sesion not in MOTORES_SESION:
+    raise ImproperlyConfigured(f"SESSION_BACKEND={motor_sesion} no existe, las opciones son {', '.join(MOTORES_SESION)}.")
+SESSION_ENGINE = MOTORES_SESION[motor_sesion]
+
+# Los mensajes (messages.success, messages.error) viajan en una cookie y no en la sesion: mostrarlos no cuesta
+# escrituras en django_session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -107,6 +194,38 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Hasheo de contraseñas (ver app_bitacora/hashers.py). PASSWORD_HASHER elige con que algoritmo se guardan las
+# contraseñas: pbkdf2, scrypt o argon2 (necesita argon2-cffi). Los otros se siguen usando para verificar, y la
+# contraseña se vuelve a hashear con el elegido (o con el costo nuevo) la proxima vez que el usuario inicia sesion
+BITACORA_PBKDF2_ITERACIONES = int(os.getenv('PBKDF2_ITERACIONES', '870000'))
+BITACORA_SCRYPT_WORK_FACTOR = int(os.getenv('SCRYPT_WORK_FACTOR', str(2 ** 14)))
+BITACORA_ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '2'))
+BITACORA_ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', '102400'))  # En KiB
+BITACORA_ARGON2_PARALELISMO = int(os.getenv('ARGON2_PARALELISMO', '8'))
+hashers = {
+    'pbkdf2': 'app_bitacora.hashers.PBKDF2Configurable',
+    'scrypt': 'app_bitacora.hashers.ScryptConfigurable',
+}
+if importlib.util.find_spec('argon2'):
+    hashers['argon2'] = 'app_bitacora.hashers.Argon2Configurable'
+hasher_elegido = os.getenv('PASSWORD_HASHER', 'pbkdf2')
+if hasher_elegido not in hashers:
+    raise ImproperlyConfigured(f"PASSWORD_HASHER={hasher_elegido} no esta disponible, las opciones son {', '.join(hashers)}.")
+PASSWORD_HASHERS = [hashers.pop(hasher_elegido), *hashers.values(), 'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Limite de intentos de inicio de sesion por nombre de usuario desde cada IP y por IP (este solo para los intentos
+# que fallan): despues de los intentos libres cada intento duplica la espera, desde LOGIN_ESPERA_INICIAL hasta
+# LOGIN_ESPERA_MAXIMA segundos. Los fallos se olvidan LOGIN_VENTANA segundos despues del primero.
+# Detras de un proxy, IP_HEADER es el header con la IP del cliente (ej. HTTP_X_FORWARDED_FOR) y PROXIES_CONFIABLES
+# cuantos proxies propios la agregan; sin IP_HEADER se usa REMOTE_ADDR
+BITACORA_LOGIN_INTENTOS_USUARIO = int(os.getenv('LOGIN_INTENTOS_USUARIO', '5'))
+BITACORA_LOGIN_INTENTOS_IP = int(os.getenv('LOGIN_INTENTOS_IP', '20'))
+BITACORA_LOGIN_ESPERA_INICIAL = float(os.getenv('LOGIN_ESPERA_INICIAL', '1'))
+BITACORA_LOGIN_ESPERA_MAXIMA = float(os.getenv('LOGIN_ESPERA_MAXIMA', str(15 * 60)))
+BITACORA_LOGIN_VENTANA = int(os.getenv('LOGIN_VENTANA', str(60 * 60)))
+BITACORA_IP_HEADER = os.getenv('IP_HEADER', '')
+BITACORA_PROXIES_CONFIABLES = int(os.getenv('PROXIES_CONFIABLES', '1'))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -136,4 +255,45 @@ LOGIN_URL = '/bitacora/iniciar_sesion'
 
 # para manejar las imagenes de la pagina
 MEDIA_URL = '/media/' # URL para acceder a los archivos multimedia
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media') # Ruta en el sistema de archivos donde se almacenan
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media') # Ruta en el sistema de archivos donde se almacenan
+
+# Los archivos subidos se guardan por el hash de su contenido (sin duplicados, ver app_bitacora/almacenamiento.py)
+STORAGES = {
+    'default': {
+        'BACKEND': 'app_bitacora.almacenamiento.AlmacenamientoPorContenido',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Procesamiento de las imagenes subidas (versiones redimensionadas en segundo plano, ver app_bitacora/imagenes.py)
+BITACORA_IMAGENES_WORKERS = int(os.getenv('IMAGENES_WORKERS', '2'))
+BITACORA_IMAGENES_SINCRONO = os.getenv('IMAGENES_SINCRONO', 'False') == 'True'
+
+# Las subidas se escriben a disco de a pedazos y se cortan apenas superan el tamanio maximo (ver app_bitacora/subidas.py)
+FILE_UPLOAD_HANDLERS = ['app_bitacora.subidas.SubidaEnDiscoHandler']
+BITACORA_IMAGEN_TAMANIO_MAXIMO = int(os.getenv('IMAGEN_TAMANIO_MAXIMO', str(10 * 1024 * 1024)))
+BITACORA_IMAGEN_LADO_MAXIMO = int(os.getenv('IMAGEN_LADO_MAXIMO', '8000'))
+BITACORA_IMAGEN_PIXELES_MAXIMOS = int(os.getenv('IMAGEN_PIXELES_MAXIMOS', '40000000'))
+BITACORA_IMPORTACION_TAMANIO_MAXIMO = int(os.getenv('IMPORTACION_TAMANIO_MAXIMO', str(200 * 1024 * 1024)))
+
+# Feed en vivo (SSE): con FEED_NOTIFY=True los avisos pasan por LISTEN/NOTIFY de PostgreSQL y llegan a todos
+# los procesos del servidor, no solo al que guardo la entrada (ver app_bitacora/tiempo_real.py)
+BITACORA_FEED_NOTIFY = os.getenv('FEED_NOTIFY', 'False') == 'True'
+
+# Metricas por vista (ver app_bitacora/metricas.py): proporcion de requests que se miden, si se envia el header
+# Server-Timing y el token con el que Prometheus lee /bitacora/metricas (sin token solo la ve el staff). El header
+# muestra cuantas consultas hace cada vista y cuanto tarda cada etapa a cualquier visitante, por eso se activa
+# solo para depurar
+BITACORA_METRICAS_MUESTREO = float(os.getenv('METRICAS_MUESTREO', '0.1'))
+BITACORA_SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+BITACORA_METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+
+# Detector de consultas repetidas (N+1) y lentas (ver app_bitacora/consultas.py). En modo estricto, que es el
+# de los tests, se revisan todos los requests y una consulta repetida es un error (las lentas solo se loguean, su
+# tiempo depende de la carga de la maquina); si no se loguea y se ve con perf_report
+BITACORA_CONSULTAS_ESTRICTO = os.getenv('CONSULTAS_ESTRICTO', str(sys.argv[1:2] == ['test'])) == 'True'
+BITACORA_CONSULTAS_MUESTREO = float(os.getenv('CONSULTAS_MUESTREO', '0.05'))
+BITACORA_CONSULTAS_REPETIDAS_MAXIMO = int(os.getenv('CONSULTAS_REPETIDAS_MAXIMO', '5'))
+BITACORA_CONSULTA_LENTA_MS = float(os.getenv('CONSULTA_LENTA_MS', '200'))